@@ -24,67 +24,576 @@ SOFTWARE.
 """
 
 import datetime
-from collections import defaultdict
-from typing import List, Tuple
+import math
+import uuid
+from collections import defaultdict, namedtuple
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 from flask_sqlalchemy import BaseQuery, Model, SQLAlchemy
-from sqlalchemy import desc, func, and_
+from sqlalchemy import String, asc, case, cast, desc, exc, func, literal, null, select, text
+from sqlalchemy.orm import aliased
+
+from . import meta
+from .buckets import auto_granularity, bucket_range, label, parse_bucket, sql_bucket, zero_filled
+from .ddsketch import MIN_VALUE, PERCENTILES, DDSketch
+from .heavy_hitters import top_with_other
+from .interning import NORMALIZED_COLUMNS, Interner
+from .partitions import Partitions
+from .rollups import DIMENSIONS, Rollups, sorted_breakdown
+from .sampling import SamplingPolicy, error_bounds, unique_visitor_estimates
+from .sketches import LatencySketches, TopValueSketches, UniqueVisitorSketches
+
+# Meta table key of a value which changes whenever hits dated before today are written
+LATE_WRITE_KEY = "late_write_watermark"
+
+# response_time_count: number of timed hits, for merging the averages of several ranges
+RouteRow = namedtuple("RouteRow", ["path", "hits", "unique_hits", "last_requested", "average_response_time",
+                                   "response_time_count"], defaults=(None,))
+
+
+# Filter operators of get_requests_page, as used by Dash DataTable filter queries
+FILTER_OPERATORS = {
+    "=": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "contains": lambda column, value: cast(column, String).contains(str(value)),
+    "datestartswith": lambda column, value: cast(column, String).startswith(str(value)),
+}
+
+
+def date_bounds(
+        start_date: datetime.date,
+        end_date: datetime.date
+) -> Tuple[datetime.datetime, datetime.datetime]:
+    """ Half open range [lower, upper) of a date range. Dates include the whole day. """
+    if isinstance(start_date, datetime.datetime):
+        lower = start_date
+    else:
+        lower = datetime.datetime.combine(start_date, datetime.time.min)
+
+    if isinstance(end_date, datetime.datetime):
+        upper = end_date
+    else:
+        upper = datetime.datetime.combine(end_date, datetime.time.min) + datetime.timedelta(days=1)
+
+    return lower, upper
 
 
 class StatisticsQueries:
-    def __init__(self, db: SQLAlchemy, model: Model):
+    def __init__(self, db: SQLAlchemy, model: Model, rollups: Rollups = None,
+                 unique_sketches: UniqueVisitorSketches = None, partitions: Partitions = None,
+                 interner: Interner = None, latency_sketches: LatencySketches = None,
+                 sampling: SamplingPolicy = None, exclude_bots: bool = False,
+                 top_value_sketches: TopValueSketches = None, meta_model: Model = None):
+        """ :param interner: lookup table of the NORMALIZED_COLUMNS, if the hits table stores them as ids
+            :param latency_sketches: response time sketches answering the percentile queries, if enabled
+            :param top_value_sketches: heavy hitter summaries answering the top value queries, if enabled
+            :param sampling: policy the hits are recorded with, if they are sampled. Counts and averages are then
+                             estimated from the sample weights of the hits.
+            :param exclude_bots: leave hits flagged as bots out of every query
+            :param meta_model: meta table holding the late write watermark
+        """
         self.db = db
         self.model = model
+        self.rollups = rollups
+        self.unique_sketches = unique_sketches
+        self.latency_sketches = latency_sketches
+        self.top_value_sketches = top_value_sketches
+        self.partitions = partitions
+        self.interner = interner
+        self.sampling = sampling
+        self.weighted = sampling is not None
+        self.exclude_bots = exclude_bots
+        self.meta_model = meta_model
+        # Whether the database has the ln function, None until checked
+        self._logarithms = None
+
+    def _source(
+            self,
+            start_date: datetime.date = None,
+            end_date: datetime.date = None
+    ):
+        """ Entity to query the hits of a date range with: the model, or the partitions overlapping the range """
+        if self.partitions is None:
+            return self.model
+        if start_date is None or end_date is None:
+            return self.partitions.source()
+        return self.partitions.source(*date_bounds(start_date, end_date))
+
+    def _rollup_bucket_size(
+            self,
+            start_date: datetime.date,
+            end_date: datetime.date
+    ):
+        """ Bucket size of the rollups which can answer a query for this range, None if the raw table is needed """
+        if self.rollups is None or start_date is None or end_date is None:
+            return None
+        return self.rollups.bucket_size_for(*date_bounds(start_date, end_date))
+
+    def _use_unique_sketches(
+            self,
+            start_date: datetime.date,
+            end_date: datetime.date,
+            exact: bool
+    ) -> bool:
+        """ Whether unique visitors of this range can be estimated with the HyperLogLog sketches """
+        if exact or self.unique_sketches is None or start_date is None or end_date is None:
+            return False
+        return self.unique_sketches.covers_range(*date_bounds(start_date, end_date))
+
+    def _use_latency_sketches(
+            self,
+            start_date: datetime.date,
+            end_date: datetime.date
+    ) -> bool:
+        """ Whether response time percentiles of this range can be read from the quantile sketches """
+        if self.latency_sketches is None or start_date is None or end_date is None:
+            return False
+        return self.latency_sketches.covers_range(*date_bounds(start_date, end_date))
+
+    def _use_top_value_sketches(
+            self,
+            column_name: str,
+            start_date: datetime.date,
+            end_date: datetime.date
+    ) -> bool:
+        """ Whether the top values of a column in this range can be read from the heavy hitter summaries """
+        if (self.top_value_sketches is None or column_name not in self.top_value_sketches.column_names or
+                start_date is None or end_date is None):
+            return False
+        return self.top_value_sketches.covers_range(*date_bounds(start_date, end_date))
+
+    def _weight(self, source):
+        """ Sample weight of the hits, hits recorded without sampling count once """
+        return func.coalesce(source.sample_weight, 1.0)
+
+    def _hits(self, source, column=None):
+        """ Aggregate counting the hits (with a value in column): the sum of their weights if hits are sampled """
+        if not self.weighted:
+            return func.count(source.index if column is None else column)
+        weight = self._weight(source)
+        return func.sum(weight if column is None else case([(column.isnot(None), weight)]))
+
+    def _average(self, source, column):
+        """ Aggregate averaging a column, weighted by the sample weights if hits are sampled """
+        if not self.weighted:
+            return func.avg(column)
+        weight = self._weight(source)
+        return func.sum(column * weight) / func.nullif(func.sum(case([(column.isnot(None), weight)])), 0)
+
+    def _visitors(
+            self,
+            start_date: datetime.date,
+            end_date: datetime.date,
+            path: str = None,
+            group=None
+    ):
+        """ Subquery with a row per visitor (and group) for sampling.error_bounds and
+            sampling.unique_visitor_estimates
+
+            :param group: function of the source and its date column returning an sql expression to group by
+        """
+        source = self._source(start_date, end_date)
+        weight = self._weight(source)
+        keys = [source.remote_address] if group is None else [group(source, source.date).label("key"),
+                                                               source.remote_address]
+        query = self.db.session.query(*keys,
+                                      func.sum(weight).label("hits"),
+                                      func.sum(weight * weight).label("squared_weights"),
+                                      func.max(1 / weight).label("sample_rate"),
+                                      func.max(weight).label("max_weight"))
+        query = self._add_date_filter_to_query(query,
+                                               start_date,
+                                               end_date,
+                                               source)
+        if path is not None:
+            query = query.filter(source.path == self._encoded("path", path))
+        return query.group_by(*keys).subquery()
+
+    def _new_latency_sketch(self) -> DDSketch:
+        return DDSketch() if self.latency_sketches is None else self.latency_sketches.new_sketch()
+
+    def _has_logarithms(self) -> bool:
+        """ Whether the database can compute the bins of the latency sketches, SQLite only with its math functions """
+        if self._logarithms is None:
+            self._logarithms = self._dialect() != "sqlite"
+            if not self._logarithms:
+                try:
+                    with self.engine().connect() as connection:
+                        connection.execute(text("SELECT ceil(ln(2.0))"))
+                    self._logarithms = True
+                except exc.OperationalError:
+                    pass
+        return self._logarithms
+
+    def _response_time_sketches(
+            self,
+            start_date: datetime.date,
+            end_date: datetime.date,
+            group=None,
+            path: str = None
+    ) -> Dict[object, DDSketch]:
+        """ Quantile sketches of the response times of the hits in a range, computed from the hits. The database
+            counts the hits per bin of the sketches if it has logarithms, otherwise the response times are read in
+            chunks. Either way only the bins are held in memory.
+
+            :param group: function of the source returning an sql expression to group by, default: one group None
+        """
+        source = self._source(start_date, end_date)
+        keys = [] if group is None else [group(source)]
+        group_by = null() if group is None else keys[0]
+        response_time = source.response_time
+        # Sketches count every hit round(sample weight) times
+        count = func.round(self._weight(source)) if self.weighted else literal(1)
+
+        if self._has_logarithms():
+            log_gamma = math.log(self._new_latency_sketch().gamma)
+            key = case([(response_time <= MIN_VALUE, null())], else_=func.ceil(func.ln(response_time) / log_gamma))
+            query = self.db.session.query(group_by, key, func.sum(count), func.sum(response_time * count),
+                                          func.min(response_time), func.max(response_time))
+        else:
+            query = self.db.session.query(group_by, response_time, count)
+        query = self._add_date_filter_to_query(query.filter(response_time.isnot(None)),
+                                               start_date,
+                                               end_date,
+                                               source)
+        if path is not None:
+            query = query.filter(source.path == self._encoded("path", path))
+
+        sketches = defaultdict(self._new_latency_sketch)
+        if self._has_logarithms():
+            for group_key, key, hits, total, minimum, maximum in query.group_by(*keys, key).all():
+                sketches[group_key].add_bin(None if key is None else int(key), int(hits), total, minimum, maximum)
+            return dict(sketches)
+
+        rows = iter(query.yield_per(10000))
+        for chunk in iter(lambda: list(islice(rows, 10000)), []):
+            response_times = defaultdict(list)
+            weights = defaultdict(list)
+            for group_key, value, weight in chunk:
+                response_times[group_key].append(value)
+                weights[group_key].append(weight)
+            for group_key, values in response_times.items():
+                sketches[group_key].add_many(values, weights[group_key] if self.weighted else None)
+        return dict(sketches)
+
+    def _is_normalized(self, column_name: str) -> bool:
+        return self.interner is not None and column_name in NORMALIZED_COLUMNS
+
+    def _encoded(self, column_name: str, value):
+        """ A value as stored in the hits table: the id of values of normalized columns, -1 if it has none """
+        if not self._is_normalized(column_name) or value is None:
+            return value
+        return self.interner.ids(column_name, [value], create=False).get(value, -1)
+
+    def decode(self, column_name: str, values: list) -> list:
+        """ Values of a column read from the hits table as they were written """
+        if not self._is_normalized(column_name):
+            return list(values)
+        return self.interner.decode(values)
+
+    def decode_rows(self, column_names: List[str], rows) -> List[tuple]:
+        """ Rows of the given columns read from the hits table as they were written """
+        columns = list(zip(*rows))
+        if not columns:
+            return []
+        return list(zip(*[self.decode(column_name, values) for column_name, values in zip(column_names, columns)]))
+
+    def engine(self):
+        """ Engine of the bind holding the hits table """
+        return self.db.get_engine(bind=self.model.__table__.info.get("bind_key"))
+
+    def _dialect(self) -> str:
+        return self.engine().dialect.name
 
     def _add_date_filter_to_query(
             self,
             query: BaseQuery,
             start_date: datetime.datetime,
-            end_date: datetime.datetime
+            end_date: datetime.datetime,
+            source=None
     ) -> BaseQuery:
-        # unsure if this works
-        return query.filter(and_(func.date(self.model.date) >= start_date),
-                            func.date(self.model.date) <= end_date)
+        # Compare the raw column with a half open range, so that the index on date can be used
+        source = self.model if source is None else source
+        lower, upper = date_bounds(start_date, end_date)
+        return self._filter_hits(query.filter(source.date >= lower,
+                                              source.date < upper), source)
+
+    def _filter_hits(self, query: BaseQuery, source=None) -> BaseQuery:
+        """ Leave out the hits no query counts, i.e. bots if they are excluded """
+        source = self.model if source is None else source
+        if self.exclude_bots:
+            # Hits stored before the bot stage are NULL, i.e. not bots
+            query = query.filter(source.is_bot.isnot(True))
+        return query
+
+    def get_write_watermark(self):
+        """ Changes whenever hits were written, used to invalidate cached results """
+        if self.partitions is not None:
+            return self.partitions.latest_index()
+        return self.db.session.query(func.max(self.model.index)).scalar() or 0
+
+    def get_late_write_watermark(self) -> str:
+        """ Changes whenever hits dated before today were written, used to invalidate cached results of past ranges """
+        if self.meta_model is None:
+            return ""
+        return meta.get_value(self.db.session, self.meta_model, LATE_WRITE_KEY, "")
+
+    def initialize_late_write_watermark(self) -> None:
+        """ Store the late write watermark, so that the writer hook only ever updates its row """
+        if self.meta_model is not None and self.get_late_write_watermark() == "":
+            meta.set_value(self.db.session, self.meta_model, LATE_WRITE_KEY, uuid.uuid4().hex)
+            self.db.session.commit()
+
+    def late_write_hook(self, session, rows: List[dict]) -> None:
+        """ Writer batch hook, changes the late write watermark if a row is dated before today (e.g. imported hits
+            or the hits of a buffer flushed after midnight)
+        """
+        today = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+        if self.meta_model is not None and any(row.get("date") is not None and row["date"] < today for row in rows):
+            meta.set_value(session, self.meta_model, LATE_WRITE_KEY, uuid.uuid4().hex)
+
+    def get_first_date(self) -> datetime.datetime:
+        """ Date of the oldest recorded hit """
+        source = self._source()
+        return self.db.session.query(func.min(source.date)).scalar()
 
     def get_number_of_unique_visitors(
             self,
             start_date: datetime.datetime,
-            end_date: datetime.datetime
+            end_date: datetime.datetime,
+            exact: bool = False
     ) -> int:
-        query = (self.db.session.query(self.model)
-                 .group_by(self.model.remote_address))
+        """ :param exact: count distinct ip addresses even if sketches or the rollups could estimate the number """
+        if self._use_unique_sketches(start_date, end_date, exact):
+            return self.unique_sketches.count(*date_bounds(start_date, end_date))
+
+        if self.weighted:
+            return unique_visitor_estimates(self.db.session, self._visitors(start_date, end_date))[None]
+        bucket_size = None if exact else self._rollup_bucket_size(start_date, end_date)
+        if bucket_size is not None:
+            return self.rollups.get_number_of_unique_visitors(*date_bounds(start_date, end_date), bucket_size)
+
+        source = self._source(start_date, end_date)
+        query = self.db.session.query(func.count(source.remote_address.distinct()))
 
         query = self._add_date_filter_to_query(query,
                                                start_date,
-                                               end_date)
+                                               end_date,
+                                               source)
 
-        return query.count()
+        return query.scalar()
 
-    def get_statistic_data(self, column_name):
-        """ Returns the available labels of a db column with the according frequency """
-        query = self.db.session.query(getattr(self.model, column_name), func.count(getattr(self.model, column_name))).\
-            group_by(getattr(self.model, column_name)).order_by(desc(column_name))
-        data_labels, data_values = map(list, zip(*query.all()))
+    def get_statistic_data(self, column_name, start_date=None, end_date=None):
+        """ Returns the available labels of a db column with the according frequency, optionally within a date range """
+        bucket_size = self._rollup_bucket_size(start_date, end_date)
+        if bucket_size is not None and column_name in DIMENSIONS:
+            return self.rollups.get_statistic_breakdowns([column_name], *date_bounds(start_date, end_date),
+                                                         bucket_size)[column_name]
+
+        source = self._source(start_date, end_date)
+        query = self.db.session.query(getattr(source, column_name),
+                                      self._hits(source, getattr(source, column_name))).\
+            group_by(getattr(source, column_name)).order_by(desc(getattr(source, column_name)))
+        if start_date is not None and end_date is not None:
+            query = self._add_date_filter_to_query(query, start_date, end_date, source)
+        else:
+            query = self._filter_hits(query, source)
+        rows = query.all()
+        if not rows:
+            return [], []
+        data_labels, data_values = map(list, zip(*rows))
+        # The sum of the weights of the None label is NULL
+        data_values = [round(value or 0) for value in data_values]
+        if self._is_normalized(column_name):
+            # Ordered by id, not by value
+            return sorted_breakdown(dict(zip(self.decode(column_name, data_labels), data_values)))
         return data_labels, data_values
 
+    def get_statistic_breakdowns(
+            self,
+            column_names: List[str],
+            start_date: datetime.datetime = None,
+            end_date: datetime.datetime = None
+    ) -> Dict[str, Tuple[list, list]]:
+        """ get_statistic_data of several columns at once: {column_name: (labels, frequencies)}.
+            The raw table is scanned only once, grouping by all columns and summing up per column afterwards.
+        """
+        bucket_size = self._rollup_bucket_size(start_date, end_date)
+        if bucket_size is not None and all(column_name in DIMENSIONS for column_name in column_names):
+            return self.rollups.get_statistic_breakdowns(column_names, *date_bounds(start_date, end_date),
+                                                         bucket_size)
+
+        source = self._source(start_date, end_date)
+        columns = [getattr(source, column_name) for column_name in column_names]
+        query = self.db.session.query(*columns, self._hits(source)).group_by(*columns)
+        if start_date is not None and end_date is not None:
+            query = self._add_date_filter_to_query(query, start_date, end_date, source)
+        else:
+            query = self._filter_hits(query, source)
+
+        counts = {column_name: defaultdict(int) for column_name in column_names}
+        for row in query.all():
+            for column_name, value in zip(column_names, row):
+                counts[column_name][value] += row[-1]
+
+        return {column_name: sorted_breakdown(dict(zip(self.decode(column_name, list(counts[column_name])),
+                                                       map(round, counts[column_name].values()))))
+                for column_name in column_names}
+
+    def get_top_values(
+            self,
+            column_name: str,
+            start_date: datetime.datetime = None,
+            end_date: datetime.datetime = None,
+            k: int = 10,
+            exact: bool = False
+    ) -> Tuple[list, list]:
+        """ Labels and frequencies of the k most frequent values of a column, most frequent first, followed by
+            heavy_hitters.OTHER with the frequency of all other values. Read from the heavy hitter summaries (which
+            may undercount each value by a bounded amount), the rollups or an sql query with a LIMIT. Hits without a
+            value aren't counted, like in get_statistic_data.
+
+            :param exact: count the values exactly even if summaries could estimate them
+        """
+        if not exact and self._use_top_value_sketches(column_name, start_date, end_date):
+            return self.top_value_sketches.top(column_name, *date_bounds(start_date, end_date), k)
+
+        bucket_size = self._rollup_bucket_size(start_date, end_date)
+        if bucket_size is not None and column_name in DIMENSIONS:
+            labels, values = self.get_statistic_data(column_name, start_date, end_date)
+            return top_with_other(list(zip(labels, values)), sum(values), k)
+
+        source = self._source(start_date, end_date)
+        column = getattr(source, column_name)
+        query = (self.db.session.query(column, self._hits(source, column).label("hits"))
+                 .filter(column.isnot(None))
+                 .group_by(column))
+        total = self.db.session.query(self._hits(source, column))
+        if start_date is not None and end_date is not None:
+            query = self._add_date_filter_to_query(query, start_date, end_date, source)
+            total = self._add_date_filter_to_query(total, start_date, end_date, source)
+        else:
+            query = self._filter_hits(query, source)
+            total = self._filter_hits(total, source)
+
+        rows = self.decode_rows([column_name, "hits"], query.order_by(desc("hits")).limit(k).all())
+        return top_with_other(rows, total.scalar() or 0, k)
+
     def get_routes_data(
             self,
             start_date: datetime.datetime,
-            end_date: datetime.datetime
+            end_date: datetime.datetime,
+            exact: bool = False,
+            limit: int = None
     ) -> List:
-        query = (self.db.session.query(self.model.path,
-                                       func.count(self.model.path).label("hits"),
-                                       func.count(self.model.remote_address.distinct()).label("unique_hits"),
-                                       func.max(self.model.date).label("last_requested"),
-                                       func.avg(self.model.response_time).label("average_response_time"))
-                 .group_by(self.model.path)
-                 .order_by(desc("hits")))
+        """ :param exact: count unique hits exactly even if sketches or the rollups could estimate them
+            :param limit: only return this many of the most requested routes
+        """
+        use_sketches = self._use_unique_sketches(start_date, end_date, exact)
 
-        query = self._add_date_filter_to_query(query,
-                                               start_date,
-                                               end_date)
+        bucket_size = None if exact else self._rollup_bucket_size(start_date, end_date)
+        if bucket_size is not None:
+            routes = self.rollups.get_routes_data(*date_bounds(start_date, end_date), bucket_size, limit=limit)
+        else:
+            source = self._source(start_date, end_date)
+            unique_hits = (null() if use_sketches or self.weighted else
+                           func.count(source.remote_address.distinct()))
+            average_response_time = self._average(source, source.response_time)
+            query = (self.db.session.query(source.path,
+                                           self._hits(source, source.path).label("hits"),
+                                           unique_hits.label("unique_hits"),
+                                           func.max(source.date).label("last_requested"),
+                                           average_response_time.label("average_response_time"),
+                                           self._hits(source, source.response_time).label("response_time_count"))
+                     .group_by(source.path)
+                     .order_by(desc("hits")))
 
-        return query.all()
+            query = self._add_date_filter_to_query(query,
+                                                   start_date,
+                                                   end_date,
+                                                   source)
+
+            routes = query.limit(limit).all()
+            if self._is_normalized("path"):
+                paths = self.decode("path", [route.path for route in routes])
+                routes = [RouteRow(path, *route[1:]) for path, route in zip(paths, routes)]
+
+        unique_per_path = None
+        if use_sketches:
+            unique_per_path = self.unique_sketches.count_per_path(*date_bounds(start_date, end_date))
+        elif self.weighted:
+            estimates = unique_visitor_estimates(self.db.session, self._visitors(
+                start_date, end_date, group=lambda source, date: source.path))
+            unique_per_path = dict(zip(self.decode("path", list(estimates)), estimates.values()))
+        elif bucket_size is not None:
+            unique_per_path = self.rollups.unique_visitors_per_path(*date_bounds(start_date, end_date), bucket_size)
+
+        # Sums of weights are estimates
+        return [RouteRow(route.path, round(route.hits),
+                         route.unique_hits if unique_per_path is None else unique_per_path.get(route.path, 0),
+                         route.last_requested, route.average_response_time, route.response_time_count)
+                for route in routes]
+
+    def get_response_time_percentiles(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            path: str = None,
+            quantiles: Sequence[float] = PERCENTILES
+    ) -> List[Optional[float]]:
+        """ Response time percentiles in seconds of a path (default: all paths), None if no hit was timed """
+        if self._use_latency_sketches(start_date, end_date):
+            return self.latency_sketches.percentiles(*date_bounds(start_date, end_date), path, quantiles)
+
+        sketch = self._response_time_sketches(start_date, end_date, path=path).get(None)
+        return (sketch or self._new_latency_sketch()).quantiles(quantiles)
+
+    def get_route_percentiles(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            quantiles: Sequence[float] = PERCENTILES
+    ) -> Dict[str, List[Optional[float]]]:
+        """ {path: response time percentiles in seconds} of the paths with timed hits """
+        if self._use_latency_sketches(start_date, end_date):
+            return self.latency_sketches.percentiles_per_path(*date_bounds(start_date, end_date), quantiles)
+
+        sketches = self._response_time_sketches(start_date, end_date, lambda source: source.path)
+        paths = self.decode("path", list(sketches))
+        return {path: sketch.quantiles(quantiles) for path, sketch in zip(paths, sketches.values())}
+
+    def get_response_time_chart_data(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            path: str = None,
+            granularity: str = None,
+            quantiles: Sequence[float] = PERCENTILES
+    ) -> List[dict]:
+        """ Response time percentiles per bucket as a sorted list of {"x": bucket label, "y": [percentiles]},
+            the percentiles of buckets without timed hits are None
+
+            :param granularity: bucket width, one of buckets.GRANULARITIES. Default: chosen from the range length
+        """
+        lower, upper = date_bounds(start_date, end_date)
+        if granularity is None:
+            granularity = auto_granularity(lower, upper)
+
+        # Sketches are kept per day
+        if granularity in ("day", "week", "month") and self._use_latency_sketches(start_date, end_date):
+            return self.latency_sketches.percentiles_per_bucket(lower, upper, path, granularity, quantiles)
+
+        sketches = self._response_time_sketches(
+            start_date, end_date, lambda source: sql_bucket(source.date, granularity, self._dialect()), path)
+        sketches = {parse_bucket(bucket): sketch for bucket, sketch in sketches.items()}
+        empty = self._new_latency_sketch()
+        return [{"x": label(bucket, granularity), "y": sketches.get(bucket, empty).quantiles(quantiles)}
+                for bucket in bucket_range(lower, upper, granularity)]
 
     def get_requests_for_path(
             self,
@@ -92,42 +601,190 @@ class StatisticsQueries:
             start_date: datetime.datetime,
             end_date: datetime.datetime
     ) -> List:
-        query = (self.db.session.query(self.model)
-                 .filter(self.model.path == path)
-                 .order_by(self.model.date.desc()))
+        source = self._source(start_date, end_date)
+        query = (self.db.session.query(source)
+                 .filter(source.path == self._encoded("path", path))
+                 .order_by(source.date.desc()))
 
         query = self._add_date_filter_to_query(query,
                                                start_date,
-                                               end_date)
+                                               end_date,
+                                               source)
 
         return query.all()
 
-    def get_user_chart_data(
+    def get_requests_page(
             self,
+            path: str,
             start_date: datetime.datetime,
             end_date: datetime.datetime,
-            path: str = None,
-    ) -> Tuple[List[dict], List[dict]]:
-        query = (self.db.session.query(self.model.date,
-                                       self.model.remote_address))
+            columns: List[str],
+            page: int = 0,
+            page_size: int = 50,
+            sort_by: List[Tuple[str, bool]] = None,
+            filters: List[Tuple[str, str, str]] = None
+    ) -> Tuple[List[dict], int]:
+        """ One page of the requests of a path, selecting only the given columns
 
+            :param sort_by: list of (column name, descending). Default: newest first
+            :param filters: list of (column name, operator, value), see FILTER_OPERATORS.
+                            Unknown columns and operators are ignored.
+            :return: the rows as dicts and the total number of matching requests
+        """
+        source = self._source(start_date, end_date)
+        table_columns = {column.name: getattr(source, column.name) for column in self.model.__table__.columns}
+
+        query = self.db.session.query(source).filter(source.path == self._encoded("path", path))
         query = self._add_date_filter_to_query(query,
                                                start_date,
-                                               end_date)
+                                               end_date,
+                                               source)
+
+        for column_name, operator, value in filters or []:
+            if column_name not in table_columns or operator not in FILTER_OPERATORS:
+                continue
+            column = table_columns[column_name]
+            if self._is_normalized(column_name):
+                # Compare the values in the lookup table and filter on their ids
+                strings = self.interner.model
+                query = query.filter(column.in_(select(strings.id).where(
+                    strings.column_name == column_name, FILTER_OPERATORS[operator](strings.value, value))))
+                continue
+            if operator not in ("contains", "datestartswith"):
+                try:
+                    value = self.model.__table__.c[column_name].type.python_type(value)
+                except (TypeError, ValueError):
+                    pass
+            query = query.filter(FILTER_OPERATORS[operator](column, value))
+
+        total = query.with_entities(func.count(source.index)).scalar()
+
+        query = query.with_entities(*[table_columns[column_name] for column_name in columns])
+        order = []
+        for column_name, descending in sort_by or []:
+            if column_name not in table_columns:
+                continue
+            sort_column = table_columns[column_name]
+            if self._is_normalized(column_name):
+                # Sort by the values, joined for the rows of this query only
+                strings = aliased(self.interner.model)
+                query = query.outerjoin(strings, strings.id == sort_column)
+                sort_column = strings.value
+            order.append((desc if descending else asc)(sort_column))
+
+        query = (query.order_by(*(order or [source.date.desc()]))
+                 .limit(page_size)
+                 .offset(page * page_size))
+
+        return [dict(zip(columns, row)) for row in self.decode_rows(columns, query.all())], total
 
+    def export_columns(self) -> List[str]:
+        """ Columns iter_requests can select """
+        return [column.name for column in self.model.__table__.columns]
+
+    def iter_requests(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            columns: List[str],
+            path: str = None,
+            chunk_size: int = 10000
+    ) -> Iterator[List[tuple]]:
+        """ Chunks of up to chunk_size rows of the given columns of the hits in a range (of a path), oldest first.
+            Rows are streamed with a server side cursor where the database supports it, only one chunk is in memory.
+        """
+        source = self._source(start_date, end_date)
+        query = self.db.session.query(*[getattr(source, column) for column in columns])
+        query = self._add_date_filter_to_query(query,
+                                               start_date,
+                                               end_date,
+                                               source)
         if path is not None:
-            query = query.filter(self.model.path == path)
+            query = query.filter(source.path == self._encoded("path", path))
+
+        rows = iter(query.order_by(source.date).execution_options(stream_results=True).yield_per(chunk_size))
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield self.decode_rows(columns, chunk)
 
-        requests = query.all()
+    def get_user_chart_data(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            path: str = None,
+            granularity: str = None,
+            exact: bool = False
+    ) -> Tuple[List[dict], List[dict]]:
+        """ Hits and unique hits per bucket as sorted, zero filled lists of {"x": bucket label, "y": count}
+
+            :param granularity: bucket width, one of buckets.GRANULARITIES. Default: chosen from the range length
+            :param exact: count unique hits exactly even if sketches or the rollups could estimate them
+        """
+        lower, upper = date_bounds(start_date, end_date)
+        if granularity is None:
+            granularity = auto_granularity(lower, upper)
+
+        # Sketches are kept per day
+        use_sketches = (granularity in ("day", "week", "month") and
+                        self._use_unique_sketches(start_date, end_date, exact))
 
-        hits_dict = defaultdict(int)
-        unique_hits_dict = defaultdict(set)
+        bucket_size = None if exact else self._rollup_bucket_size(start_date, end_date)
+        if bucket_size == "day" and granularity in ("day", "week", "month"):
+            rollup_bucket_size = "day"
+        elif bucket_size is not None and granularity != "minute":
+            rollup_bucket_size = "hour"
+        else:
+            rollup_bucket_size = None
 
-        for req in requests:
-            hits_dict[str(req.date.date())] += 1
-            unique_hits_dict[str(req.date.date())].add(req.remote_address)
+        if rollup_bucket_size is not None:
+            hits, unique_hits = self.rollups.get_user_chart_data(lower, upper, path, granularity, rollup_bucket_size,
+                                                                 self._dialect(),
+                                                                 unique=not (use_sketches or self.weighted))
+        else:
+            source = self._source(start_date, end_date)
+            bucket = sql_bucket(source.date, granularity, self._dialect()).label("bucket")
+            unique_count = (null() if use_sketches or self.weighted else
+                            func.count(source.remote_address.distinct()))
+            query = (self.db.session.query(bucket,
+                                           self._hits(source),
+                                           unique_count)
+                     .group_by(bucket))
 
-        hits = [{"x": date, "y": count} for date, count in hits_dict.items()]
-        unique_hits = [{"x": date, "y": len(ip_set)} for date, ip_set in unique_hits_dict.items()]
+            query = self._add_date_filter_to_query(query,
+                                                   start_date,
+                                                   end_date,
+                                                   source)
+
+            if path is not None:
+                query = query.filter(source.path == self._encoded("path", path))
+
+            rows = query.all()
+
+            hits = zero_filled(((row[0], round(row[1])) for row in rows), lower, upper, granularity)
+            unique_hits = zero_filled(((row[0], row[2]) for row in rows), lower, upper, granularity)
+
+        if use_sketches:
+            unique_hits = self.unique_sketches.count_per_bucket(lower, upper, path, granularity)
+        elif self.weighted:
+            visitors = self._visitors(start_date, end_date, path,
+                                      lambda source, date: sql_bucket(date, granularity, self._dialect()))
+            unique_hits = zero_filled(unique_visitor_estimates(self.db.session, visitors).items(),
+                                      lower, upper, granularity)
 
         return hits, unique_hits
+
+    def get_sampling_errors(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            path: str = None
+    ) -> Optional[Dict[str, Optional[float]]]:
+        """ 95% error bounds {"hits": ..., "unique_visitors": ...} of the estimated number of hits and unique
+            visitors of a path (default: all paths), see sampling.error_bounds. None if hits aren't sampled.
+        """
+        if not self.weighted:
+            return None
+        visitors = self._visitors(start_date, end_date, path)
+        return error_bounds(self.db.session, visitors, self.sampling.per_visitor)
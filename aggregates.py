@@ -0,0 +1,124 @@
+import datetime
+import time
+from typing import List
+
+from flask_sqlalchemy import Model, SQLAlchemy
+from sqlalchemy import func
+
+from . import meta
+
+
+class Aggregate:
+    """ Base class for data derived from the hits as they are written (rollups, sketches, ...)
+
+        write_hook() is registered as a writer batch hook. Since aggregates can be enabled on a database which already
+        holds hits, each one records in the meta table since when it is complete. Queries only use it for ranges
+        starting at or after that date, until rebuild() recomputed it from all hits.
+    """
+
+    # Meta table key of the date since when the aggregate is complete
+    since_key = None
+    # Hit columns read by update()
+    columns = ("date", "path")
+    # Seconds for which since() is reused. It only ever moves back, so a stale value just skips the aggregate.
+    since_ttl = 5.0
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model):
+        self.db = db
+        self.model = model
+        self.meta_model = meta_model
+        # Monthly partitions holding the hits, if enabled
+        self.partitions = None
+        # Lookup table of the normalized columns, if enabled
+        self.interner = None
+        # Leave hits flagged as bots out
+        self.exclude_bots = False
+        self._since = (0.0, None)
+
+    def engine(self):
+        """ Engine of the bind holding the hits table """
+        return self.db.get_engine(bind=self.model.__table__.info.get("bind_key"))
+
+    def _raw_tables(self) -> list:
+        return [self.model.__table__] if self.partitions is None else self.partitions.raw_tables()
+
+    def initialize(self) -> None:
+        """ Mark since when the aggregate is complete, if that is not known yet.
+            An empty database is complete right away, otherwise from tomorrow on (or after a rebuild).
+        """
+        session = self.db.session
+        if meta.get_value(session, self.meta_model, self.since_key) is not None:
+            return
+
+        if all(session.query(table.c.index).first() is None for table in self._raw_tables()):
+            since = datetime.datetime.min
+        else:
+            since = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+            since += datetime.timedelta(days=1)
+        meta.set_value(session, self.meta_model, self.since_key, since.isoformat())
+        session.commit()
+        self._since = (0.0, None)
+
+    def since(self) -> datetime.datetime:
+        checked, since = self._since
+        if since is None or time.monotonic() - checked > self.since_ttl:
+            value = meta.get_value(self.db.session, self.meta_model, self.since_key)
+            since = datetime.datetime.max if value is None else datetime.datetime.fromisoformat(value)
+            self._since = (time.monotonic(), since)
+        return since
+
+    def covers(self, lower: datetime.datetime) -> bool:
+        return lower >= self.since()
+
+    def write_hook(self, session, rows: List[dict]) -> None:
+        """ Writer batch hook, adds the rows within the writer's transaction """
+        if self.exclude_bots:
+            rows = [row for row in rows if not row.get("is_bot")]
+        if rows:
+            self.update(session, rows)
+
+    def update(self, session, rows: List[dict]) -> None:
+        raise NotImplementedError
+
+    def clear(self, session) -> None:
+        raise NotImplementedError
+
+    def rebuild(self, chunk_size: int = 10000) -> int:
+        """ Recompute the aggregate from the raw table(s). Returns the number of hits read. """
+        if self.partitions is not None and self.partitions.compacted_before() is not None:
+            raise RuntimeError("Partitions were compacted into the rollups, a rebuild would lose their hits")
+
+        session = self.db.session
+        tables = self._raw_tables()
+
+        # Clear and take the cutoffs in one transaction: hits written afterwards are added by the writer hook
+        self.clear(session)
+        cutoffs = [session.query(func.max(table.c.index)).scalar() or 0 for table in tables]
+        meta.set_value(session, self.meta_model, self.since_key, datetime.datetime.min.isoformat())
+        session.commit()
+        self._since = (0.0, None)
+
+        total = 0
+        for table, cutoff in zip(tables, cutoffs):
+            columns = [table.c.index, *[table.c[column] for column in self.columns]]
+            last_index = 0
+            while last_index < cutoff:
+                query = session.query(*columns).filter(table.c.index > last_index, table.c.index <= cutoff)
+                if self.exclude_bots:
+                    query = query.filter(table.c.is_bot.isnot(True))
+                chunk = (query.order_by(table.c.index)
+                         .limit(chunk_size)
+                         .all())
+                if not chunk:
+                    break
+
+                rows = [row._asdict() for row in chunk if row.date is not None]
+                if self.interner is not None:
+                    rows = self.interner.decode_rows(rows)
+                self.update(session, rows)
+                session.commit()
+
+                last_index = chunk[-1].index
+                total += len(rows)
+
+        return total
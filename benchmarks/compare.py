@@ -0,0 +1,47 @@
+""" Compare the median timings of two benchmark results
+
+    python -m Dash_statistics.benchmarks.compare baseline.json results.json --threshold 1.2
+"""
+import json
+from typing import Dict
+
+import click
+
+
+def timings(results: dict, prefix: str = "") -> Dict[str, float]:
+    """ {"queries.get_routes_data.day": median seconds, ...} of all timings in a result file """
+    flat = {}
+    for key, value in results.items():
+        if key == "meta" or not isinstance(value, dict):
+            continue
+        name = f"{prefix}{key}"
+        if "median" in value:
+            flat[name] = value["median"]
+        else:
+            flat.update(timings(value, name + "."))
+    return flat
+
+
+@click.command()
+@click.argument("baseline", type=click.File())
+@click.argument("results", type=click.File())
+@click.option("--threshold", default=1.2, show_default=True, help="Slowdown ratio counted as a regression.")
+def main(baseline, results, threshold):
+    """ Print the ratio of every timing and exit with 1 if any is slower than the threshold """
+    before, after = timings(json.load(baseline)), timings(json.load(results))
+
+    regressions = 0
+    for name in sorted(before.keys() & after.keys()):
+        ratio = after[name] / before[name] if before[name] else float("inf")
+        regression = ratio > threshold
+        regressions += regression
+        click.echo(f"{name:60} {before[name] * 1000:10.2f} ms {after[name] * 1000:10.2f} ms {ratio:6.2f}x"
+                   + ("  REGRESSION" if regression else ""))
+
+    if regressions:
+        click.echo(f"{regressions} timings are more than {threshold}x slower", err=True)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+""" Benchmark the capture and query paths of dash-statistics on synthetic traffic
+
+    python -m Dash_statistics.benchmarks.run --rows 1000000 --output results.json
+"""
+import datetime
+import json
+import os
+import platform
+import statistics as stats_module
+import tempfile
+import time
+
+import click
+import flask
+import sqlalchemy
+from sqlalchemy import func
+
+from .. import index_view, route_view
+from ..geo import GeoResolver
+from ..statistics import DashStatistics
+from .traffic import TrafficGenerator
+
+PREFIX = "/statistics/"
+
+
+def timed(function, repeat: int) -> dict:
+    """ Call function repeat times, durations in seconds """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return {"min": min(durations), "median": stats_module.median(durations),
+            "mean": stats_module.mean(durations), "runs": repeat}
+
+
+def create_app(database_path: str, **options) -> DashStatistics:
+    app = flask.Flask(__name__)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    @app.route("/bench")
+    def bench():
+        return "ok"
+
+    return DashStatistics(app, PREFIX, database_uri=f"sqlite:///{os.path.abspath(database_path)}",
+                          geo_resolver=GeoResolver(), **options)
+
+
+def load(dash_statistics: DashStatistics, rows: int, start: datetime.datetime, end: datetime.datetime,
+         seed: int, chunk_size: int) -> dict:
+    """ Write synthetic hits through the writer, including its batch hooks (rollups, sketches, ...) """
+    generator = TrafficGenerator(start, end, seed=seed)
+    generating = 0.0
+    started = time.perf_counter()
+    with dash_statistics.app.app_context():
+        chunks = generator.hits(rows, chunk_size)
+        while True:
+            generating_started = time.perf_counter()
+            chunk = next(chunks, None)
+            generating += time.perf_counter() - generating_started
+            if chunk is None:
+                break
+            dash_statistics.writer.write_many(chunk)
+    writing = time.perf_counter() - started - generating
+    return {"rows": rows, "generate_seconds": generating, "write_seconds": writing,
+            "rows_per_second": rows / writing if writing else None}
+
+
+def date_ranges(start: datetime.datetime, end: datetime.datetime) -> dict:
+    today = (end - datetime.timedelta(microseconds=1)).date()
+    return {
+        "day": (today, today),
+        "week": (today - datetime.timedelta(days=6), today),
+        "month": (today - datetime.timedelta(days=29), today),
+        "all": (start.date(), today),
+    }
+
+
+def bench_queries(dash_statistics: DashStatistics, ranges: dict, path: str, repeat: int) -> dict:
+    api = dash_statistics.api
+    queries = {
+        "get_number_of_unique_visitors": lambda s, e: api.get_number_of_unique_visitors(s, e),
+        "get_statistic_data": lambda s, e: api.get_statistic_data("browser", s, e),
+        "get_statistic_breakdowns": lambda s, e: api.get_statistic_breakdowns(
+            ["browser", "user_country_name", "platform"], s, e),
+        "get_routes_data": lambda s, e: api.get_routes_data(s, e),
+        "get_requests_page": lambda s, e: api.get_requests_page(path, s, e, ["date", "remote_address", "browser"],
+                                                                0, 50, [("date", True)], []),
+        "get_user_chart_data": lambda s, e: api.get_user_chart_data(s, e),
+        "get_user_chart_data_path": lambda s, e: api.get_user_chart_data(s, e, path),
+        "get_route_percentiles": lambda s, e: api.get_route_percentiles(s, e),
+        "get_response_time_chart_data_path": lambda s, e: api.get_response_time_chart_data(s, e, path),
+    }
+
+    results = {}
+    with dash_statistics.app.app_context():
+        for name, query in queries.items():
+            results[name] = {range_name: timed(lambda: query(start, end), repeat)
+                             for range_name, (start, end) in ranges.items()}
+    return results
+
+
+def bench_views(dash_statistics: DashStatistics, ranges: dict, path: str, repeat: int) -> dict:
+    api = dash_statistics.api
+    views = {
+        "index_view": lambda s, e: index_view.view(api, s, e, PREFIX),
+        "route_view": lambda s, e: route_view.view(api, s, e, path, PREFIX),
+    }
+
+    results = {}
+    with dash_statistics.app.test_request_context(PREFIX):
+        for name, view in views.items():
+            results[name] = {}
+            for range_name, (start, end) in ranges.items():
+                start, end = (datetime.datetime.combine(day, datetime.time.min) for day in (start, end))
+                results[name][range_name] = timed(lambda: view(start, end), repeat)
+    return results
+
+
+def request_durations(app: flask.Flask, requests: int) -> list:
+    client = app.test_client()
+    for _ in range(min(100, requests)):
+        client.get("/bench")
+
+    durations = []
+    for i in range(requests):
+        started = time.perf_counter()
+        client.get("/bench", environ_base={"REMOTE_ADDR": f"10.0.{i // 256 % 256}.{i % 256}"})
+        durations.append(time.perf_counter() - started)
+    return sorted(durations)
+
+
+def bench_hooks(directory: str, requests: int, writer_modes: list) -> dict:
+    """ Time a trivial route with and without the before/after/teardown request hooks """
+
+    def summary(durations: list) -> dict:
+        return {"median": stats_module.median(durations), "mean": stats_module.mean(durations),
+                "p99": durations[int(len(durations) * 0.99) - 1], "runs": len(durations)}
+
+    plain = flask.Flask(__name__)
+    plain.add_url_rule("/bench", "bench", lambda: "ok")
+    results = {"plain": summary(request_durations(plain, requests))}
+
+    for writer_mode in writer_modes:
+        writer_options = {"directory": os.path.join(directory, "spool")} if writer_mode == "spool" else {}
+        dash_statistics = create_app(os.path.join(directory, f"hooks_{writer_mode}.db"), writer_mode=writer_mode,
+                                     writer_options=writer_options)
+        results[writer_mode] = summary(request_durations(dash_statistics.app, requests))
+        results[writer_mode]["overhead_median"] = results[writer_mode]["median"] - results["plain"]["median"]
+        dash_statistics.writer.close()
+    return results
+
+
+@click.command()
+@click.option("--rows", default=100000, show_default=True, help="Hits in the benchmark database (10k - 50M).")
+@click.option("--months", default=6, show_default=True, help="Months the hits are spread over.")
+@click.option("--database", default=None, help="Database file, reused if it already holds --rows hits.")
+@click.option("--rollups", is_flag=True, help="Enable rollups.")
+@click.option("--unique-visitors", type=click.Choice(["exact", "sketch"]), default="exact", show_default=True)
+@click.option("--partitioning", is_flag=True, help="Store the hits in monthly partitions.")
+@click.option("--normalized", is_flag=True, help="Store repeated strings as ids into a lookup table.")
+@click.option("--response-time-percentiles", is_flag=True, help="Keep quantile sketches of the response times.")
+@click.option("--columnar-archive", is_flag=True, help="Export the closed months into a columnar archive.")
+@click.option("--query-cache", is_flag=True, help="Enable the query cache (measures the warm cache).")
+@click.option("--repeat", default=5, show_default=True, help="Runs per query and view.")
+@click.option("--requests", default=2000, show_default=True, help="Requests for the request hook overhead.")
+@click.option("--path", default="/", show_default=True, help="Path of the route queries and view.")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--chunk-size", default=10000, show_default=True, help="Hits written per transaction.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="JSON result file, default stdout.")
+def main(rows, months, database, rollups, unique_visitors, partitioning, normalized, response_time_percentiles,
+         columnar_archive, query_cache, repeat, requests, path, seed, chunk_size, output):
+    """ Benchmark dash-statistics on synthetic traffic and write the timings as JSON """
+    directory = tempfile.mkdtemp(prefix="dash-statistics-benchmark-")
+    database = database or os.path.join(directory, "statistics.db")
+    options = {"rollups": rollups, "unique_visitors": unique_visitors, "query_cache": query_cache,
+               "partitioning": "month" if partitioning else None, "normalized": normalized,
+               "response_time_percentiles": response_time_percentiles,
+               "columnar_archive": database + ".columnar" if columnar_archive else None}
+
+    end = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+    end += datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=30 * months)
+
+    dash_statistics = create_app(database, **options)
+    with dash_statistics.app.app_context():
+        tables = ([dash_statistics.model.__table__] if dash_statistics.partitions is None
+                  else dash_statistics.partitions.raw_tables())
+        existing = sum(dash_statistics.db.session.query(func.count(table.c.index)).scalar() for table in tables)
+    if existing not in (0, rows):
+        raise click.UsageError(f"{database} holds {existing} hits instead of {rows}.")
+
+    results = {
+        "meta": {
+            "rows": rows,
+            "months": months,
+            "seed": seed,
+            "options": options,
+            "date": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+        },
+        "load": load(dash_statistics, rows, start, end, seed, chunk_size) if existing == 0 else None,
+    }
+    click.echo(f"Loaded {rows} hits into {database}", err=True)
+    if columnar_archive:
+        with dash_statistics.app.app_context():
+            results["export"] = timed(lambda: dash_statistics.api.export_closed_months(force=True), 1)
+
+    ranges = date_ranges(start, end)
+    results["queries"] = bench_queries(dash_statistics, ranges, path, repeat)
+    results["views"] = bench_views(dash_statistics, ranges, path, repeat)
+    results["hooks"] = bench_hooks(directory, requests, ["sync", "buffered", "spool"])
+
+    text = json.dumps(results, indent=2)
+    if output is None:
+        click.echo(text)
+    else:
+        with open(output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
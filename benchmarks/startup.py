@@ -0,0 +1,86 @@
+""" Measure what dash-statistics costs a host app's worker at startup: import time, DashStatistics() time, memory
+    and the first request of the dashboard, for every dashboard mode. Every run is a fresh interpreter.
+
+    python -m Dash_statistics.benchmarks.startup --runs 5 --output startup.json
+"""
+import json
+import os
+import platform
+import statistics as stats_module
+import subprocess
+import sys
+import tempfile
+
+import click
+
+PACKAGE = __package__.rsplit(".", 1)[0]
+
+# Run in a fresh interpreter, prints the measurements as json
+CHILD = """
+import json, resource, sys, time
+started = time.perf_counter()
+import flask
+from {package}.statistics import DashStatistics
+from {package}.geo import GeoResolver
+imported = time.perf_counter()
+
+app = flask.Flask("startup")
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+DashStatistics(app, "/statistics/", database_uri={database!r}, geo_resolver=GeoResolver(), dashboard={dashboard!r})
+initialized = time.perf_counter()
+
+def rss_kib():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * resource.getpagesize() // 1024
+
+result = {{"import_seconds": imported - started, "init_seconds": initialized - imported, "rss_kib": rss_kib(),
+          "modules": len(sys.modules), "dash_imported": "dash" in sys.modules, "pandas_imported": "pandas" in sys.modules}}
+if {dashboard!r} is not None:
+    requested = time.perf_counter()
+    app.test_client().get("/statistics/")
+    result["first_dashboard_request_seconds"] = time.perf_counter() - requested
+    result["rss_after_dashboard_kib"] = rss_kib()
+print(json.dumps(result))
+"""
+
+
+def measure(dashboard, database: str) -> dict:
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run([sys.executable, "-c", CHILD.format(package=PACKAGE, database=database,
+                                                                dashboard=dashboard)],
+                            env=environment, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summary(runs: list) -> dict:
+    result = {}
+    for key, value in runs[0].items():
+        if isinstance(value, bool):
+            result[key] = value
+        else:
+            result[key] = stats_module.median(run[key] for run in runs)
+    result["runs"] = len(runs)
+    return result
+
+
+@click.command()
+@click.option("--runs", default=5, show_default=True, help="Fresh interpreters per dashboard mode.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="JSON result file, default stdout.")
+def main(runs, output):
+    """ Measure import time, initialization time and memory of a host app per dashboard mode """
+    database = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="dash-statistics-startup-"), "statistics.db")
+    results = {"meta": {"python": platform.python_version(), "platform": platform.platform()}}
+    for dashboard in ("eager", "lazy", None):
+        results[str(dashboard)] = summary([measure(dashboard, database) for _ in range(runs)])
+        click.echo(f"{dashboard}: {results[str(dashboard)]}", err=True)
+
+    text = json.dumps(results, indent=2)
+    if output is None:
+        click.echo(text)
+    else:
+        with open(output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
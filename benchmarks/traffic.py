@@ -0,0 +1,119 @@
+import datetime
+from typing import Iterator, List
+
+import numpy as np
+
+# (user agent, browser column, platform column, weight)
+USER_AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 "
+     "Safari/537.36", "chrome 91.0.4472.124", "windows", 0.45),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+     "Version/14.1.1 Mobile/15E148 Safari/604.1", "safari 14.1.1", "iphone", 0.2),
+    ("Mozilla/5.0 (Linux; Android 11; SM-G991B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 "
+     "Mobile Safari/537.36", "chrome 91.0.4472.120", "android", 0.15),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0", "firefox 89.0", "linux", 0.1),
+    ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 "
+     "Safari/605.1.15", "safari 14.1.1", "macos", 0.07),
+    ("Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)", "google 2.1", "None", 0.03),
+]
+
+# (country code, country name, weight)
+COUNTRIES = [
+    ("US", "United States", 0.35), ("DE", "Germany", 0.2), ("GB", "United Kingdom", 0.1), ("FR", "France", 0.08),
+    ("IN", "India", 0.08), ("BR", "Brazil", 0.06), ("JP", "Japan", 0.05), ("", "", 0.08),
+]
+
+# (status code, weight)
+STATUS_CODES = [(200, 0.9), (304, 0.04), (404, 0.04), (302, 0.015), (500, 0.005)]
+
+
+def _weights(choices: list) -> np.ndarray:
+    weights = np.array([choice[-1] for choice in choices], dtype=np.float64)
+    return weights / weights.sum()
+
+
+class TrafficGenerator:
+    """ Synthetic hits resembling the traffic of a website
+
+        Paths are Zipf distributed, like the popularity of pages. Most hits come from a pool of returning visitors,
+        again Zipf distributed, the rest from one time visitors. The dates are spread uniformly over [start, end),
+        in ascending order like hits which are written as they happen.
+
+        :param paths: number of distinct paths
+        :param returning_visitors: size of the pool of returning visitors
+        :param returning_share: share of the hits coming from returning visitors
+        :param zipf_exponent: exponent of the path and visitor distributions, > 1
+    """
+
+    def __init__(self, start: datetime.datetime, end: datetime.datetime, paths: int = 1000,
+                 returning_visitors: int = 50000, returning_share: float = 0.7, zipf_exponent: float = 1.2,
+                 seed: int = 0):
+        self.start = start
+        self.end = end
+        self.paths = [self._path(rank) for rank in range(paths)]
+        self.returning_visitors = returning_visitors
+        self.returning_share = returning_share
+        self.zipf_exponent = zipf_exponent
+        self.rng = np.random.default_rng(seed)
+
+    @staticmethod
+    def _path(rank: int) -> str:
+        if rank == 0:
+            return "/"
+        section = ("blog", "product", "docs", "user", "api")[rank % 5]
+        return f"/{section}/{rank}"
+
+    def _zipf(self, size: int, n: int) -> np.ndarray:
+        """ Zipf distributed ranks in [0, n) """
+        ranks = self.rng.zipf(self.zipf_exponent, size) - 1
+        # Ranks beyond n are rare, spread them uniformly instead of clipping them onto the last rank
+        overflow = ranks >= n
+        ranks[overflow] = self.rng.integers(0, n, int(overflow.sum()))
+        return ranks
+
+    def _ips(self, size: int) -> List[str]:
+        returning = self.rng.random(size) < self.returning_share
+        ids = np.where(returning, self._zipf(size, self.returning_visitors),
+                       self.returning_visitors + self.rng.integers(0, 2 ** 31, size))
+        return [f"{(i >> 24) % 223 + 1}.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in ids.tolist()]
+
+    def hits(self, n: int, chunk_size: int = 10000) -> Iterator[List[dict]]:
+        """ Yield n hits in chunks of rows for the statistics table, in ascending date order """
+        span = (self.end - self.start).total_seconds()
+        user_agent_weights, country_weights, status_weights = (_weights(USER_AGENTS), _weights(COUNTRIES),
+                                                                _weights(STATUS_CODES))
+
+        for offset in range(0, n, chunk_size):
+            size = min(chunk_size, n - offset)
+            # Each chunk covers its share of the time span, so that the dates ascend across chunks
+            seconds = np.sort(self.rng.uniform(offset, offset + size, size)) * span / n
+            paths = self._zipf(size, len(self.paths)).tolist()
+            ips = self._ips(size)
+            user_agents = self.rng.choice(len(USER_AGENTS), size, p=user_agent_weights).tolist()
+            countries = self.rng.choice(len(COUNTRIES), size, p=country_weights).tolist()
+            status_codes = self.rng.choice(len(STATUS_CODES), size, p=status_weights).tolist()
+            response_times = self.rng.lognormal(-3.5, 1.0, size).tolist()
+            sizes = self.rng.integers(200, 50000, size).tolist()
+
+            rows = []
+            for i in range(size):
+                user_agent, browser, platform, _ = USER_AGENTS[user_agents[i]]
+                country_code, country_name, _ = COUNTRIES[countries[i]]
+                rows.append({
+                    "response_time": response_times[i],
+                    "date": self.start + datetime.timedelta(seconds=float(seconds[i])),
+                    "method": "GET",
+                    "size": sizes[i],
+                    "status_code": STATUS_CODES[status_codes[i]][0],
+                    "path": self.paths[paths[i]],
+                    "user_agent": user_agent,
+                    "remote_address": ips[i],
+                    "exception": None,
+                    "referrer": None,
+                    "browser": browser,
+                    "platform": platform,
+                    "mimetype": "text/html",
+                    "user_country_code": country_code,
+                    "user_country_name": country_name,
+                })
+            yield rows
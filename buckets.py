@@ -0,0 +1,107 @@
+import datetime
+from typing import Iterable, List
+
+from sqlalchemy import func
+
+GRANULARITIES = ("minute", "hour", "day", "week", "month")
+# Approximate bucket widths, used to pick a granularity for a range
+WIDTHS = {
+    "minute": datetime.timedelta(minutes=1),
+    "hour": datetime.timedelta(hours=1),
+    "day": datetime.timedelta(days=1),
+    "week": datetime.timedelta(weeks=1),
+    "month": datetime.timedelta(days=31),
+}
+# Upper limit of buckets in a chart when the granularity is chosen automatically
+MAX_BUCKETS = 400
+
+
+def truncate(date: datetime.datetime, granularity: str) -> datetime.datetime:
+    """ Start of the bucket containing date, weeks start on monday """
+    if granularity == "minute":
+        return date.replace(second=0, microsecond=0)
+    elif granularity == "hour":
+        return date.replace(minute=0, second=0, microsecond=0)
+    elif granularity == "day":
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif granularity == "week":
+        return truncate(date, "day") - datetime.timedelta(days=date.weekday())
+    elif granularity == "month":
+        return truncate(date, "day").replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity!r}")
+
+
+def next_bucket(bucket: datetime.datetime, granularity: str) -> datetime.datetime:
+    if granularity == "month":
+        return bucket.replace(year=bucket.year + bucket.month // 12, month=bucket.month % 12 + 1)
+    return bucket + WIDTHS[granularity]
+
+
+def bucket_range(lower: datetime.datetime, upper: datetime.datetime, granularity: str):
+    """ Starts of all buckets overlapping the half open range [lower, upper) """
+    bucket = truncate(lower, granularity)
+    while bucket < upper:
+        yield bucket
+        bucket = next_bucket(bucket, granularity)
+
+
+def auto_granularity(lower: datetime.datetime, upper: datetime.datetime, max_buckets: int = MAX_BUCKETS) -> str:
+    """ Finest granularity which splits [lower, upper) into at most max_buckets buckets """
+    for granularity in GRANULARITIES:
+        if (upper - lower) / WIDTHS[granularity] <= max_buckets:
+            return granularity
+    return GRANULARITIES[-1]
+
+
+def parse_bucket(value) -> datetime.datetime:
+    """ Bucket start from a sql bucket expression's result, which is a string on sqlite """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time.min)
+    return datetime.datetime.fromisoformat(value)
+
+
+def sql_bucket(column, granularity: str, dialect: str):
+    """ SQL expression truncating a datetime column to the start of its bucket """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity!r}")
+
+    if dialect == "sqlite":
+        if granularity == "week":
+            return func.date(column, "weekday 0", "-6 days")
+        return func.strftime({
+            "minute": "%Y-%m-%d %H:%M:00",
+            "hour": "%Y-%m-%d %H:00:00",
+            "day": "%Y-%m-%d",
+            "month": "%Y-%m-01",
+        }[granularity], column)
+
+    elif dialect == "postgresql":
+        return func.date_trunc(granularity, column)
+
+    elif dialect == "mysql":
+        if granularity == "week":
+            return func.subdate(func.date(column), func.weekday(column))
+        return func.date_format(column, {
+            "minute": "%Y-%m-%d %H:%i:00",
+            "hour": "%Y-%m-%d %H:00:00",
+            "day": "%Y-%m-%d",
+            "month": "%Y-%m-01",
+        }[granularity])
+
+    raise NotImplementedError(f"Date buckets are not supported on {dialect}")
+
+
+def label(bucket: datetime.datetime, granularity: str) -> str:
+    """ Chart label of a bucket """
+    if granularity in ("minute", "hour"):
+        return bucket.strftime("%Y-%m-%d %H:%M")
+    return str(bucket.date())
+
+
+def zero_filled(rows: Iterable, lower: datetime.datetime, upper: datetime.datetime, granularity: str) -> List[dict]:
+    """ Chart points {"x": label, "y": count} for every bucket of [lower, upper) from (bucket, count) rows """
+    counts = {parse_bucket(bucket): count for bucket, count in rows}
+    return [{"x": label(bucket, granularity), "y": counts.get(bucket, 0)}
+            for bucket in bucket_range(lower, upper, granularity)]
@@ -0,0 +1,102 @@
+""" Time series figures of the dashboard which stay small for long ranges: series are queried at the finest granularity
+    within a bucket budget, downsampled to a number of points with Largest-Triangle-Three-Buckets, and the figures are
+    cached as JSON per (chart, range, path, granularity).
+"""
+import datetime
+import json
+from typing import Callable, List
+
+import numpy as np
+
+from .buckets import MAX_BUCKETS, auto_granularity, next_bucket, truncate
+from .lru import LRUCache
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """ Indices of the threshold points which keep the shape of the series (x, y) best, see
+        Steinarsson, Downsampling Time Series for Visual Representation (2013). The first and last point are kept,
+        of every other bucket the point forming the largest triangle with the previously kept point and the average
+        of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    kept = 0
+    for bucket in range(threshold - 2):
+        start, end = int(bucket * every) + 1, int((bucket + 1) * every) + 1
+        next_end = n if bucket == threshold - 3 else min(int((bucket + 2) * every) + 1, n)
+        average_x, average_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[kept] - average_x) * (y[start:end] - y[kept])
+                       - (x[kept] - x[start:end]) * (average_y - y[kept]))
+        kept = start + int(np.argmax(areas))
+        indices[bucket + 1] = kept
+    return indices
+
+
+def downsample(points: List[dict], threshold: int) -> List[dict]:
+    """ At most about threshold of the chart points {"x": label, "y": value}, chosen with lttb. Points whose "y" is a
+        list of series (e.g. percentiles) keep the points chosen for any series, threshold / number of series each.
+    """
+    if len(points) <= threshold:
+        return points
+
+    x = np.array([point["x"] for point in points], dtype="datetime64[s]").astype(np.float64)
+    values = np.nan_to_num(np.array([point["y"] for point in points], dtype=np.float64))
+    if values.ndim == 1:
+        keep = lttb(x, values, threshold)
+    else:
+        per_series = max(3, threshold // values.shape[1])
+        keep = np.unique(np.concatenate([lttb(x, series, per_series) for series in values.T]))
+    return [points[index] for index in keep]
+
+
+class Charts:
+    """ Granularity, downsampling and cache of the dashboard's time series figures
+
+        :param points: points per trace after downsampling
+        :param max_buckets: most buckets queried for a chart, the granularity is the finest within this budget
+        :param cache_bytes: memory budget of the figure cache, 0 disables it
+    """
+
+    def __init__(self, points: int = MAX_BUCKETS, max_buckets: int = 4 * MAX_BUCKETS,
+                 cache_bytes: int = 16 * 1024 * 1024):
+        self.points = points
+        self.max_buckets = max_buckets
+        self.cache = LRUCache(maxsize=10000, maxbytes=cache_bytes, sizeof=lambda entry: len(entry[1]))
+
+    def granularity(self, lower: datetime.datetime, upper: datetime.datetime) -> str:
+        return auto_granularity(lower, upper, self.max_buckets)
+
+    def window(self, lower: datetime.datetime, upper: datetime.datetime, granularity: str):
+        """ [lower, upper) widened to whole buckets """
+        upper_bucket = truncate(upper, granularity)
+        return truncate(lower, granularity), upper if upper_bucket == upper else next_bucket(upper_bucket, granularity)
+
+    def downsample(self, points: List[dict]) -> List[dict]:
+        return downsample(points, self.points)
+
+    def figure(self, api, key: tuple, upper: datetime.datetime, build: Callable) -> dict:
+        """ Figure (as a dict) built by build(), cached by key until hits are written if upper is after today, or
+            until hits dated before today are written otherwise
+
+            :param api: StatisticsQueries, for the write watermarks
+        """
+        today = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+        if upper <= today:
+            watermark = "late:" + api.get_late_write_watermark()
+        else:
+            watermark = str(api.get_write_watermark())
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] == watermark:
+            return json.loads(entry[1])
+
+        data = build().to_json()
+        self.cache.put(key, (watermark, data))
+        return json.loads(data)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,218 @@
+import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+from . import export, geo, importer, migrations, spool
+from .sketches import SketchAggregate
+
+
+def register_commands(stats) -> AppGroup:
+    """ Register the `flask statistics ...` commands of a DashStatistics instance on its flask app """
+    group = AppGroup("statistics", help="Manage the dash-statistics database.")
+
+    @group.command("build-geo-db")
+    @click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+    @click.argument("out_path", type=click.Path(dir_okay=False))
+    def build_geo_db(csv_path, out_path):
+        """ Convert an ip range csv file into a database for LocalGeoResolver """
+        ranges = geo.build_database(csv_path, out_path)
+        click.echo(f"Wrote {ranges} ip ranges to {out_path}")
+
+    @group.command("rebuild-rollups")
+    @click.option("--chunk-size", default=10000, show_default=True, help="Hits read per transaction.")
+    def rebuild_rollups(chunk_size):
+        """ Recompute the rollup tables from all recorded hits """
+        if stats.rollups is None:
+            raise click.UsageError("Rollups are not enabled, pass rollups=True to DashStatistics.")
+        try:
+            hits = stats.rollups.rebuild(chunk_size)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Rebuilt rollups from {hits} hits")
+
+    @group.command("rebuild-sketches")
+    @click.option("--chunk-size", default=10000, show_default=True, help="Hits read per transaction.")
+    def rebuild_sketches(chunk_size):
+        """ Recompute all sketches from the recorded hits """
+        sketches = [aggregate for aggregate in stats.aggregates if isinstance(aggregate, SketchAggregate)]
+        if not sketches:
+            raise click.UsageError("No sketches are enabled.")
+        for sketch in sketches:
+            try:
+                hits = sketch.rebuild(chunk_size)
+            except RuntimeError as e:
+                raise click.ClickException(str(e))
+            click.echo(f"Rebuilt {sketch.kind} sketches from {hits} hits")
+
+    @group.command("migrate")
+    def migrate():
+        """ Add missing columns and indexes to an existing statistics database """
+        changes = stats.migrate()
+        for change in changes:
+            click.echo(change)
+        click.echo(f"{len(changes)} changes")
+
+    @group.command("explain")
+    @click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First day, default: 30 days ago.")
+    @click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last day, default: today.")
+    @click.option("--path", help="Also explain the queries of a route view.")
+    def explain(start, end, path):
+        """ Print the sqlite query plans of the dashboard queries """
+        end = (end or datetime.datetime.utcnow()).date()
+        start = start.date() if start else end - datetime.timedelta(days=30)
+        for statement, plan in migrations.query_plans(stats.api, start, end, path):
+            click.echo(statement)
+            for line in plan:
+                click.echo("    " + line)
+            click.echo()
+
+    @group.command("partitions")
+    def partitions():
+        """ List the monthly partitions and their number of hits """
+        if stats.partitions is None:
+            raise click.UsageError("Partitioning is not enabled, pass partitioning=\"month\" to DashStatistics.")
+        for table in stats.partitions.raw_tables():
+            hits = stats.db.session.query(func.count(table.c.index)).scalar()
+            click.echo(f"{table.name:30} {hits:>12} hits")
+
+    @group.command("apply-retention")
+    def apply_retention():
+        """ Drop, archive and compact partitions according to the retention options """
+        if stats.partitions is None:
+            raise click.UsageError("Partitioning is not enabled, pass partitioning=\"month\" to DashStatistics.")
+        changes = stats.apply_retention()
+        for change in changes:
+            click.echo(change)
+        click.echo(f"{len(changes)} changes")
+
+    @group.command("export-columnar")
+    @click.option("--force", is_flag=True, help="Export months again which were exported before.")
+    @click.option("--chunk-size", default=10000, show_default=True, help="Hits read at once.")
+    def export_columnar(force, chunk_size):
+        """ Export the hits of every closed month into the columnar archive """
+        if stats.columnar_archive is None:
+            raise click.UsageError("The columnar archive is not enabled, pass columnar_archive=... to DashStatistics.")
+        changes = stats.api.export_closed_months(force, chunk_size)
+        for change in changes:
+            click.echo(change)
+        click.echo(f"{len(changes)} months exported to {stats.columnar_archive.directory}")
+
+    @group.command("import-logs")
+    @click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+    @click.option("--batch-size", default=10000, show_default=True, help="Hits written per transaction.")
+    @click.option("--workers", type=int, default=None, help="Parser processes, 0 parses in this process. "
+                                                             "Default: number of cpus.")
+    @click.option("--dedup", is_flag=True, help="Skip hits which are already stored, for overlapping logs.")
+    @click.option("--no-geo", is_flag=True, help="Don't resolve the geo columns of the addresses.")
+    @click.option("--restart", is_flag=True, help="Import the files from their first line, ignoring checkpoints.")
+    def import_logs(paths, batch_size, workers, dedup, no_geo, restart):
+        """ Import nginx/Apache access logs in the combined format, which may be gzip compressed """
+        log_importer = importer.LogImporter(stats, batch_size, workers, dedup, geo=not no_geo)
+
+        def progress(counters):
+            click.echo(f"{counters['path']}: {counters['lines']} lines, {counters['imported']} hits, "
+                       f"{counters['hits_per_second']:.0f} hits/s", err=True)
+
+        for path in paths:
+            counters = log_importer.import_file(path, restart, progress)
+            click.echo(f"{path}: imported {counters['imported']} hits from {counters['lines']} lines "
+                       f"in {counters['seconds']:.1f}s ({counters['hits_per_second']:.0f} hits/s), skipped "
+                       f"{counters['skipped_lines']} lines imported before, {counters['duplicates']} duplicates, "
+                       f"{counters['unparsed']} unparsable and {counters['ignored']} ignored lines")
+
+    def echo_metrics(metrics):
+        click.echo(f"{metrics['hits']} hits stored, {metrics['hits_per_second']:.0f} hits/s, lag "
+                   f"{metrics['lag_seconds']:.1f}s, backlog {metrics['backlog_bytes']} bytes in {metrics['files']} "
+                   f"files, {metrics['invalid']} invalid lines", err=True)
+
+    @group.command("aggregate")
+    @click.option("--batch-size", default=5000, show_default=True, help="Hits written per transaction.")
+    @click.option("--poll-interval", default=0.5, show_default=True, help="Seconds to wait while the spool is empty.")
+    @click.option("--report-interval", default=10.0, show_default=True, help="Seconds between metric reports.")
+    @click.option("--once", is_flag=True, help="Store the spooled hits and exit.")
+    @click.option("--no-geo", is_flag=True, help="Don't resolve the geo columns of the addresses.")
+    def aggregate(batch_size, poll_interval, report_interval, once, no_geo):
+        """ Store the hits spooled by the worker processes (writer_mode="spool") """
+        if not isinstance(stats.writer, spool.SpoolWriter):
+            raise click.UsageError("The spool writer is not enabled, pass writer_mode=\"spool\" to DashStatistics.")
+        aggregator = spool.SpoolAggregator(stats, batch_size=batch_size, geo=not no_geo)
+        try:
+            aggregator.acquire()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+
+        if once:
+            while aggregator.drain() >= batch_size:
+                pass
+        else:
+            try:
+                aggregator.run(poll_interval, report=echo_metrics, report_interval=report_interval)
+            except KeyboardInterrupt:
+                pass
+        echo_metrics(aggregator.metrics())
+
+    @group.command("aggregator-status")
+    def aggregator_status():
+        """ Print the lag and throughput metrics of the spool aggregator """
+        if not isinstance(stats.writer, spool.SpoolWriter):
+            raise click.UsageError("The spool writer is not enabled, pass writer_mode=\"spool\" to DashStatistics.")
+        status = spool.read_status(stats.writer.directory)
+        if status is None:
+            raise click.ClickException(f"No aggregator drained {stats.writer.directory} yet.")
+        for key, value in status.items():
+            click.echo(f"{key:20} {value}")
+
+    @group.command("match-path")
+    @click.argument("paths", nargs=-1, required=True)
+    @click.option("--method", default="GET", show_default=True)
+    def match_path(paths, method):
+        """ Show whether paths are recorded and the path they are stored with """
+        for path in paths:
+            if not stats.path_rules.is_recorded(path):
+                click.echo(f"{path}  not recorded")
+                continue
+            url_rule = stats.url_rule_for(path, method) if stats.url_rule_templates else None
+            click.echo(f"{path}  recorded as {stats.stored_path(path, url_rule)}")
+        for key, counters in stats.path_rules.stats().items():
+            if isinstance(counters, dict):
+                for rule, hits in counters.items():
+                    if hits:
+                        click.echo(f"  {key} by {rule}: {hits}")
+
+    @group.command("export")
+    @click.option("--start", type=click.DateTime(["%Y-%m-%d"]), help="First day, default: the first recorded hit.")
+    @click.option("--end", type=click.DateTime(["%Y-%m-%d"]), help="Last day, default: today.")
+    @click.option("--path", help="Only export the hits of this path.")
+    @click.option("--columns", help="Comma separated columns to export, default: all.")
+    @click.option("--format", "export_format", type=click.Choice(list(export.FORMATS)), default="csv",
+                  show_default=True)
+    @click.option("--output", type=click.File("wb"), default="-", help="File to write, default: stdout.")
+    @click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip.")
+    @click.option("--chunk-size", default=10000, show_default=True, help="Hits read at once.")
+    def export_hits(start, end, path, columns, export_format, output, compress, chunk_size):
+        """ Stream the recorded hits as CSV or NDJSON """
+        available = stats.api.export_columns()
+        columns = [column for column in (columns or "").split(",") if column] or available
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            raise click.BadParameter(f"Unknown columns {', '.join(unknown)}, use some of {', '.join(available)}",
+                                     param_hint="--columns")
+
+        end = (end or datetime.datetime.utcnow()).date()
+        start = (start or stats.api.get_first_date() or datetime.datetime.utcnow()).date()
+        for chunk in export.export_chunks(stats.api, start, end, columns, path, export_format, compress, chunk_size):
+            output.write(chunk)
+
+    @group.command("dashboard")
+    @click.option("--host", default="127.0.0.1", show_default=True)
+    @click.option("--port", default=8050, show_default=True)
+    @click.option("--debug", is_flag=True, help="Run the development server in debug mode.")
+    def dashboard(host, port, debug):
+        """ Serve only the dashboard from this process, e.g. for a host app with dashboard=None """
+        from .dashboard import create_server
+        create_server(stats, record_hits=False).run(host, port, debug=debug)
+
+    stats.app.cli.add_command(group)
+    return group
@@ -0,0 +1,585 @@
+import datetime
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+from .StatisticsQueries import RouteRow, StatisticsQueries, date_bounds
+from .buckets import auto_granularity, bucket_range, label, next_bucket, truncate
+from .heavy_hitters import top_with_other
+from .rollups import sorted_breakdown
+from .sampling import bounds
+
+# Columns stored as int32 codes into a list of labels which is shared by all months
+DICTIONARY_COLUMNS = ("path", "remote_address", "browser", "platform", "user_country_name", "status_code")
+# Columns stored as plain arrays
+VALUE_COLUMNS = {"date": "datetime64[us]", "response_time": "float64", "sample_weight": "float64"}
+ARCHIVE_COLUMNS = (*VALUE_COLUMNS, *DICTIONARY_COLUMNS)
+# Bytes of the .npy headers written by export, room for any dtype and number of rows
+HEADER_BYTES = 128
+
+
+def _atomic_write_json(path: str, value) -> None:
+    with open(path + ".tmp", "w") as file:
+        json.dump(value, file)
+    os.replace(path + ".tmp", path)
+
+
+def _npy_header(dtype: str, rows: int) -> bytes:
+    """ Header of a version 1.0 .npy file of a 1-d array, padded to HEADER_BYTES so that it can be rewritten with the
+        number of rows once they were all appended
+    """
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (rows,)})
+    # Magic string, version and header length take 10 bytes, the header ends with a newline
+    header = header.ljust(HEADER_BYTES - 11) + "\n"
+    return np.lib.format.magic(1, 0) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _to_datetimes(values: np.ndarray) -> list:
+    return values.astype("datetime64[us]").astype(datetime.datetime).tolist()
+
+
+def min_per_key(keys: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Distinct keys and the smallest weight of each, e.g. the weight of each visitor of sampled hits """
+    order = np.lexsort((weights, keys))
+    keys, weights = keys[order], weights[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first], weights[first]
+
+
+def buckets_of(dates: np.ndarray, granularity: str) -> np.ndarray:
+    """ Start of the bucket of every date, like buckets.truncate. Weeks start on monday. """
+    if granularity == "week":
+        days = dates.astype("datetime64[D]")
+        # 1970-01-01 was a thursday
+        weekdays = (days.view("int64") + 3) % 7
+        return days - weekdays.astype("timedelta64[D]")
+    return dates.astype({"minute": "datetime64[m]", "hour": "datetime64[h]", "day": "datetime64[D]",
+                         "month": "datetime64[M]"}[granularity])
+
+
+class ColumnarArchive:
+    """ Hits of closed months in a directory of column files, one sub directory per month (e.g. 2021_07/) holding
+        a .npy file per column and a manifest.
+
+        Rows are sorted by date, so a date range is a slice of each memory mapped column. The string columns are
+        dictionary encoded: every month stores int32 codes into the label lists in dictionaries/, which are shared
+        by all months and only ever appended to. Only one process should export at a time.
+    """
+
+    # Seconds after which the month directories are listed again, to see months exported by other processes
+    refresh_interval = 10.0
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        self._months = {}
+        self._arrays = {}
+        self._dictionaries = {}
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _month_path(self, month: datetime.datetime) -> str:
+        return os.path.join(self.directory, f"{month:%Y_%m}")
+
+    def _dictionary_path(self, column: str) -> str:
+        return os.path.join(self.directory, "dictionaries", f"{column}.json")
+
+    def refresh(self, force: bool = False) -> None:
+        """ Find the exported months in the directory """
+        if not force and time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+
+        months = {}
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                manifest_path = os.path.join(entry.path, "manifest.json")
+                if not entry.is_dir() or not os.path.exists(manifest_path):
+                    continue
+                try:
+                    month = datetime.datetime.strptime(entry.name, "%Y_%m")
+                except ValueError:
+                    continue
+                with open(manifest_path) as file:
+                    months[month] = json.load(file)
+
+        with self._lock:
+            # Forget the arrays of months which were exported again
+            self._arrays = {key: array for key, array in self._arrays.items()
+                            if key[0] in months and months[key[0]]["exported"] == key[1]}
+            self._months = months
+            self._refreshed = time.monotonic()
+
+    def months(self) -> Dict[datetime.datetime, dict]:
+        """ {month: manifest} of all exported months, in chronological order """
+        self.refresh()
+        with self._lock:
+            return dict(sorted(self._months.items()))
+
+    def dictionary(self, column: str) -> Tuple[list, dict]:
+        """ Labels of a dictionary encoded column and their {label: code} index """
+        path = self._dictionary_path(column)
+        modified = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        with self._lock:
+            cached = self._dictionaries.get(column)
+        if cached is not None and cached[0] == modified:
+            return cached[1], cached[2]
+
+        labels = []
+        if modified is not None:
+            with open(path) as file:
+                labels = json.load(file)
+        index = {value: code for code, value in enumerate(labels)}
+        with self._lock:
+            self._dictionaries[column] = (modified, labels, index)
+        return labels, index
+
+    def encode(self, column: str, values: Iterable, missing: dict = None) -> Tuple[np.ndarray, list]:
+        """ Codes of values, labels missing in the dictionary get codes after it.
+            Returns the codes and the missing labels, in the order of their codes.
+
+            :param missing: {label: code} of the labels missing in earlier calls, extended with those of values
+        """
+        labels, index = self.dictionary(column)
+        missing = {} if missing is None else missing
+        codes = []
+        for value in values:
+            code = index.get(value)
+            if code is None:
+                code = missing.setdefault(value, len(labels) + len(missing))
+            codes.append(code)
+        return np.array(codes, dtype=np.int64), list(missing)
+
+    def decode(self, column: str, codes: Iterable[int], missing: list = ()) -> list:
+        """ Labels of codes, codes after the dictionary refer to the missing labels returned by encode() """
+        labels = self.dictionary(column)[0]
+        return [labels[code] if code < len(labels) else missing[code - len(labels)] for code in codes]
+
+    def column(self, month: datetime.datetime, column: str) -> np.ndarray:
+        """ Memory mapped column of an exported month """
+        exported = self.months()[month]["exported"]
+        key = (month, exported, column)
+        with self._lock:
+            array = self._arrays.get(key)
+        if array is None:
+            path = os.path.join(self._month_path(month), f"{column}.npy")
+            if column == "sample_weight" and not os.path.exists(path):
+                # Exported before hits were sampled
+                array = np.ones(self.months()[month]["rows"])
+            else:
+                array = np.load(path, mmap_mode="r")
+            with self._lock:
+                self._arrays[key] = array
+        return array
+
+    def select(self, ranges: List[Tuple[datetime.datetime, datetime.datetime]], columns: Iterable[str]
+               ) -> Dict[str, np.ndarray]:
+        """ Columns of the hits within the half open ranges, sorted by date. The ranges must be archived. """
+        parts = defaultdict(list)
+        for lower, upper in ranges:
+            for month in bucket_range(lower, upper, "month"):
+                dates = self.column(month, "date")
+                start, stop = np.searchsorted(dates, [np.datetime64(lower, "us"), np.datetime64(upper, "us")])
+                for column in columns:
+                    parts[column].append(self.column(month, column)[start:stop])
+
+        selected = {}
+        for column in columns:
+            if len(parts[column]) == 1:
+                selected[column] = parts[column][0]
+            elif parts[column]:
+                selected[column] = np.concatenate(parts[column])
+            else:
+                selected[column] = np.empty(0, dtype=VALUE_COLUMNS.get(column, "int32"))
+        return selected
+
+    def export(self, month: datetime.datetime, chunks: Iterable[List[tuple]]) -> int:
+        """ Write the hits of a month, replacing a previous export of it. Returns the number of rows, nothing is
+            written without rows.
+
+            Chunks are lists of tuples of the ARCHIVE_COLUMNS, sorted by date. Each chunk is appended to the column
+            files, so that a month is never held in memory at once.
+        """
+        path = self._month_path(month)
+        temporary = path + ".tmp"
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+
+        dtypes = {**VALUE_COLUMNS, **{column: "int32" for column in DICTIONARY_COLUMNS}}
+        missing = {column: {} for column in DICTIONARY_COLUMNS}
+        files = {column: open(os.path.join(temporary, f"{column}.npy"), "wb") for column in ARCHIVE_COLUMNS}
+        rows, last_date = 0, None
+        try:
+            for column, file in files.items():
+                file.write(_npy_header(dtypes[column], 0))
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                data = dict(zip(ARCHIVE_COLUMNS, zip(*chunk)))
+                arrays = {
+                    "date": np.array(data["date"], dtype="datetime64[us]"),
+                    "response_time": np.array([np.nan if value is None else value for value in data["response_time"]],
+                                              dtype=np.float64),
+                    "sample_weight": np.array([1.0 if value is None else value for value in data["sample_weight"]],
+                                              dtype=np.float64),
+                }
+                dates = arrays["date"]
+                if (last_date is not None and dates[0] < last_date) or np.any(dates[1:] < dates[:-1]):
+                    raise ValueError("Rows must be sorted by date")
+                for column in DICTIONARY_COLUMNS:
+                    arrays[column] = self.encode(column, data[column], missing[column])[0].astype(np.int32)
+                for column, array in arrays.items():
+                    array.tofile(files[column])
+                rows += len(dates)
+                last_date = dates[-1]
+
+            for column, file in files.items():
+                file.seek(0)
+                file.write(_npy_header(dtypes[column], rows))
+        finally:
+            for file in files.values():
+                file.close()
+
+        if not rows:
+            shutil.rmtree(temporary, ignore_errors=True)
+            return 0
+
+        os.makedirs(os.path.dirname(self._dictionary_path("path")), exist_ok=True)
+        for column in DICTIONARY_COLUMNS:
+            if missing[column]:
+                # Dictionaries first: a month never refers to codes a dictionary doesn't have
+                _atomic_write_json(self._dictionary_path(column), self.dictionary(column)[0] + list(missing[column]))
+        _atomic_write_json(os.path.join(temporary, "manifest.json"),
+                           {"rows": rows, "exported": datetime.datetime.utcnow().isoformat()})
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temporary, path)
+        self.refresh(force=True)
+        return rows
+
+
+class ArchivedStatisticsQueries:
+    """ Answers the dashboard queries from a ColumnarArchive with vectorized numpy operations for the archived months
+        of a range, and from the wrapped StatisticsQueries for the rest of it. Everything else is passed through.
+
+        Unique visitors are merged exactly by encoding the visitors of the live part with the archive's dictionaries,
+        unless the wrapped object would estimate them with sketches anyway.
+    """
+
+    def __init__(self, api: StatisticsQueries, archive: ColumnarArchive):
+        self.api = api
+        self.archive = archive
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def _split(self, start_date, end_date, granularity: str = None):
+        """ lower, upper and the archived and live ranges of a date range. With a granularity, archived ranges are
+            shrunk to whole buckets so that no bucket is counted from both.
+        """
+        lower, upper = date_bounds(start_date, end_date)
+        months = self.archive.months()
+        archived, live = [], []
+        for month in bucket_range(lower, upper, "month"):
+            part = [max(lower, month), min(upper, next_bucket(month, "month"))]
+            parts = archived if month in months else live
+            if parts and parts[-1][1] == part[0]:
+                parts[-1][1] = part[1]
+            else:
+                parts.append(part)
+
+        if granularity == "week":
+            aligned = []
+            for part_lower, part_upper in archived:
+                if part_lower != lower and truncate(part_lower, "week") != part_lower:
+                    part_lower = next_bucket(truncate(part_lower, "week"), "week")
+                if part_upper != upper:
+                    part_upper = truncate(part_upper, "week")
+                if part_lower < part_upper:
+                    aligned.append([part_lower, part_upper])
+            live = self._difference(lower, upper, aligned)
+            archived = aligned
+
+        return lower, upper, [tuple(part) for part in archived], [tuple(part) for part in live]
+
+    @staticmethod
+    def _difference(lower: datetime.datetime, upper: datetime.datetime, parts: list) -> list:
+        """ Ranges of [lower, upper) not covered by the sorted, disjoint parts """
+        remaining = []
+        for part_lower, part_upper in parts:
+            if lower < part_lower:
+                remaining.append([lower, part_lower])
+            lower = part_upper
+        if lower < upper:
+            remaining.append([lower, upper])
+        return remaining
+
+    def _live_distinct(self, parts: list, columns: List[str], path: str = None) -> Dict[tuple, float]:
+        """ Distinct values of columns within the live ranges and the smallest sample weight of their hits """
+        values = {}
+        for lower, upper in parts:
+            source = self.api._source(lower, upper)
+            keys = [getattr(source, column) for column in columns]
+            if self.api.weighted:
+                query = self.api.db.session.query(*keys, func.min(self.api._weight(source))).group_by(*keys)
+            else:
+                query = self.api.db.session.query(*keys).distinct()
+            query = self.api._add_date_filter_to_query(query, lower, upper, source)
+            if path is not None:
+                query = query.filter(source.path == self.api._encoded("path", path))
+
+            for row in self.api.decode_rows(self._columns(*columns), query.all()):
+                key, weight = (row[:-1], row[-1]) if self.api.weighted else (row, 1.0)
+                values[key] = min(weight, values.get(key, weight))
+        return values
+
+    def _weights(self, data: Dict[str, np.ndarray]) -> np.ndarray:
+        """ Sample weights of selected hits, None if hits aren't sampled """
+        return data["sample_weight"] if self.api.weighted else None
+
+    def _columns(self, *columns: str) -> List[str]:
+        """ Columns to select, with the sample weights if hits are sampled """
+        return [*columns, "sample_weight"] if self.api.weighted else list(columns)
+
+    def _path_mask(self, paths: np.ndarray, path: str):
+        """ Selects the rows of a path, None for all paths """
+        if path is None:
+            return None
+        code = self.archive.dictionary("path")[1].get(path)
+        return paths == code if code is not None else np.zeros(len(paths), dtype=bool)
+
+    def get_number_of_unique_visitors(self, start_date, end_date, exact: bool = False) -> int:
+        if start_date is None or end_date is None or self.api._use_unique_sketches(start_date, end_date, exact):
+            return self.api.get_number_of_unique_visitors(start_date, end_date, exact)
+        _, _, archived, live = self._split(start_date, end_date)
+        if not archived:
+            return self.api.get_number_of_unique_visitors(start_date, end_date, exact)
+
+        data = self.archive.select(archived, self._columns("remote_address"))
+        live_visitors = self._live_distinct(live, ["remote_address"])
+        live_codes, _ = self.archive.encode("remote_address", (row[0] for row in live_visitors))
+        visitors = np.concatenate([data["remote_address"], live_codes])
+        if not self.api.weighted:
+            return len(np.unique(visitors))
+        _, weights = min_per_key(visitors, np.concatenate([data["sample_weight"], list(live_visitors.values())]))
+        return round(float(weights.sum()))
+
+    def get_statistic_data(self, column_name, start_date=None, end_date=None):
+        if column_name not in DICTIONARY_COLUMNS:
+            return self.api.get_statistic_data(column_name, start_date, end_date)
+        return self.get_statistic_breakdowns([column_name], start_date, end_date)[column_name]
+
+    def get_statistic_breakdowns(self, column_names: List[str], start_date=None, end_date=None
+                                 ) -> Dict[str, Tuple[list, list]]:
+        if (start_date is None or end_date is None or
+                any(column_name not in DICTIONARY_COLUMNS for column_name in column_names)):
+            return self.api.get_statistic_breakdowns(column_names, start_date, end_date)
+        _, _, archived, live = self._split(start_date, end_date)
+        if not archived:
+            return self.api.get_statistic_breakdowns(column_names, start_date, end_date)
+
+        counts = {column_name: defaultdict(int) for column_name in column_names}
+        data = self.archive.select(archived, self._columns(*column_names))
+        for column_name in column_names:
+            labels = self.archive.dictionary(column_name)[0]
+            frequencies = np.bincount(data[column_name], weights=self._weights(data), minlength=len(labels))
+            for code in np.flatnonzero(frequencies):
+                counts[column_name][labels[code]] += frequencies[code].item()
+
+        for part_lower, part_upper in live:
+            breakdowns = self.api.get_statistic_breakdowns(column_names, part_lower, part_upper)
+            for column_name, (labels, frequencies) in breakdowns.items():
+                for value, frequency in zip(labels, frequencies):
+                    counts[column_name][value] += frequency
+
+        return {column_name: sorted_breakdown({value: round(count) for value, count in counts[column_name].items()})
+                for column_name in column_names}
+
+    def get_top_values(self, column_name: str, start_date=None, end_date=None, k: int = 10,
+                       exact: bool = False) -> Tuple[list, list]:
+        if (start_date is None or end_date is None or column_name not in DICTIONARY_COLUMNS or
+                (not exact and self.api._use_top_value_sketches(column_name, start_date, end_date)) or
+                not self._split(start_date, end_date)[2]):
+            return self.api.get_top_values(column_name, start_date, end_date, k, exact)
+        labels, values = self.get_statistic_data(column_name, start_date, end_date)
+        return top_with_other(list(zip(labels, values)), sum(values), k)
+
+    def get_routes_data(self, start_date, end_date, exact: bool = False, limit: int = None) -> List:
+        lower, upper, archived, live = self._split(start_date, end_date)
+        if not archived:
+            return self.api.get_routes_data(start_date, end_date, exact, limit)
+
+        data = self.archive.select(archived, self._columns("date", "path", "remote_address", "response_time"))
+        paths, response_times, weights = data["path"], data["response_time"], self._weights(data)
+        size = len(self.archive.dictionary("path")[0])
+        timed = ~np.isnan(response_times)
+        timed_weights = None if weights is None else weights[timed]
+        hits = np.bincount(paths, weights=weights, minlength=size)
+        response_time_sums = np.bincount(paths[timed], weights=response_times[timed] * (
+            1 if timed_weights is None else timed_weights), minlength=size)
+        response_time_counts = np.bincount(paths[timed], weights=timed_weights, minlength=size)
+        # Dates are sorted, the last occurrence of a path is its last request
+        reversed_codes, reversed_positions = np.unique(paths[::-1], return_index=True)
+        last_positions = len(paths) - 1 - reversed_positions
+
+        # path: [hits, response time sum, response time count, last requested]
+        routes = {}
+        last_requested = _to_datetimes(data["date"][last_positions])
+        for path, code, last in zip(self.archive.decode("path", reversed_codes), reversed_codes, last_requested):
+            routes[path] = [hits[code].item(), float(response_time_sums[code]), response_time_counts[code].item(), last]
+
+        for part_lower, part_upper in live:
+            for route in self.api.get_routes_data(part_lower, part_upper, exact):
+                entry = routes.setdefault(route.path, [0, 0.0, 0, None])
+                entry[0] += route.hits
+                if route.response_time_count:
+                    entry[1] += route.average_response_time * route.response_time_count
+                    entry[2] += route.response_time_count
+                if entry[3] is None or (route.last_requested is not None and route.last_requested > entry[3]):
+                    entry[3] = route.last_requested
+
+        if self.api._use_unique_sketches(start_date, end_date, exact):
+            unique_per_path = self.api.unique_sketches.count_per_path(lower, upper)
+        else:
+            live_visitors = self._live_distinct(live, ["path", "remote_address"])
+            live_paths, missing_paths = self.archive.encode("path", (row[0] for row in live_visitors))
+            live_addresses, _ = self.archive.encode("remote_address", (row[1] for row in live_visitors))
+            pairs = np.concatenate([(paths.astype(np.int64) << 32) | data["remote_address"],
+                                    (live_paths << 32) | live_addresses])
+            if weights is None:
+                pair_paths, unique_hits = np.unique(np.unique(pairs) >> 32, return_counts=True)
+            else:
+                pairs, pair_weights = min_per_key(pairs, np.concatenate([weights, list(live_visitors.values())]))
+                pair_paths, inverse = np.unique(pairs >> 32, return_inverse=True)
+                unique_hits = np.bincount(inverse, weights=pair_weights).round().astype(np.int64)
+            unique_per_path = dict(zip(self.archive.decode("path", pair_paths, missing_paths), unique_hits.tolist()))
+
+        rows = [RouteRow(path, round(hits), unique_per_path.get(path, 0), last_requested,
+                         response_time_sum / response_time_count if response_time_count else None, response_time_count)
+                for path, (hits, response_time_sum, response_time_count, last_requested) in routes.items()]
+        return sorted(rows, key=lambda row: row.hits, reverse=True)[:limit]
+
+    def get_user_chart_data(self, start_date, end_date, path: str = None, granularity: str = None,
+                            exact: bool = False) -> Tuple[List[dict], List[dict]]:
+        lower, upper = date_bounds(start_date, end_date)
+        if granularity is None:
+            granularity = auto_granularity(lower, upper)
+        _, _, archived, live = self._split(start_date, end_date, granularity)
+        if not archived:
+            return self.api.get_user_chart_data(start_date, end_date, path, granularity, exact)
+
+        use_sketches = (granularity in ("day", "week", "month") and
+                        self.api._use_unique_sketches(start_date, end_date, exact))
+
+        hits, unique_hits = defaultdict(int), defaultdict(int)
+        for part_lower, part_upper in live:
+            part_hits, part_unique_hits = self.api.get_user_chart_data(part_lower, part_upper, path, granularity,
+                                                                       exact)
+            for point in part_hits:
+                hits[point["x"]] += point["y"]
+            for point in part_unique_hits:
+                unique_hits[point["x"]] += point["y"] or 0
+
+        data = self.archive.select(archived, self._columns("date", "path", "remote_address"))
+        mask = self._path_mask(data["path"], path)
+        dates, visitors, weights = data["date"], data["remote_address"], self._weights(data)
+        if mask is not None:
+            dates, visitors = dates[mask], visitors[mask]
+            weights = None if weights is None else weights[mask]
+
+        buckets, inverse = np.unique(buckets_of(dates, granularity), return_inverse=True)
+        bucket_labels = [label(bucket, granularity) for bucket in _to_datetimes(buckets)]
+        for bucket_label, count in zip(bucket_labels, np.bincount(inverse, weights=weights, minlength=len(buckets))):
+            hits[bucket_label] += count.item()
+        if not use_sketches:
+            pairs = (inverse.astype(np.int64) << 32) | visitors
+            if weights is None:
+                counts = np.bincount(np.unique(pairs) >> 32, minlength=len(buckets))
+            else:
+                pairs, pair_weights = min_per_key(pairs, weights)
+                counts = np.bincount(pairs >> 32, weights=pair_weights, minlength=len(buckets))
+            for position, count in enumerate(counts):
+                unique_hits[bucket_labels[position]] += count.item()
+
+        labels = [label(bucket, granularity) for bucket in bucket_range(lower, upper, granularity)]
+        hits = [{"x": bucket_label, "y": round(hits.get(bucket_label, 0))} for bucket_label in labels]
+        if use_sketches:
+            unique_hits = self.api.unique_sketches.count_per_bucket(lower, upper, path, granularity)
+        else:
+            unique_hits = [{"x": bucket_label, "y": round(unique_hits.get(bucket_label, 0))} for bucket_label in labels]
+        return hits, unique_hits
+
+    def get_sampling_errors(self, start_date, end_date, path: str = None) -> Optional[Dict[str, Optional[float]]]:
+        if not self.api.weighted or start_date is None or end_date is None:
+            return self.api.get_sampling_errors(start_date, end_date, path)
+        _, _, archived, live = self._split(start_date, end_date)
+        if not archived:
+            return self.api.get_sampling_errors(start_date, end_date, path)
+
+        data = self.archive.select(archived, ["path", "remote_address", "sample_weight"])
+        mask = self._path_mask(data["path"], path)
+        visitors, weights = data["remote_address"], data["sample_weight"]
+        if mask is not None:
+            visitors, weights = visitors[mask], weights[mask]
+
+        # hits, squared weights, sample rate and largest weight per visitor, see sampling.error_bounds
+        live_rows = []
+        for part_lower, part_upper in live:
+            part = self.api._visitors(part_lower, part_upper, path)
+            live_rows += self.api.db.session.query(part.c.remote_address, part.c.hits, part.c.squared_weights,
+                                                   part.c.sample_rate, part.c.max_weight).all()
+        live_codes, _ = self.archive.encode("remote_address", (row[0] for row in live_rows))
+        live_values = np.array([row[1:] for row in live_rows], dtype=np.float64).reshape(-1, 4)
+
+        codes, inverse = np.unique(np.concatenate([visitors, live_codes]), return_inverse=True)
+        hits = np.bincount(inverse, weights=np.concatenate([weights, live_values[:, 0]]), minlength=len(codes))
+        squared_weights = np.bincount(inverse, weights=np.concatenate([weights * weights, live_values[:, 1]]),
+                                      minlength=len(codes))
+        sample_rates = np.zeros(len(codes))
+        np.maximum.at(sample_rates, inverse, np.concatenate([1 / weights, live_values[:, 2]]))
+        max_weights = np.zeros(len(codes))
+        np.maximum.at(max_weights, inverse, np.concatenate([weights, live_values[:, 3]]))
+
+        clustered = self.api.sampling.per_visitor
+        hits_variance = (((1 - 1 / max_weights) * hits * hits).sum() if clustered else
+                         (squared_weights - hits).sum())
+        return bounds(float(hits_variance), float(((1 / sample_rates) * (1 / sample_rates - 1)).sum()), clustered)
+
+    def export(self, month: datetime.datetime, chunk_size: int = 10000) -> int:
+        """ Export the hits of a month into the archive. Returns the number of hits. """
+        lower, upper = month, next_bucket(month, "month")
+        source = self.api._source(lower, upper)
+        query = self.api.db.session.query(*[getattr(source, column) for column in ARCHIVE_COLUMNS])
+        query = self.api._add_date_filter_to_query(query, lower, upper, source).order_by(source.date)
+        rows = iter(query.yield_per(chunk_size))
+        chunks = iter(lambda: self.api.decode_rows(ARCHIVE_COLUMNS, list(islice(rows, chunk_size))), [])
+        return self.archive.export(month, chunks)
+
+    def export_closed_months(self, force: bool = False, chunk_size: int = 10000) -> List[str]:
+        """ Export every month which ended before today and holds hits. Returns the changes made.
+
+            :param force: export months again which were exported before
+        """
+        first_date = self.api.get_first_date()
+        if first_date is None:
+            return []
+
+        today = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+        exported = self.archive.months()
+        changes = []
+        for month in bucket_range(truncate(first_date, "month"), today, "month"):
+            if next_bucket(month, "month") > today or (month in exported and not force):
+                continue
+            hits = self.export(month, chunk_size)
+            if hits:
+                changes.append(f"exported {hits} hits of {month:%Y-%m}")
+        return changes
@@ -0,0 +1,92 @@
+""" The Dash dashboard of a DashStatistics instance. Imported on demand, as dash, plotly and pandas take a while to
+    import and a host app only needs them once the dashboard is opened.
+"""
+import datetime
+
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import flask
+from dash.dependencies import Input, Output, State
+
+from . import export, index_view, live_view, route_view, utils
+
+
+def create_dash_app(stats, server: flask.Flask) -> dash.Dash:
+    """Create a Plotly Dash dashboard."""
+    dash_app = dash.Dash(
+        name=__name__,
+        server=server,
+        routes_pathname_prefix=stats.prefix,
+        external_stylesheets=[
+            {
+                'href': 'https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/css/bootstrap.min.css',
+                'rel': 'stylesheet',
+                'integrity': 'sha384-MCw98/SFnGE8fJT3GXwEOngsV7Zt27NXFoaoApmYm81iuXoPkFOJwJ8ERdknLPMO',
+                'crossorigin': 'anonymous'
+            }
+        ],
+        external_scripts=[
+            {
+                'src': 'https://cdn.jsdelivr.net/npm/bootstrap@5.0.0-beta3/dist/js/bootstrap.bundle.min.js',
+                'integrity': 'sha384-JEW9xMcG8R+pH31jmWH6WWP0WintQrMb4s7ZOdauHnUtxwoG2vI5DkLtS3qm9Ekf',
+                'crossorigin': 'anonymous'
+            }
+        ],
+        meta_tags=[
+            {"name": "viewport", "content": "width=device-width, initial-scale=1"}
+        ],
+    )
+    dash_app.title = f"{stats.app_name} - Statistics"
+    dash_app.layout = html.Div([
+        dcc.Location(id='url', refresh=False),
+        html.Div(id='page-content')
+    ])
+    export.register_endpoint(stats, server)
+
+    return dash_app
+
+
+def register_callbacks(stats, dash_app: dash.Dash) -> None:
+    index_view.callbacks(dash_app, stats.api, stats.prefix, stats.top_k, stats.route_limit, stats.charts)
+    route_view.callbacks(dash_app, stats.api, stats.prefix, stats.charts)
+    utils.chart_callbacks(dash_app, stats.api, stats.charts)
+    if stats.live is not None:
+        live_view.callbacks(dash_app, stats.live)
+
+    @dash_app.callback(Output('page-content', 'children'),
+                       [Input('url', 'pathname'), State("url", "search")])
+    def display_page(pathname, search):
+        print(pathname)
+        print(search)
+        if pathname == stats.prefix + "live":
+            return live_view.view(stats.live, stats.prefix, stats.live_interval)
+        elif stats.prefix == pathname and "path" not in search:
+            return index_view.view(stats.api, None, datetime.datetime.now(), stats.prefix, stats.top_k,
+                                   stats.route_limit, stats.charts)
+        elif "?path=" in search:
+            return route_view.view(stats.api, None, datetime.datetime.now(), search.split("?path=")[1], stats.prefix,
+                                   stats.charts)
+        else:
+            return index_view.view(stats.api, None, datetime.datetime.now(), stats.prefix, stats.top_k,
+                                   stats.route_limit, stats.charts)
+
+
+def create_server(stats, record_hits: bool = True) -> flask.Flask:
+    """ Flask app serving only the dashboard, with the configuration and statistics database of the host app
+
+        :param record_hits: record the dashboard's own requests like the host app does
+    """
+    server = flask.Flask(stats.app.import_name, root_path=stats.app.root_path)
+    server.config.update(stats.app.config)
+    server.logger.setLevel(stats.app.logger.level)
+    stats.db.init_app(server)
+    if record_hits:
+        server.before_request(stats.before_request)
+        server.after_request(stats.after_request)
+        server.teardown_request(stats.teardown_request)
+
+    stats.dash_app = create_dash_app(stats, server)
+    register_callbacks(stats, stats.dash_app)
+    return server
+
@@ -0,0 +1,125 @@
+import threading
+
+import flask
+from flask_sqlalchemy import Model, SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+# Key of the statistics database in SQLALCHEMY_BINDS
+BIND_KEY = "statistics"
+DEFAULT_URI = "sqlite:///statistics.db"
+
+# Applied to every new SQLite connection. WAL lets the dashboard read while hits are written,
+# synchronous=NORMAL only syncs at checkpoints in WAL mode, a negative cache_size is in KiB.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+class StatisticsModel(Model):
+    """ Base class of the dash-statistics models, which all live in the statistics bind """
+    __bind_key__ = BIND_KEY
+
+
+class StatisticsSession(SignallingSession):
+    """ Session of the statistics database, which resolves the statistics bind through the dash-statistics
+        SQLAlchemy instance even if the host app's own instance is the one registered on the app
+    """
+
+    def __init__(self, db: "StatisticsSQLAlchemy", autocommit=False, autoflush=True, **options):
+        self.statistics_db = db
+        engine = db.get_engine(db.get_app(), bind=BIND_KEY)
+        # sessionmaker passes bind=None explicitly
+        if options.get("bind") is None:
+            options["bind"] = engine
+        options.setdefault("binds", {table: engine for table in db.get_tables_for_bind(BIND_KEY)})
+        super().__init__(db, autocommit=autocommit, autoflush=autoflush, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if mapper is not None and mapper.persist_selectable.info.get("bind_key") == BIND_KEY:
+            return self.statistics_db.get_engine(self.app, bind=BIND_KEY)
+        return super().get_bind(mapper, clause)
+
+
+class StatisticsSQLAlchemy(SQLAlchemy):
+    """ SQLAlchemy instance of the statistics database, stored in its own bind so that it neither shares tables nor
+        the engine configuration with an SQLAlchemy instance of the host app.
+
+        :param uri: database of the bind, unless app.config["SQLALCHEMY_BINDS"]["statistics"] is set
+        :param engine_options: keyword arguments for sqlalchemy.create_engine of the bind
+        :param pool_size: number of pooled connections, SQLite files are pooled with a QueuePool when it is set
+        :param sqlite_pragmas: pragmas set on every new SQLite connection. Default: SQLITE_PRAGMAS
+    """
+
+    def __init__(self, app: flask.Flask = None, uri: str = DEFAULT_URI, engine_options: dict = None,
+                 pool_size: int = None, sqlite_pragmas: dict = None, **kwargs):
+        self.uri = uri
+        self.bind_engine_options = engine_options or {}
+        self.pool_size = pool_size
+        self.sqlite_pragmas = SQLITE_PRAGMAS if sqlite_pragmas is None else sqlite_pragmas
+        self._bind_engines = {}
+        self._bind_lock = threading.Lock()
+
+        kwargs.setdefault("model_class", StatisticsModel)
+        super().__init__(app, **kwargs)
+
+    def init_app(self, app: flask.Flask) -> None:
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.setdefault(BIND_KEY, self.uri)
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+        # Leave the host app's SQLAlchemy instance registered, the statistics bind doesn't depend on it
+        state = app.extensions.get("sqlalchemy")
+        super().init_app(app)
+        if state is not None:
+            app.extensions["sqlalchemy"] = state
+
+    def create_session(self, options: dict) -> orm.sessionmaker:
+        return orm.sessionmaker(class_=StatisticsSession, db=self, **options)
+
+    def get_engine(self, app: flask.Flask = None, bind: str = None) -> Engine:
+        if bind != BIND_KEY:
+            return super().get_engine(app, bind)
+
+        app = self.get_app(app)
+        uri = app.config["SQLALCHEMY_BINDS"][BIND_KEY]
+        with self._bind_lock:
+            cached = self._bind_engines.get(app)
+            if cached is None or cached[0] != uri:
+                cached = self._bind_engines[app] = (uri, self.create_bind_engine(app, uri))
+            return cached[1]
+
+    def create_bind_engine(self, app: flask.Flask, uri: str) -> Engine:
+        sa_url = make_url(uri)
+        options = {}
+        if self.pool_size is not None:
+            options["pool_size"] = self.pool_size
+            if sa_url.drivername == "sqlite" and sa_url.database not in (None, "", ":memory:"):
+                # pysqlite doesn't pool connections to files by default
+                options["poolclass"] = QueuePool
+                options["connect_args"] = {"check_same_thread": False}
+
+        # Makes relative SQLite paths relative to the app's root path
+        sa_url, options = self.apply_driver_hacks(app, sa_url, options)
+        if app.config.get("SQLALCHEMY_ECHO"):
+            options["echo"] = True
+        options.update(self.bind_engine_options)
+
+        engine = self.create_engine(sa_url, options)
+        if engine.dialect.name == "sqlite" and self.sqlite_pragmas:
+            event.listen(engine, "connect", self._set_sqlite_pragmas)
+        return engine
+
+    def _set_sqlite_pragmas(self, dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
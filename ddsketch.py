@@ -0,0 +1,169 @@
+import math
+import struct
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Percentiles shown on the dashboard
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Values up to this are counted as zero, their logarithm isn't usable
+MIN_VALUE = 1e-9
+
+# relative accuracy, max bins, zero count, count, sum, min, max, number of bins
+_HEADER = struct.Struct("<dIQQdddI")
+
+
+class DDSketch:
+    """ DDSketch quantile sketch of positive values, e.g. response times.
+
+        Values are counted in logarithmically sized bins, so every quantile is answered with a relative error of at
+        most relative_accuracy (1% by default), however skewed the values are. Sketches of the same accuracy can be
+        merged, the merged sketch answers the quantiles of all their values. Once there are more than max_bins bins,
+        the lowest ones are collapsed, which only affects the accuracy of the lowest quantiles.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        """ Value representing a bin, within relative_accuracy of all values in it """
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _collapse(self) -> None:
+        if len(self.bins) <= self.max_bins:
+            return
+        keys = sorted(self.bins)
+        lowest = keys[-self.max_bins]
+        self.bins[lowest] += sum(self.bins.pop(key) for key in keys[:-self.max_bins])
+
+    def add(self, value: float, count: int = 1) -> None:
+        """ :param count: number of times the value occurred, e.g. the rounded sample weight of a hit """
+        if count <= 0:
+            return
+        if value <= MIN_VALUE:
+            self.zero_count += count
+        else:
+            key = self._key(value)
+            if key in self.bins:
+                self.bins[key] += count
+            else:
+                self.bins[key] = count
+                self._collapse()
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def add_many(self, values: Iterable[float], counts: Iterable[int] = None) -> None:
+        """ :param counts: number of times each value occurred, default once """
+        values = np.asarray(values, dtype=np.float64)
+        counts = np.ones(len(values), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        values, counts = values[counts > 0], counts[counts > 0]
+        if not len(values):
+            return
+
+        is_positive = values > MIN_VALUE
+        keys, inverse = np.unique(np.ceil(np.log(values[is_positive]) / self._log_gamma).astype(np.int64),
+                                  return_inverse=True)
+        key_counts = np.bincount(inverse, weights=counts[is_positive], minlength=len(keys)).astype(np.int64)
+        for key, count in zip(keys.tolist(), key_counts.tolist()):
+            self.bins[key] = self.bins.get(key, 0) + count
+        self._collapse()
+
+        total = int(counts.sum())
+        self.zero_count += total - int(counts[is_positive].sum())
+        self.count += total
+        self.sum += float(np.dot(values, counts))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def add_bin(self, key: Optional[int], count: int, total: float, minimum: float, maximum: float) -> None:
+        """ Add the values of a bin at once, e.g. binned by the database
+
+            :param key: key of the bin (ceil(log(value) / log(gamma))), None for values counted as zero
+            :param total: sum of the values, each counted count times
+        """
+        if count <= 0:
+            return
+        if key is None:
+            self.zero_count += count
+        else:
+            self.bins[key] = self.bins.get(key, 0) + count
+            self._collapse()
+        self.count += count
+        self.sum += total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        """ Merge other into this sketch """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches of the same relative accuracy")
+        bins = self.bins
+        for key, count in other.bins.items():
+            bins[key] = bins.get(key, 0) + count
+        self._collapse()
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ Estimated q-quantile (0 <= q <= 1) of the added values, None if there are none """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0.0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # The extreme values are known exactly
+                return min(max(self._value(key), self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs: Iterable[float] = PERCENTILES) -> List[Optional[float]]:
+        return [self.quantile(q) for q in qs]
+
+    def to_bytes(self) -> bytes:
+        bins = len(self.bins)
+        return (_HEADER.pack(self.relative_accuracy, self.max_bins, self.zero_count, self.count, self.sum,
+                             self.min, self.max, bins)
+                + struct.pack(f"<{bins}i{bins}Q", *self.bins.keys(), *self.bins.values()))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DDSketch":
+        relative_accuracy, max_bins, zero_count, count, total, minimum, maximum, bins = _HEADER.unpack_from(data)
+        sketch = cls(relative_accuracy, max_bins)
+        values = struct.unpack_from(f"<{bins}i{bins}Q", data, _HEADER.size)
+        sketch.bins = dict(zip(values[:bins], values[bins:]))
+        sketch.zero_count = zero_count
+        sketch.count = count
+        sketch.sum = total
+        sketch.min = minimum
+        sketch.max = maximum
+        return sketch
@@ -0,0 +1,171 @@
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import flask
+
+from .geo import GEO_COLUMNS, GeoResolver
+from .lru import LRUCache, MISSING
+
+# User agent fragments of crawlers, link previews, monitoring and http libraries
+BOT_PATTERNS = ("bot", "crawl", "spider", "slurp", "archiver", "facebookexternalhit", "embedly", "preview",
+                "headless", "phantomjs", "lighthouse", "pingdom", "uptime", "monitor", "curl", "wget",
+                "python-requests", "python-urllib", "aiohttp", "httpclient", "okhttp", "go-http-client", "java/",
+                "libwww", "scrapy")
+
+
+def parse_user_agent(user_agent: str) -> Dict[str, str]:
+    """ browser and platform columns of a user agent """
+    parsed = flask.Request.user_agent_class(user_agent)
+    return {"browser": "{browser} {version}".format(browser=parsed.browser, version=parsed.version),
+            "platform": parsed.platform}
+
+
+class EnrichmentStage:
+    """ Derives columns of a hit from one of its columns, e.g. browser and platform from the user agent.
+        Results are memoized per input value in a bounded LRU cache, since few values make up most of the hits.
+
+        Subclasses set name, input and columns and implement derive(), or pass a function.
+
+        :param maxsize: cached inputs, None disables the cache
+        :param function: derive(value) for stages which aren't subclassed
+    """
+
+    name = "stage"
+    # Column the stage derives its columns from
+    input = "user_agent"
+    # Columns the stage sets, it is skipped for hits which have all of them already
+    columns = ()
+
+    def __init__(self, maxsize: Optional[int] = 4096, function=None, name: str = None, input: str = None,
+                 columns: Iterable[str] = None):
+        self.cache = LRUCache(maxsize) if maxsize else None
+        self.function = function
+        self.name = name or self.name
+        self.input = input or self.input
+        self.columns = tuple(columns) if columns is not None else self.columns
+
+        self.rows = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def derive(self, value) -> Optional[dict]:
+        """ {column: value} of an input value, None if it can't be derived right now (which isn't cached) """
+        return self.function(value)
+
+    def _derived(self, value) -> Optional[dict]:
+        if self.cache is None:
+            return self.derive(value)
+        derived = self.cache.get(value, MISSING)
+        if derived is MISSING:
+            derived = self.derive(value)
+            if derived is not None:
+                self.cache.put(value, derived)
+        return derived
+
+    def enrich(self, rows: List[dict]) -> None:
+        started = time.perf_counter()
+        enriched = errors = 0
+        error = None
+        for row in rows:
+            if self.columns and all(column in row for column in self.columns):
+                continue
+            try:
+                row.update(self._derived(row.get(self.input)) or {})
+                enriched += 1
+            except Exception as e:
+                errors += 1
+                error = str(e)
+
+        with self._lock:
+            self.rows += enriched
+            self.errors += errors
+            self.last_error = error or self.last_error
+            self.seconds += time.perf_counter() - started
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"rows": self.rows, "seconds": self.seconds, "errors": self.errors, "last_error": self.last_error}
+        stats.update(self.cache_stats())
+        if "hits" in stats:
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        return stats
+
+
+class UserAgentStage(EnrichmentStage):
+    name = "user_agent"
+    input = "user_agent"
+    columns = ("browser", "platform")
+
+    def derive(self, value) -> Optional[dict]:
+        return parse_user_agent(value or "")
+
+
+class BotStage(EnrichmentStage):
+    """ Flags hits of crawlers and other non-human user agents in the is_bot column. Hits without a user agent are
+        bots, too.
+
+        :param patterns: case insensitive user agent fragments of bots
+    """
+
+    name = "bot"
+    input = "user_agent"
+    columns = ("is_bot",)
+
+    def __init__(self, patterns: Iterable[str] = BOT_PATTERNS, maxsize: Optional[int] = 4096):
+        super().__init__(maxsize)
+        self.pattern = re.compile("|".join(re.escape(pattern) for pattern in patterns), re.IGNORECASE)
+
+    def derive(self, value) -> Optional[dict]:
+        return {"is_bot": not value or self.pattern.search(value) is not None}
+
+
+class GeoStage(EnrichmentStage):
+    """ Fills the geo columns with a GeoResolver, which caches its lookups itself (see CachedGeoResolver) """
+
+    name = "geo"
+    input = "remote_address"
+    columns = tuple(GEO_COLUMNS)
+
+    def __init__(self, resolver: GeoResolver, maxsize: Optional[int] = None):
+        super().__init__(maxsize)
+        self.resolver = resolver
+
+    def derive(self, value) -> Optional[dict]:
+        return self.resolver.resolve(value)
+
+    def cache_stats(self) -> dict:
+        return super().cache_stats() if self.cache is not None else self.resolver.stats()
+
+
+class EnrichmentPipeline:
+    """ Ordered stages deriving the columns of hits which aren't known while the request is served. The writers run it
+        on the rows they store, so it is off the request thread unless hits are written synchronously.
+    """
+
+    def __init__(self, stages: Iterable[EnrichmentStage]):
+        self.stages = list(stages)
+
+    def enrich(self, rows: List[dict], skip: Iterable[str] = ()) -> List[dict]:
+        """ Add the derived columns to the rows in place
+
+            :param skip: names of stages not to run, e.g. ("geo",)
+        """
+        for stage in self.stages:
+            if stage.name not in skip:
+                stage.enrich(rows)
+        return rows
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+
+def default_stages(geo_resolver: GeoResolver) -> List[EnrichmentStage]:
+    return [UserAgentStage(), BotStage(), GeoStage(geo_resolver)]
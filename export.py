@@ -0,0 +1,102 @@
+""" Streaming export of the raw hits as CSV or NDJSON, served under the dashboard's prefix and by
+    `flask statistics export`. Rows are read with server side cursors in chunks and encoded chunk by chunk, so memory
+    stays flat however many hits are exported.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+from typing import Iterable, Iterator, List
+
+import flask
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_chunks(columns: List[str], chunks: Iterable[List[tuple]], export_format: str) -> Iterator[bytes]:
+    """ Encoded bytes of every chunk of rows, CSV starts with a header """
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows([value.isoformat() if isinstance(value, datetime.datetime) else value
+                              for value in row] for row in chunk)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+    elif export_format == "ndjson":
+        for chunk in chunks:
+            yield "".join(json.dumps(dict(zip(columns, row)), default=_json_default) + "\n"
+                          for row in chunk).encode("utf-8")
+    else:
+        raise ValueError(f"Unknown export format: {export_format!r}")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """ A gzip stream of the chunks, compressed as they come """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(api, start_date, end_date, columns: List[str], path: str = None, export_format: str = "csv",
+                  compress: bool = False, chunk_size: int = 10000) -> Iterator[bytes]:
+    chunks = encode_chunks(columns, api.iter_requests(start_date, end_date, columns, path, chunk_size), export_format)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def _parse_date(value: str, default: datetime.date) -> datetime.date:
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date() if value else default
+
+
+def register_endpoint(stats, server: flask.Flask) -> None:
+    """ Serve the export under prefix + "export", e.g.
+        /statistics/export?start=2021-01-01&end=2021-01-31&path=/&columns=date,path,status_code&format=ndjson
+    """
+
+    def export():
+        args = flask.request.args
+        export_format = args.get("format", "csv")
+        if export_format not in FORMATS:
+            flask.abort(400, f"Unknown format {export_format!r}, use one of {', '.join(FORMATS)}")
+
+        available = stats.api.export_columns()
+        columns = [column for column in args.get("columns", "").split(",") if column] or available
+        unknown = [column for column in columns if column not in available]
+        if unknown:
+            flask.abort(400, f"Unknown columns {', '.join(unknown)}, use some of {', '.join(available)}")
+
+        today = datetime.datetime.utcnow().date()
+        try:
+            end_date = _parse_date(args.get("end"), today)
+            start_date = _parse_date(args.get("start"), None)
+        except ValueError:
+            flask.abort(400, "Dates must be formatted as YYYY-MM-DD")
+        if start_date is None:
+            first_date = stats.api.get_first_date()
+            start_date = first_date.date() if first_date is not None else today
+
+        compress = "gzip" in flask.request.headers.get("Accept-Encoding", "")
+        chunks = export_chunks(stats.api, start_date, end_date, columns, args.get("path"), export_format, compress)
+        response = flask.Response(flask.stream_with_context(chunks), mimetype=FORMATS[export_format])
+        response.headers["Content-Disposition"] = (f"attachment; filename=statistics_{start_date}_{end_date}."
+                                                   f"{export_format}")
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    server.add_url_rule(stats.prefix + "export", "dash_statistics_export", export)
@@ -0,0 +1,232 @@
+import concurrent.futures
+import csv
+import functools
+import ipaddress
+import json
+import mmap
+import struct
+import threading
+from typing import Optional
+
+import requests
+
+from .lru import LRUCache, MISSING
+
+GEO_COLUMNS = ["user_country_code", "user_country_name", "user_region_code", "user_region_name", "user_city",
+               "user_zip_code", "user_time_zone", "user_latitude", "user_longitude"]
+
+
+class GeoResolver:
+    """ Base class for geo ip backends.
+
+        resolve() returns a dict with (a subset of) the GEO_COLUMNS, an empty dict if nothing is known about the ip,
+        or None if the lookup failed temporarily and may be retried.
+    """
+
+    def resolve(self, ip: str) -> Optional[dict]:
+        return {}
+
+    def stats(self) -> dict:
+        return {}
+
+
+class CachedGeoResolver(GeoResolver):
+    """ Puts a bounded LRU cache per ip in front of another resolver """
+
+    def __init__(self, resolver: GeoResolver, maxsize: int = 10000):
+        self.resolver = resolver
+        self.cache = LRUCache(maxsize)
+
+    def resolve(self, ip: str) -> Optional[dict]:
+        result = self.cache.get(ip, MISSING)
+        if result is MISSING:
+            result = self.resolver.resolve(ip)
+            if result is not None:
+                self.cache.put(ip, result)
+        return result
+
+    def stats(self) -> dict:
+        return {**self.resolver.stats(), **self.cache.stats()}
+
+
+# File layout of the local database:
+#   MAGIC | uint32 number of ranges | ranges | locations
+#   range:    16 byte start ip | 16 byte end ip | uint32 location offset | uint32 location length
+#   location: json array with the values of GEO_COLUMNS
+# IPv4 addresses are stored as IPv4-mapped IPv6 addresses, so all ips compare as 16 byte big endian strings.
+MAGIC = b"DSGEO001"
+_HEADER = struct.Struct(">8sI")
+_RANGE = struct.Struct(">16s16sII")
+
+
+def _packed(ip: str) -> bytes:
+    address = ipaddress.ip_address(ip)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b"\x00" * 10 + b"\xff\xff" + address.packed)
+    return address.packed
+
+
+class LocalGeoResolver(GeoResolver):
+    """ Resolves ips with a local ip range database (see build_database), which is memory mapped and
+        binary searched, so lookups work offline and without loading the file into memory
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a dash-statistics geo database")
+
+    def _start(self, i: int) -> bytes:
+        offset = _HEADER.size + i * _RANGE.size
+        return self._mm[offset:offset + 16]
+
+    def resolve(self, ip: str) -> Optional[dict]:
+        try:
+            key = _packed(ip)
+        except ValueError:
+            return {}
+
+        # Last range which starts at or before the ip
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._start(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return {}
+
+        _, end, offset, length = _RANGE.unpack_from(self._mm, _HEADER.size + (lo - 1) * _RANGE.size)
+        if key > end:
+            return {}
+
+        values = json.loads(self._mm[offset:offset + length])
+        return {column: value for column, value in zip(GEO_COLUMNS, values) if value is not None}
+
+
+def build_database(csv_path: str, out_path: str) -> int:
+    """ Convert a csv file with the columns ip_start, ip_end followed by the GEO_COLUMNS
+        (country code, country name, region code, region name, city, zip code, time zone, latitude, longitude)
+        into the file format read by LocalGeoResolver. Returns the number of ranges.
+    """
+    ranges = []
+    locations = {}
+    blob = bytearray()
+
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            try:
+                start, end = _packed(row[0].strip()), _packed(row[1].strip())
+            except ValueError:
+                continue  # header line
+
+            values = [value.strip() or None for value in row[2:2 + len(GEO_COLUMNS)]]
+            values += [None] * (len(GEO_COLUMNS) - len(values))
+            for i in (-2, -1):
+                values[i] = None if values[i] is None else float(values[i])
+
+            location = json.dumps(values, separators=(",", ":")).encode("utf-8")
+            if location not in locations:
+                locations[location] = len(blob)
+                blob += location
+            ranges.append((start, end, locations[location], len(location)))
+
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(f"Overlapping ip ranges in {csv_path}")
+
+    blob_offset = _HEADER.size + len(ranges) * _RANGE.size
+    with open(out_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(ranges)))
+        for start, end, offset, length in ranges:
+            f.write(_RANGE.pack(start, end, blob_offset + offset, length))
+        f.write(blob)
+
+    return len(ranges)
+
+
+class RemoteGeoResolver(GeoResolver):
+    """ Looks ips up with a freegeoip compatible http api on a thread pool.
+
+        resolve() waits at most `wait` seconds for the answer (by default it doesn't wait) and returns None if it isn't
+        there yet, so the hit is stored without geo data. Lookups keep running and their result is returned the next
+        time the same ip is resolved.
+
+        :param timeout: seconds after which an http request is given up
+        :param wait: seconds resolve() waits for a lookup which isn't finished
+        :param max_results: finished lookups kept until their ip is resolved again
+    """
+
+    def __init__(self, url: str = "https://freegeoip.app/json/{0}", timeout: float = 2.0, max_workers: int = 4,
+                 wait: float = 0.0, max_results: int = 10000):
+        self.url = url
+        self.timeout = timeout
+        self.wait = wait
+        self.timeouts = 0
+        self.errors = 0
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix="dash-statistics-geo")
+        self._pending = {}
+        self._results = LRUCache(max_results)
+        self._lock = threading.Lock()
+
+    def _lookup(self, ip: str) -> Optional[dict]:
+        # the api does not work with '127.0.0.1' but with "" for the localhost
+        ip = ip if ip != "127.0.0.1" else ""
+
+        with requests.get(self.url.format(ip), timeout=self.timeout) as req:
+            if req.status_code == 403:  # 403 means rate limit was reached
+                return None
+            resp = req.json()
+
+        none_if_empty = lambda s: None if resp.get(s) == "" else resp.get(s)  # noqa F731
+        return {column: none_if_empty(column[len("user_"):]) for column in GEO_COLUMNS}
+
+    def _finished(self, ip: str, future: concurrent.futures.Future) -> None:
+        """ Done callback of a lookup, keeps its result for the next resolve() of the ip """
+        with self._lock:
+            self._pending.pop(ip, None)
+        try:
+            result = future.result()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        # Failed lookups (None) are tried again
+        if result is not None:
+            self._results.put(ip, result)
+
+    def resolve(self, ip: str) -> Optional[dict]:
+        result = self._results.get(ip, MISSING)
+        if result is not MISSING:
+            return result
+
+        with self._lock:
+            future = self._pending.get(ip)
+            submitted = future is None
+            if submitted:
+                future = self._pending[ip] = self._executor.submit(self._lookup, ip)
+        if submitted:
+            # Outside of the lock, the callback runs right away if the lookup already finished
+            future.add_done_callback(functools.partial(self._finished, ip))
+
+        try:
+            return future.result(timeout=self.wait)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+        except Exception:
+            pass
+        return None
+
+    def stats(self) -> dict:
+        return {"timeouts": self.timeouts, "errors": self.errors, "pending": len(self._pending),
+                "results": len(self._results)}
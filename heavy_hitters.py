@@ -0,0 +1,83 @@
+import heapq
+import json
+import zlib
+from typing import Dict, Hashable, List, Tuple
+
+# Label of the values outside the top k
+OTHER = "Other"
+
+
+class HeavyHitters:
+    """ Approximate counts of the most frequent values in a fixed amount of memory, with at most `capacity` counters.
+
+        This is the Misra-Gries form of the Space-Saving summary, which stays mergeable with guaranteed bounds: when
+        more than capacity values are counted, the (capacity + 1)th largest count is subtracted from all counters and
+        the ones dropping to zero are removed. Every count is a lower bound of the value's true count and at most
+        `error` <= (total - sum of counts) / (capacity + 1) below it, so any value with more than total / (capacity + 1)
+        hits is kept. Merged summaries bound the counts of all their hits the same way.
+
+        Counts may be float, e.g. sums of sample weights.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[Hashable, float] = {}
+        self.total = 0.0
+        # Subtracted from every counter so far: the maximum undercount
+        self.error = 0.0
+
+    def add(self, value: Hashable, count: float = 1) -> None:
+        self.counts[value] = self.counts.get(value, 0) + count
+        self.total += count
+        # Prune in batches, amortizing the selection of the threshold
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self) -> None:
+        if len(self.counts) <= self.capacity:
+            return
+        threshold = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+        self.counts = {value: count - threshold for value, count in self.counts.items() if count > threshold}
+        self.error += threshold
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        """ Merge other into this summary """
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        self.total += other.total
+        self.error += other.error
+        self._prune()
+        return self
+
+    def top(self, k: int) -> List[Tuple[Hashable, float]]:
+        """ The (up to) k values with the largest counts and their counts, largest first """
+        self._prune()
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+    def to_bytes(self) -> bytes:
+        self._prune()
+        return zlib.compress(json.dumps([self.capacity, self.total, self.error, list(self.counts),
+                                         list(self.counts.values())]).encode("utf-8"))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HeavyHitters":
+        capacity, total, error, values, counts = json.loads(zlib.decompress(data))
+        summary = cls(capacity)
+        summary.counts = dict(zip(values, counts))
+        summary.total = total
+        summary.error = error
+        return summary
+
+
+def top_with_other(counts: List[Tuple[Hashable, float]], total: float, k: int) -> Tuple[list, list]:
+    """ Labels and values of the top k of (value, count) pairs, largest first, followed by OTHER with the rest of the
+        total if there is a rest. The None value (hits without a value) is left out, it must not be part of total.
+    """
+    top = sorted(((value, count) for value, count in counts if value is not None), key=lambda item: item[1],
+                 reverse=True)[:k]
+    labels, values = [value for value, _ in top], [round(count) for _, count in top]
+    rest = round(total - sum(count for _, count in top))
+    if rest > 0:
+        labels.append(OTHER)
+        values.append(rest)
+    return labels, values
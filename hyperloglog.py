@@ -0,0 +1,75 @@
+import hashlib
+import math
+
+import numpy as np
+
+# Flag in the precision byte of serialized sketches which only store their non-zero registers
+SPARSE = 0x80
+
+
+class HyperLogLog:
+    """ HyperLogLog sketch estimating the number of distinct items in a fixed amount of memory.
+
+        Uses 2 ** precision one byte registers, the standard error is about 1.04 / sqrt(2 ** precision),
+        e.g. 1.6% for the default precision of 12 (4 KiB). Sketches of the same precision can be merged,
+        the merged sketch estimates the number of distinct items of their union.
+    """
+
+    def __init__(self, precision: int = 12, registers: np.ndarray = None):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8) if registers is None else registers
+
+    @staticmethod
+    def relative_error(precision: int) -> float:
+        return 1.04 / math.sqrt(1 << precision)
+
+    def add(self, item: str) -> None:
+        h = int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1 bit in the remaining 64 - precision bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """ Merge other into this sketch """
+        if other.precision != self.precision:
+            raise ValueError("Can only merge sketches of the same precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> float:
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(self.m, 0.7213 / (1 + 1.079 / self.m))
+        estimate = alpha * self.m * self.m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return float(estimate)
+
+    def to_bytes(self) -> bytes:
+        """ The precision and the registers, or if few registers are set (e.g. sketches of an hour) the precision
+            flagged with SPARSE and index << 6 | value of every set register as 4 byte integers
+        """
+        indices = np.flatnonzero(self.registers)
+        if 4 * len(indices) < self.m:
+            # Register values are at most 64 - precision + 1 < 2 ** 6
+            entries = (indices.astype("<u4") << 6) | self.registers[indices]
+            return bytes([self.precision | SPARSE]) + entries.astype("<u4").tobytes()
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        if data[0] & SPARSE:
+            precision = data[0] & ~SPARSE
+            entries = np.frombuffer(data, dtype="<u4", offset=1)
+            registers = np.zeros(1 << precision, dtype=np.uint8)
+            registers[entries >> 6] = entries & 0x3f
+            return cls(precision, registers)
+        return cls(data[0], np.frombuffer(data, dtype=np.uint8, offset=1).copy())
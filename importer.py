@@ -0,0 +1,232 @@
+import collections
+import datetime
+import functools
+import gzip
+import itertools
+import multiprocessing
+import os
+import re
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from . import enrichment, meta
+
+# nginx/Apache "combined" log format, optionally followed by the request time in seconds (nginx $request_time).
+# Quotes within quoted fields are escaped as \" (Apache) or \x22 (nginx).
+COMBINED_PATTERN = re.compile(
+    r'(?P<remote_address>\S+) \S+ \S+ \[(?P<date>[^\]]+)\] "(?P<request>(?:[^"\\]|\\.)*)" '
+    r'(?P<status_code>\d{3}) (?P<size>\d+|-)'
+    r'(?: "(?P<referrer>(?:[^"\\]|\\.)*)" "(?P<user_agent>(?:[^"\\]|\\.)*)")?'
+    r'(?: (?P<response_time>\d+(?:\.\d+)?))?')
+
+MONTHS = {name: number for number, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1)}
+
+# Columns identifying a hit for deduplication, dates are compared to the second as logs don't have more
+DEDUP_COLUMNS = ("date", "remote_address", "method", "path", "status_code", "size", "user_agent")
+
+
+def parse_date(value: str) -> datetime.datetime:
+    """ UTC date of a log timestamp like 10/Oct/2000:13:55:36 -0700 """
+    date = datetime.datetime(int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]),
+                             int(value[12:14]), int(value[15:17]), int(value[18:20]))
+    sign = -1 if value[21] == "-" else 1
+    offset = datetime.timedelta(hours=int(value[22:24]), minutes=int(value[24:26]))
+    return date - sign * offset
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_user_agent(user_agent: str) -> Tuple[str, str]:
+    """ browser and platform columns of a user agent, as the enrichment pipeline stores them """
+    parsed = enrichment.parse_user_agent(user_agent)
+    return parsed["browser"], parsed["platform"]
+
+
+def _unescape(value: Optional[str]) -> Optional[str]:
+    return None if value is None else value.replace('\\"', '"').replace("\\x22", '"')
+
+
+def parse_line(line: str) -> Optional[dict]:
+    """ Hit of a log line, without geo data. None if the line can't be parsed. """
+    match = COMBINED_PATTERN.match(line)
+    if match is None:
+        return None
+    request = match.group("request").split()
+    if len(request) < 2:
+        return None
+
+    try:
+        date = parse_date(match.group("date"))
+    except (KeyError, ValueError, IndexError):
+        return None
+
+    user_agent = _unescape(match.group("user_agent")) or ""
+    browser, platform = parse_user_agent(user_agent)
+    referrer = _unescape(match.group("referrer"))
+    size = match.group("size")
+    response_time = match.group("response_time")
+    return {"response_time": None if response_time is None else float(response_time),
+            "status_code": int(match.group("status_code")), "size": None if size == "-" else int(size),
+            "method": request[0], "path": unquote(urlsplit(request[1]).path) or "/",
+            "referrer": None if referrer in (None, "-") else referrer, "browser": browser, "platform": platform,
+            "user_agent": user_agent, "date": date, "mimetype": None, "exception": None,
+            "remote_address": match.group("remote_address")}
+
+
+def parse_lines(lines: List[str]) -> Tuple[List[dict], int]:
+    """ Hits of lines and the number of lines which couldn't be parsed, run in the parser processes """
+    rows = [parse_line(line) for line in lines]
+    return [row for row in rows if row is not None], rows.count(None)
+
+
+def open_log(path: str) -> Iterator[str]:
+    """ Lines of a log file, which may be gzip compressed """
+    with open(path, "rb") as file:
+        compressed = file.read(2) == b"\x1f\x8b"
+    opener = gzip.open if compressed else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as file:
+        yield from file
+
+
+def _chunks(lines: Iterable[str], size: int) -> Iterator[List[str]]:
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class LogImporter:
+    """ Imports access logs in the nginx/Apache combined format through the writer of a DashStatistics instance, so
+        rollups, sketches, partitions, ... are maintained as for hits recorded by the request hooks.
+
+        Lines are parsed in a process pool and written in batches. The number of imported lines of every file is
+        stored in the meta table within the batch's transaction, an interrupted import continues after it.
+
+        :param batch_size: hits written per transaction
+        :param workers: parser processes, 0 parses in this process
+        :param dedup: skip hits which are already stored (same second, address, method, path, status code, size and
+                      user agent), so that overlapping logs can be imported
+        :param geo: resolve the geo columns with the geo resolver of the DashStatistics instance
+        :param chunk_lines: lines per parser task
+    """
+
+    checkpoint_prefix = "import_checkpoint:"
+
+    def __init__(self, stats, batch_size: int = 10000, workers: int = None, dedup: bool = False, geo: bool = True,
+                 chunk_lines: int = 2000):
+        self.stats = stats
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.dedup = dedup
+        self.geo = geo
+        self.chunk_lines = chunk_lines
+
+    def _key(self, path: str) -> str:
+        return self.checkpoint_prefix + os.path.abspath(path)
+
+    def checkpoint(self, path: str) -> int:
+        """ Number of lines of a file which were imported """
+        return int(meta.get_value(self.stats.db.session, self.stats.meta_model, self._key(path), "0"))
+
+    def _parsed(self, chunks: Iterator[List[str]], pool) -> Iterator[Tuple[List[dict], int, int]]:
+        """ (hits, unparsed lines, lines) of every chunk, in order. At most a few chunks per worker are in flight. """
+        if pool is None:
+            for chunk in chunks:
+                yield (*parse_lines(chunk), len(chunk))
+            return
+
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append((pool.apply_async(parse_lines, (chunk,)), len(chunk)))
+            if len(pending) >= self.workers * 4:
+                result, lines = pending.popleft()
+                yield (*result.get(), lines)
+        while pending:
+            result, lines = pending.popleft()
+            yield (*result.get(), lines)
+
+    def _duplicates(self, rows: List[dict]) -> collections.Counter:
+        """ Fingerprints of the stored hits within the dates of rows """
+        api = self.stats.api
+        lower = min(row["date"] for row in rows)
+        upper = max(row["date"] for row in rows) + datetime.timedelta(seconds=1)
+        source = api._source(lower, upper)
+        query = self.stats.db.session.query(*[getattr(source, column) for column in DEDUP_COLUMNS])
+        query = api._add_date_filter_to_query(query, lower, upper, source)
+        stored = api.decode_rows(DEDUP_COLUMNS, query.all())
+        self.stats.db.session.commit()
+        return collections.Counter((row[0].replace(microsecond=0), *row[1:]) for row in stored)
+
+    def _write(self, rows: List[dict], path: str, lines: int, counters: dict) -> None:
+        if self.dedup and rows:
+            stored = self._duplicates(rows)
+            unique = []
+            for row in rows:
+                fingerprint = tuple(row[column] for column in DEDUP_COLUMNS)
+                if stored[fingerprint] > 0:
+                    stored[fingerprint] -= 1
+                else:
+                    unique.append(row)
+            counters["duplicates"] += len(rows) - len(unique)
+            rows = unique
+
+        # Browser and platform were parsed with the lines
+        self.stats.enrichment.enrich(rows, skip=() if self.geo else ("geo",))
+
+        def store_checkpoint(session):
+            meta.set_value(session, self.stats.meta_model, self._key(path), str(lines))
+
+        self.stats.writer.write_many(rows, before_commit=store_checkpoint)
+        counters["imported"] += len(rows)
+
+    def import_file(self, path: str, restart: bool = False, progress: Callable = None) -> dict:
+        """ Import the lines of a file after its checkpoint. Returns counters of the lines and hits.
+
+            :param restart: import the file from its first line
+            :param progress: called with the counters after every batch
+        """
+        with self.stats.app.app_context():
+            return self._import_file(path, restart, progress)
+
+    def _import_file(self, path: str, restart: bool, progress: Callable) -> dict:
+        done = 0 if restart else self.checkpoint(path)
+        counters = {"path": path, "skipped_lines": done, "lines": 0, "unparsed": 0, "ignored": 0, "duplicates": 0,
+                    "imported": 0, "seconds": 0.0, "hits_per_second": 0.0}
+        started = time.perf_counter()
+
+        chunks = _chunks(itertools.islice(open_log(path), done, None), self.chunk_lines)
+        pool = multiprocessing.Pool(self.workers) if self.workers > 0 else None
+        try:
+            batch = []
+            for rows, unparsed, lines in self._parsed(chunks, pool):
+                counters["lines"] += lines
+                counters["unparsed"] += unparsed
+                for row in rows:
+                    # Hits the request hooks wouldn't record, e.g. of the dashboard's callbacks
+                    if not self.stats.path_rules.is_recorded(row["path"]):
+                        counters["ignored"] += 1
+                    else:
+                        url_rule = (self.stats.url_rule_for(row["path"], row["method"])
+                                    if self.stats.url_rule_templates else None)
+                        row["path"] = self.stats.stored_path(row["path"], url_rule)
+                        batch.append(row)
+
+                if len(batch) >= self.batch_size:
+                    self._write(batch, path, done + counters["lines"], counters)
+                    batch = []
+                    counters["seconds"] = time.perf_counter() - started
+                    counters["hits_per_second"] = counters["imported"] / counters["seconds"]
+                    if progress is not None:
+                        progress(counters)
+
+            self._write(batch, path, done + counters["lines"], counters)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        counters["seconds"] = time.perf_counter() - started
+        counters["hits_per_second"] = counters["imported"] / counters["seconds"] if counters["seconds"] else 0.0
+        return counters
@@ -1,19 +1,20 @@
 import dash_html_components as html
-from datetime import datetime, date, timedelta
+from datetime import datetime
 # from .statistics import colors
 
-import plotly.graph_objects as go
 import plotly.io as pio
 
 pio.templates.default = "plotly_white"
 from dash.dependencies import Output, Input, State
 
-from .utils import header, search_section, basic_stats, hits_chart, stats_table, initial_date
+from .utils import header, search_section, basic_stats, hits_chart, stats_table, initial_date, percentile_label
+from .ddsketch import PERCENTILES
+from .render_context import RenderContext
 
-from flask import url_for
+from flask import current_app
 
 
-def callbacks(app, api, dash_prefix):
+def callbacks(app, api, dash_prefix, top_k=None, route_limit=None, charts=None):
     """ Updates index view with new datetime data """
 
     @app.callback(
@@ -24,11 +25,11 @@ def callbacks(app, api, dash_prefix):
     )
     def update(n_clicks, start_date, end_date):
         return view(api, datetime.strptime(start_date, "%Y-%m-%d"),
-                    datetime.strptime(end_date, "%Y-%m-%d"), dash_prefix)
+                    datetime.strptime(end_date, "%Y-%m-%d"), dash_prefix, top_k, route_limit, charts)
 
 
 # TODO: more flexible
-def table_data(api, start_date, end_date, dash_prefix):
+def table_data(context: RenderContext, dash_prefix):
     """ Format information of the routes for the Dash Datatable
 
         :returns: List with lists containing column values:
@@ -37,35 +38,47 @@ def table_data(api, start_date, end_date, dash_prefix):
                         [hits],
                         [unique hits],
                         [last requested],
-                        [average response duration]
+                        [average response duration],
+                        [p50, p90, p95, p99 response duration] (if response time percentiles are enabled)
                 ] and the corresponding column names
     """
     column_names = ["URL", "Hits", "Unique Hits", "Last requested", "Avg. Duration in [s]"]
-    routes = api.get_routes_data(start_date, end_date)
+    routes = [[route.path, route.hits, route.unique_hits, route.last_requested, route.average_response_time]
+              for route in context.routes()]
+
+    if context.api.latency_sketches is not None:
+        column_names += [f"{percentile_label(quantile)} in [s]" for quantile in PERCENTILES]
+        percentiles = context.route_percentiles()
+        for route in routes:
+            route += [None if value is None else float(f"{value:.3g}")
+                      for value in percentiles.get(route[0], [None] * len(PERCENTILES))]
 
     return [
                [
                    f"[{entry}]({dash_prefix}?path={entry})" if i == 0 else entry
-                   for i, entry in enumerate(list(route))
+                   for i, entry in enumerate(route)
                ] for route in routes
            ], column_names
 
 
-def view(api, start_date, end_date, dash_prefix):
+def view(api, start_date, end_date, dash_prefix, top_k=None, route_limit=None, charts=None):
     if start_date is None:
         start_date = initial_date(api)
 
     start_date = start_date.date()
     end_date = end_date.date()
-    data_values, data_labels = table_data(api, start_date, end_date, dash_prefix)
-
-    return html.Div(id="index_view", children=[
-        header(None, dash_prefix),
-        html.Div(className="px-1", style={}, children=[
-                search_section(api, start_date, end_date),
-                basic_stats(api, start_date, end_date),
-                hits_chart(api, start_date, end_date),
-                stats_table(data_values, data_labels),
-            ]
-        )
-    ])
+
+    with RenderContext(api, start_date, end_date, logger=current_app.logger, top_k=top_k,
+                       route_limit=route_limit, charts=charts) as context:
+        data_values, data_labels = table_data(context, dash_prefix)
+
+        return html.Div(id="index_view", children=[
+            header(None, dash_prefix),
+            html.Div(className="px-1", style={}, children=[
+                    search_section(api, start_date, end_date),
+                    basic_stats(context),
+                    hits_chart(context),
+                    stats_table(data_values, data_labels),
+                ]
+            )
+        ])
@@ -0,0 +1,195 @@
+from typing import Dict, Iterable, List, Optional
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData, exc, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import Table
+from sqlalchemy.sql import sqltypes
+
+from .lru import LRUCache, MISSING
+
+# Hit columns which normalized hit tables store as ids into the statistics_string table
+NORMALIZED_COLUMNS = ("path", "method", "user_agent", "referrer", "browser", "platform", "mimetype",
+                      "user_country_code", "user_country_name", "user_region_code", "user_region_name", "user_city",
+                      "user_zip_code", "user_time_zone")
+
+# Values per IN (...) clause
+_CHUNK = 500
+
+
+class Interner:
+    """ The distinct values of the NORMALIZED_COLUMNS in the statistics_string lookup table, with an in memory cache.
+
+        Ids are created on first use in their own transaction and never change, so cached entries stay valid and
+        writing a hit with known values doesn't touch the lookup table at all.
+
+        :param cache_size: maximum number of cached values, per direction
+    """
+
+    def __init__(self, db: SQLAlchemy, cache_size: int = 100000):
+        self.db = db
+
+        class StatisticsString(db.Model):
+            __tablename__ = "statistics_string"
+            __table_args__ = (db.Index("ix_statistics_string_key", "column_name", "value", unique=True),)
+
+            id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+            column_name = db.Column(db.String, nullable=False)
+            value = db.Column(db.String, nullable=False)
+
+        self.model = StatisticsString
+        self._ids = LRUCache(cache_size)
+        self._values = LRUCache(cache_size)
+
+    def engine(self) -> Engine:
+        return self.db.get_engine(bind=self.model.__table__.info.get("bind_key"))
+
+    def _remember(self, column_name: str, value: str, value_id: int) -> None:
+        self._ids.put((column_name, value), value_id)
+        self._values.put(value_id, value)
+
+    def _load(self, column_name: str, values: List[str]) -> Dict[str, int]:
+        table = self.model.__table__
+        found = {}
+        with self.engine().connect() as connection:
+            for start in range(0, len(values), _CHUNK):
+                rows = connection.execute(select(table.c.id, table.c.value)
+                                          .where(table.c.column_name == column_name,
+                                                 table.c.value.in_(values[start:start + _CHUNK])))
+                for value_id, value in rows:
+                    self._remember(column_name, value, value_id)
+                    found[value] = value_id
+        return found
+
+    def _create(self, column_name: str, values: List[str]) -> None:
+        table = self.model.__table__
+        rows = [{"column_name": column_name, "value": value} for value in values]
+        try:
+            with self.engine().begin() as connection:
+                connection.execute(table.insert(), rows)
+        except exc.IntegrityError:
+            # Another process created some of them, create the rest one by one
+            for row in rows:
+                try:
+                    with self.engine().begin() as connection:
+                        connection.execute(table.insert(), row)
+                except exc.IntegrityError:
+                    pass
+
+    def ids(self, column_name: str, values: Iterable, create: bool = True) -> Dict[str, int]:
+        """ {value: id} of the values of a column, None has no id.
+            Must not be called while the session writes, missing ids are created on another connection.
+
+            :param create: create missing ids, otherwise unknown values are left out
+        """
+        found = {}
+        missing = set()
+        for value in values:
+            if value is None or value in found:
+                continue
+            value_id = self._ids.get((column_name, value), MISSING)
+            if value_id is MISSING:
+                missing.add(value)
+            else:
+                found[value] = value_id
+
+        if missing:
+            found.update(self._load(column_name, list(missing)))
+            missing -= found.keys()
+        if missing and create:
+            self._create(column_name, list(missing))
+            found.update(self._load(column_name, list(missing)))
+        return found
+
+    def values(self, ids: Iterable[int]) -> Dict[int, str]:
+        """ {id: value} of ids """
+        found = {}
+        missing = set()
+        for value_id in ids:
+            if value_id is None or value_id in found:
+                continue
+            value = self._values.get(value_id, MISSING)
+            if value is MISSING:
+                missing.add(value_id)
+            else:
+                found[value_id] = value
+
+        if missing:
+            table = self.model.__table__
+            missing = list(missing)
+            with self.engine().connect() as connection:
+                for start in range(0, len(missing), _CHUNK):
+                    rows = connection.execute(select(table.c.id, table.c.column_name, table.c.value)
+                                              .where(table.c.id.in_(missing[start:start + _CHUNK])))
+                    for value_id, column_name, value in rows:
+                        self._remember(column_name, value, value_id)
+                        found[value_id] = value
+        return found
+
+    def decode(self, ids: Iterable[int]) -> list:
+        ids = list(ids)
+        values = self.values(ids)
+        return [values.get(value_id) for value_id in ids]
+
+    def encode_rows(self, rows: List[dict]) -> List[dict]:
+        """ Copies of hit rows with the ids of their NORMALIZED_COLUMNS """
+        ids = {column_name: self.ids(column_name, {row.get(column_name) for row in rows})
+               for column_name in NORMALIZED_COLUMNS}
+        return [{**row, **{column_name: ids[column_name].get(row[column_name])
+                           for column_name in NORMALIZED_COLUMNS if column_name in row}}
+                for row in rows]
+
+    def decode_rows(self, rows: List[dict]) -> List[dict]:
+        """ Copies of hit rows read from a normalized table with the values of their NORMALIZED_COLUMNS """
+        values = self.values(row[column_name] for row in rows for column_name in NORMALIZED_COLUMNS
+                             if column_name in row)
+        return [{**row, **{column_name: values.get(row[column_name])
+                           for column_name in NORMALIZED_COLUMNS if column_name in row}}
+                for row in rows]
+
+
+def is_normalized(engine: Engine, table_name: str) -> Optional[bool]:
+    """ Whether an existing hits table stores ids, None if it doesn't exist """
+    inspector = inspect(engine)
+    if table_name not in inspector.get_table_names():
+        return None
+    types = {column["name"]: column["type"] for column in inspector.get_columns(table_name)}
+    return not isinstance(types.get("path"), sqltypes.String)
+
+
+def normalize_table(engine: Engine, interner: Interner, table: Table, chunk_size: int = 10000) -> int:
+    """ Rebuild a hits table which stores the NORMALIZED_COLUMNS as text according to its normalized declaration:
+        the hits are copied into a new table in chunks, which then replaces the old one.
+        Returns the number of copied hits.
+    """
+    wide = Table(table.name, MetaData(), autoload_with=engine)
+    copy = table.to_metadata(MetaData(), name=f"{table.name}_normalizing")
+    # The indexes are created once the copy replaced the table, their names are still taken until then
+    copy.indexes.clear()
+    copy.drop(bind=engine, checkfirst=True)
+    copy.create(bind=engine)
+
+    columns = [column.name for column in copy.columns if column.name in wide.c]
+    copied = 0
+    last_index = 0
+    while True:
+        with engine.connect() as connection:
+            chunk = connection.execute(select(*[wide.c[column] for column in columns])
+                                       .where(wide.c.index > last_index)
+                                       .order_by(wide.c.index)
+                                       .limit(chunk_size)).mappings().all()
+        if not chunk:
+            break
+        # Ids are created before the copy's transaction starts, SQLite allows one writer at a time
+        rows = interner.encode_rows([dict(row) for row in chunk])
+        with engine.begin() as connection:
+            connection.execute(copy.insert(), rows)
+        last_index = chunk[-1]["index"]
+        copied += len(rows)
+
+    with engine.begin() as connection:
+        wide.drop(bind=connection)
+        connection.execute(text(f'ALTER TABLE "{copy.name}" RENAME TO "{table.name}"'))
+    for index in table.indexes:
+        index.create(bind=engine)
+    return copied
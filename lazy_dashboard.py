@@ -0,0 +1,27 @@
+import threading
+
+
+class LazyDashboard:
+    """ WSGI middleware in front of the host app which serves the requests under the dashboard's prefix from a
+        dashboard server (see dashboard.create_server) that is imported and built on the first of them
+
+        :param wsgi_app: the host app's wsgi_app
+    """
+
+    def __init__(self, stats, wsgi_app):
+        self.stats = stats
+        self.wsgi_app = wsgi_app
+        self.server = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if not path.startswith(self.stats.prefix) and path != self.stats.prefix.rstrip("/"):
+            return self.wsgi_app(environ, start_response)
+
+        if self.server is None:
+            with self._lock:
+                if self.server is None:
+                    from .dashboard import create_server
+                    self.server = create_server(self.stats)
+        return self.server(environ, start_response)
@@ -0,0 +1,116 @@
+import datetime
+import threading
+import uuid
+from array import array
+from typing import List, Tuple
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _seconds(date: datetime.datetime) -> float:
+    return (date - EPOCH).total_seconds()
+
+
+def minute_date(minute: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(minutes=minute)
+
+
+class LiveBuffer:
+    """ The most recent hits and per minute counters of the process writing them, for the live view.
+
+        Hits are kept in a fixed size ring buffer of arrays, so memory stays constant however busy the app is. Every
+        added hit gets the next sequence number; clients poll with the last number they have seen and only get the
+        hits after it. Hits older than the minutes window (e.g. of imported logs) are ignored.
+
+        :param capacity: number of recent hits kept
+        :param minutes: number of minutes with counters
+    """
+
+    def __init__(self, capacity: int = 2000, minutes: int = 60):
+        self.capacity = capacity
+        self.minutes = minutes
+        # Leave hits flagged as bots out
+        self.exclude_bots = False
+        # Changes with every process, so that clients notice when another process answers
+        self.token = uuid.uuid4().hex
+        self.sequence = 0
+
+        self._dates = array("d", [0.0]) * capacity
+        self._response_times = array("d", [0.0]) * capacity
+        self._status_codes = array("i", [0]) * capacity
+        self._paths = [None] * capacity
+
+        # Slot minute % minutes holds the counters of that minute, as long as its key is the minute
+        self._minute_keys = array("q", [-1]) * minutes
+        self._minute_hits = array("d", [0.0]) * minutes
+        self._minute_errors = array("d", [0.0]) * minutes
+        self._minute_response_times = array("d", [0.0]) * minutes
+        self._lock = threading.Lock()
+
+    def current_minute(self) -> int:
+        return int(_seconds(datetime.datetime.utcnow()) // 60)
+
+    def add(self, rows: List[dict]) -> None:
+        oldest = (self.current_minute() - self.minutes + 1) * 60
+        with self._lock:
+            for row in rows:
+                seconds = _seconds(row["date"])
+                if seconds < oldest or (self.exclude_bots and row.get("is_bot")):
+                    continue
+                weight = row.get("sample_weight") or 1
+                response_time = row.get("response_time") or 0.0
+                status_code = row.get("status_code") or 0
+
+                slot = self.sequence % self.capacity
+                self._dates[slot] = seconds
+                self._response_times[slot] = response_time
+                self._status_codes[slot] = status_code
+                self._paths[slot] = row.get("path")
+                self.sequence += 1
+
+                minute = int(seconds // 60)
+                slot = minute % self.minutes
+                if self._minute_keys[slot] != minute:
+                    self._minute_keys[slot] = minute
+                    self._minute_hits[slot] = self._minute_errors[slot] = self._minute_response_times[slot] = 0.0
+                self._minute_hits[slot] += weight
+                self._minute_response_times[slot] += response_time * weight
+                if status_code >= 500 or row.get("exception"):
+                    self._minute_errors[slot] += weight
+
+    def write_hook(self, session, rows: List[dict]) -> None:
+        """ Writer batch hook. Runs before the batch is committed, a failing batch still shows up live. """
+        self.add(rows)
+
+    def since(self, sequence: int) -> Tuple[int, List[tuple]]:
+        """ The current sequence number and the hits (date, path, status code, response time) after sequence.
+            Hits which were overwritten meanwhile are missing.
+        """
+        with self._lock:
+            first = max(sequence, self.sequence - self.capacity, 0)
+            hits = []
+            for number in range(first, self.sequence):
+                slot = number % self.capacity
+                hits.append((EPOCH + datetime.timedelta(seconds=self._dates[slot]), self._paths[slot],
+                             self._status_codes[slot], self._response_times[slot]))
+            return self.sequence, hits
+
+    def minute_counts(self, after: int, before: int) -> List[Tuple[datetime.datetime, float, float, float]]:
+        """ (minute, hits, errors, average response time) of the minutes after and before the given minutes, which
+            are numbers of minutes since the epoch (see current_minute). Minutes without hits count 0.
+        """
+        counts = []
+        with self._lock:
+            for minute in range(max(after + 1, before - self.minutes), before):
+                slot = minute % self.minutes
+                if self._minute_keys[slot] == minute and self._minute_hits[slot]:
+                    hits = self._minute_hits[slot]
+                    counts.append((minute_date(minute), hits, self._minute_errors[slot],
+                                   self._minute_response_times[slot] / hits))
+                else:
+                    counts.append((minute_date(minute), 0.0, 0.0, 0.0))
+        return counts
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sequence": self.sequence, "capacity": self.capacity, "minutes": self.minutes}
@@ -0,0 +1,130 @@
+""" Live view of the last minutes, polling a LiveBuffer for the hits since the client's last sequence number and
+    extending the charts with them instead of rebuilding them
+"""
+import dash
+import dash_core_components as dcc
+import dash_html_components as html
+import plotly.graph_objects as go
+from dash.dependencies import Input, Output, State
+
+from .live import LiveBuffer
+from .utils import header, card
+
+CHART_CONFIG = {"displayModeBar": False}
+
+
+def _minutes_figure(counts: list) -> go.Figure:
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=[count[0] for count in counts], y=[count[1] for count in counts], name="Hits",
+                         hovertemplate="%{x|%H:%M} || Hits: %{y:.0f}"))
+    fig.add_trace(go.Bar(x=[count[0] for count in counts], y=[count[2] for count in counts], name="Errors",
+                         hovertemplate="%{x|%H:%M} || Errors: %{y:.0f}"))
+    fig.update_layout(title="Hits per Minute", barmode="overlay", yaxis_title="Number of Hits",
+                      legend=dict(orientation="h", y=0), margin=dict(l=0, r=0, b=0, t=50, pad=0),
+                      uirevision="live")
+    fig.update_xaxes(tickformat="%H:%M", fixedrange=True)
+    fig.update_yaxes(fixedrange=True)
+    return fig
+
+
+def _hits_figure(hits: list) -> go.Figure:
+    fig = go.Figure(go.Scattergl(x=[hit[0] for hit in hits], y=[hit[3] for hit in hits],
+                                 text=[f"{hit[1]} ({hit[2]})" for hit in hits], mode="markers", name="Hits",
+                                 hovertemplate="%{x|%H:%M:%S} || %{text} || %{y:.4f} s"))
+    fig.update_layout(title="Recent Hits", yaxis_title="Duration in [s]", margin=dict(l=0, r=0, b=0, t=50, pad=0),
+                      uirevision="live")
+    fig.update_xaxes(tickformat="%H:%M:%S", fixedrange=True)
+    fig.update_yaxes(fixedrange=True)
+    return fig
+
+
+def _minutes_extension(counts: list, buffer: LiveBuffer):
+    return (dict(x=[[count[0] for count in counts]] * 2, y=[[count[1] for count in counts],
+                                                            [count[2] for count in counts]]),
+            [0, 1], buffer.minutes)
+
+
+def _hits_extension(hits: list, buffer: LiveBuffer):
+    return (dict(x=[[hit[0] for hit in hits]], y=[[hit[3] for hit in hits]],
+                 text=[[f"{hit[1]} ({hit[2]})" for hit in hits]]),
+            [0], buffer.capacity)
+
+
+def _cards(buffer: LiveBuffer, minute: int) -> list:
+    """ Cards of the current minute and the minutes window """
+    current = buffer.minute_counts(minute - 1, minute + 1)
+    window = buffer.minute_counts(minute - buffer.minutes, minute + 1)
+    hits = sum(count[1] for count in window)
+    errors = sum(count[2] for count in window)
+    return [
+        html.Div(className="col-sm", children=[card(f"{current[-1][1]:.0f}", "Hits this minute")]),
+        html.Div(className="col-sm", children=[card(f"{hits:.0f}", f"Hits in the last {buffer.minutes} minutes")]),
+        html.Div(className="col-sm", children=[card(f"{errors:.0f}", f"Errors in the last {buffer.minutes} minutes")]),
+        html.Div(className="col-sm", children=[card(f"{current[-1][3]:.4f} s", "Avg. Duration this minute")]),
+    ]
+
+
+def _state(buffer: LiveBuffer, sequence: int, minute: int) -> dict:
+    return {"token": buffer.token, "sequence": sequence, "minute": minute}
+
+
+def view(buffer: LiveBuffer, dash_prefix: str, interval: int):
+    if buffer is None:
+        return html.Div(id="live_view", children=[
+            header(None, dash_prefix),
+            html.P("The live view is not enabled, pass live_view=True to DashStatistics.", className="px-3"),
+        ])
+
+    # Completed minutes are charted, the current one is extended into the chart once it is over
+    minute = buffer.current_minute()
+    sequence, hits = buffer.since(0)
+    counts = buffer.minute_counts(minute - buffer.minutes, minute)
+
+    return html.Div(id="live_view", children=[
+        header(None, dash_prefix),
+        html.Div(className="container-fluid px-1", children=[
+            dcc.Interval(id="live-interval", interval=interval),
+            dcc.Store(id="live-state", data=_state(buffer, sequence, minute - 1)),
+            html.Div(style={"margin": "25px 5px"}, children=[
+                html.Div(id="live-cards", className="row", children=_cards(buffer, minute)),
+            ]),
+            html.Div(className="row justify-content-md-center", children=[
+                html.Div(className="col-md-10 py-1", children=[
+                    html.Div(className="card", children=[html.Div(className="card-body px-1", children=[
+                        dcc.Graph(id="live-minutes", figure=_minutes_figure(counts), config=CHART_CONFIG),
+                    ])]),
+                ]),
+                html.Div(className="col-md-10 py-1", children=[
+                    html.Div(className="card", children=[html.Div(className="card-body px-1", children=[
+                        dcc.Graph(id="live-hits", figure=_hits_figure(hits), config=CHART_CONFIG),
+                    ])]),
+                ]),
+            ]),
+        ]),
+    ])
+
+
+def callbacks(app, buffer: LiveBuffer):
+    """ Extends the live charts with what happened since the client's last poll """
+
+    @app.callback(
+        [Output("live-minutes", "extendData"), Output("live-hits", "extendData"),
+         Output("live-minutes", "figure"), Output("live-hits", "figure"),
+         Output("live-state", "data"), Output("live-cards", "children")],
+        [Input("live-interval", "n_intervals"), State("live-state", "data")]
+    )
+    def update(n_intervals, state):
+        minute = buffer.current_minute()
+        if state is None or state.get("token") != buffer.token:
+            # Another process (or a restarted one) answered: its sequence numbers mean something else
+            sequence, hits = buffer.since(0)
+            counts = buffer.minute_counts(minute - buffer.minutes, minute)
+            return (dash.no_update, dash.no_update, _minutes_figure(counts), _hits_figure(hits),
+                    _state(buffer, sequence, minute - 1), _cards(buffer, minute))
+
+        sequence, hits = buffer.since(state["sequence"])
+        counts = buffer.minute_counts(state["minute"], minute)
+        return (_minutes_extension(counts, buffer) if counts else dash.no_update,
+                _hits_extension(hits, buffer) if hits else dash.no_update,
+                dash.no_update, dash.no_update,
+                _state(buffer, sequence, minute - 1), _cards(buffer, minute))
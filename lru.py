@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    """ Thread safe, bounded least recently used cache which counts its hits, misses and evictions
+
+        :param maxsize: maximum number of entries
+        :param maxbytes: optional memory budget, the size of an entry is estimated with sizeof(value)
+    """
+
+    def __init__(self, maxsize: int = 1024, maxbytes: int = None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        with self._lock:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                evicted, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data),
+                    "maxsize": self.maxsize, "bytes": self.bytes, "maxbytes": self.maxbytes}
@@ -0,0 +1,25 @@
+from typing import Optional
+
+from flask_sqlalchemy import Model, SQLAlchemy
+
+
+def create_model(db: SQLAlchemy) -> Model:
+    """ Key/value table for bookkeeping of the statistics database (e.g. since when rollups are complete) """
+
+    class Meta(db.Model):
+        __tablename__ = "statistics_meta"
+
+        key = db.Column(db.String, primary_key=True)
+        value = db.Column(db.String)
+
+    return Meta
+
+
+def get_value(session, model: Model, key: str, default: str = None) -> Optional[str]:
+    entry = session.query(model).get(key)
+    return default if entry is None else entry.value
+
+
+def set_value(session, model: Model, key: str, value: str) -> None:
+    """ Set a value, the caller commits """
+    session.merge(model(key=key, value=value))
@@ -0,0 +1,78 @@
+import datetime
+from typing import List, Tuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import Table
+
+
+def migrate(engine: Engine, tables: List[Table]) -> List[str]:
+    """ Bring existing tables up to date with their declaration, which create_all() does not do:
+        adds missing (nullable) columns and missing indexes. Returns a description of every change.
+    """
+    changes = []
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+
+    for table in tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            changes.append(f"added column {table.name}.{column.name}")
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(bind=engine)
+            changes.append(f"created index {index.name}")
+
+    return changes
+
+
+def query_plans(api, start_date: datetime.date, end_date: datetime.date, path: str = None
+                ) -> List[Tuple[str, List[str]]]:
+    """ Run the raw table queries of a StatisticsQueries object for a date range and return the sqlite
+        query plan of every executed statement, to check that they are answered with indexes
+    """
+    engine = api.engine()
+    if engine.dialect.name != "sqlite":
+        raise NotImplementedError("Query plans are only available for sqlite")
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    rollups, api.rollups = api.rollups, None
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        api.get_routes_data(start_date, end_date)
+        api.get_number_of_unique_visitors(start_date, end_date)
+        api.get_statistic_data("browser", start_date, end_date)
+        api.get_user_chart_data(start_date, end_date, path)
+        if path is not None:
+            api.get_requests_for_path(path, start_date, end_date)
+            api.get_requests_page(path, start_date, end_date, ["date", "remote_address", "status_code"])
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+        api.rollups = rollups
+
+    plans = []
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for statement, parameters in statements:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            plans.append((statement, [row[-1] for row in cursor.fetchall()]))
+    finally:
+        connection.close()
+
+    return plans
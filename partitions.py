@@ -0,0 +1,230 @@
+import datetime
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from flask_sqlalchemy import Model, SQLAlchemy
+from sqlalchemy import MetaData, create_engine, false, func, inspect, select, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.schema import Table
+
+from . import meta
+from .buckets import next_bucket, truncate
+
+
+class Partitions:
+    """ Hits stored in one table per month, e.g. statistics_2021_07, with the same columns and indexes as the
+        statistics table.
+
+        Queries only read the partitions overlapping their date range. Whole months are removed cheaply by
+        dropping their table instead of deleting rows. The statistics table itself keeps the hits written before
+        partitioning was enabled and is only read for ranges starting before that.
+    """
+
+    since_key = "partitions_since"
+    compacted_key = "partitions_compacted_before"
+    # Seconds after which the partition tables are listed again, to see partitions created by other processes
+    refresh_interval = 10.0
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model):
+        self.db = db
+        self.model = model
+        self.meta_model = meta_model
+
+        self._tables = {}
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+        self._name_pattern = re.compile(re.escape(self.model.__tablename__) + r"_(\d{4})_(\d{2})$")
+
+    def engine(self):
+        return self.db.get_engine(bind=self.model.__table__.info.get("bind_key"))
+
+    def table_name(self, month: datetime.datetime) -> str:
+        return f"{self.model.__tablename__}_{month:%Y_%m}"
+
+    def _define(self, month: datetime.datetime) -> Table:
+        """ Table object of a month's partition, which may not exist in the database yet """
+        name = self.table_name(month)
+        table = self.db.Model.metadata.tables.get(name)
+        if table is None:
+            table = self.model.__table__.to_metadata(self.db.Model.metadata, name=name)
+            for index in table.indexes:
+                # Index names are unique per database
+                index.name = index.name.replace(self.model.__tablename__, name, 1)
+        return table
+
+    def refresh(self, force: bool = False) -> None:
+        """ Find the partition tables in the database """
+        if not force and time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+
+        tables = {}
+        for name in inspect(self.engine()).get_table_names():
+            match = self._name_pattern.match(name)
+            if match is not None:
+                month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+                tables[month] = self._define(month)
+
+        with self._lock:
+            self._tables = tables
+            self._refreshed = time.monotonic()
+
+    def tables(self) -> Dict[datetime.datetime, Table]:
+        """ {month: table} of all partitions, in chronological order """
+        self.refresh()
+        with self._lock:
+            return dict(sorted(self._tables.items()))
+
+    def initialize(self) -> None:
+        """ Mark since when hits are written into partitions, if that is not known yet """
+        session = self.db.session
+        if meta.get_value(session, self.meta_model, self.since_key) is None:
+            if session.query(self.model.index).first() is None:
+                since = datetime.datetime.min
+            else:
+                since = datetime.datetime.utcnow()
+            meta.set_value(session, self.meta_model, self.since_key, since.isoformat())
+            session.commit()
+        self.refresh(force=True)
+
+    def since(self) -> datetime.datetime:
+        value = meta.get_value(self.db.session, self.meta_model, self.since_key)
+        return datetime.datetime.min if value is None else datetime.datetime.fromisoformat(value)
+
+    def compacted_before(self) -> Optional[datetime.datetime]:
+        """ Month before which only the rollups of the hits are kept, None if nothing was compacted """
+        value = meta.get_value(self.db.session, self.meta_model, self.compacted_key)
+        return None if value is None else datetime.datetime.fromisoformat(value)
+
+    def raw_tables(self, lower: datetime.datetime = None, upper: datetime.datetime = None) -> List[Table]:
+        """ Tables holding the hits of [lower, upper), all tables if no range is given """
+        tables = []
+        if lower is None or lower < self.since():
+            tables.append(self.model.__table__)
+
+        for month, table in self.tables().items():
+            if lower is None or upper is None or (month < upper and next_bucket(month, "month") > lower):
+                tables.append(table)
+        return tables
+
+    def source(self, lower: datetime.datetime = None, upper: datetime.datetime = None):
+        """ Entity to query the hits of [lower, upper) with, like the model of the statistics table """
+        tables = self.raw_tables(lower, upper)
+        if not tables:
+            # No partition overlaps the range, no hits
+            selectable = select(self.model.__table__).where(false()).subquery(self.model.__tablename__)
+        elif len(tables) == 1:
+            selectable = tables[0].alias(self.model.__tablename__)
+        else:
+            selectable = union_all(*[select(table) for table in tables]).subquery(self.model.__tablename__)
+        return aliased(self.model, selectable, adapt_on_names=True)
+
+    def partition_for(self, month: datetime.datetime) -> Table:
+        """ Table of a month's partition, created if needed """
+        with self._lock:
+            table = self._tables.get(month)
+        if table is None:
+            table = self._define(month)
+            # In its own transaction, so that the table stays known even if the caller's transaction is rolled back
+            table.create(bind=self.engine(), checkfirst=True)
+            with self._lock:
+                self._tables[month] = table
+        return table
+
+    def insert(self, session, rows: List[dict]) -> None:
+        """ Insert rows into the partitions of their dates, the caller commits.
+            Must precede other writes of the transaction, missing partitions are created on another connection.
+        """
+        columns = [column.name for column in self.model.__table__.columns if column.name != "index"]
+        by_month = {}
+        for row in rows:
+            month = truncate(row.get("date") or datetime.datetime.utcnow(), "month")
+            by_month.setdefault(month, []).append({column: row.get(column) for column in columns})
+
+        # Create missing partitions before the session starts writing, SQLite would lock the other connection out
+        tables = {month: self.partition_for(month) for month in by_month}
+        for month, month_rows in by_month.items():
+            session.execute(tables[month].insert(), month_rows)
+
+    def latest_index(self) -> tuple:
+        """ (table name, highest index) of the newest partition, changes whenever hits were written """
+        tables = self.raw_tables()
+        table = tables[-1]
+        return table.name, self.db.session.query(func.max(table.c.index)).scalar() or 0
+
+    def drop(self, month: datetime.datetime) -> None:
+        table = self.tables().get(month)
+        if table is None:
+            return
+        table.drop(bind=self.engine(), checkfirst=True)
+        self.db.Model.metadata.remove(table)
+        with self._lock:
+            self._tables.pop(month, None)
+
+    def archive(self, month: datetime.datetime, directory: str, chunk_size: int = 10000) -> str:
+        """ Copy a partition into its own SQLite file in directory and drop it. Returns the file path. """
+        table = self.tables()[month]
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{table.name}.db")
+
+        archive_engine = create_engine(f"sqlite:///{os.path.abspath(path)}")
+        archive_table = table.to_metadata(MetaData())
+        archive_table.create(bind=archive_engine, checkfirst=True)
+
+        last_index = 0
+        with self.engine().connect() as source, archive_engine.begin() as target:
+            while True:
+                chunk = source.execute(select(table)
+                                       .where(table.c.index > last_index)
+                                       .order_by(table.c.index)
+                                       .limit(chunk_size)).mappings().all()
+                if not chunk:
+                    break
+                target.execute(archive_table.insert(), [dict(row) for row in chunk])
+                last_index = chunk[-1]["index"]
+        archive_engine.dispose()
+
+        self.drop(month)
+        return path
+
+    def expired(self, months: int, now: datetime.datetime = None) -> List[datetime.datetime]:
+        """ Partitions whose month ended more than the given number of months before the current month """
+        cutoff = truncate(now or datetime.datetime.utcnow(), "month")
+        for _ in range(months):
+            cutoff = (cutoff - datetime.timedelta(days=1)).replace(day=1)
+        return [month for month in self.tables() if month < cutoff]
+
+    def mark_compacted(self, month: datetime.datetime) -> None:
+        """ Record that the raw hits before the end of month were removed and only the rollups remain """
+        end = next_bucket(month, "month")
+        compacted = self.compacted_before()
+        if compacted is None or end > compacted:
+            session = self.db.session
+            meta.set_value(session, self.meta_model, self.compacted_key, end.isoformat())
+            session.commit()
+
+    def apply_retention(self, retention_months: int = None, action: str = "drop", archive_directory: str = None,
+                        compact_after_months: int = None, rollups=None) -> List[str]:
+        """ Drop or archive the partitions older than retention_months and compact the ones older than
+            compact_after_months, i.e. drop them once the rollups cover them. Returns the changes made.
+        """
+        changes = []
+        if retention_months is not None:
+            for month in self.expired(retention_months):
+                if action == "archive":
+                    changes.append(f"archived {self.table_name(month)} to {self.archive(month, archive_directory)}")
+                else:
+                    self.drop(month)
+                    changes.append(f"dropped {self.table_name(month)}")
+
+        if compact_after_months is not None:
+            for month in self.expired(compact_after_months):
+                if rollups is None or not rollups.covers(month):
+                    changes.append(f"kept {self.table_name(month)}, it is not covered by the rollups")
+                    continue
+                self.drop(month)
+                self.mark_compacted(month)
+                changes.append(f"compacted {self.table_name(month)} into the rollups")
+        return changes
@@ -0,0 +1,174 @@
+import fnmatch
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+# Requests of the dashboard itself, which are not recorded
+DASH_RULES = ["contains:_dash-component-suites", "contains:_dash-dependencies", "contains:_dash-layout",
+              "contains:_dash-update-component"]
+
+RULE_KINDS = ("prefix", "glob", "regex", "contains")
+
+# <name> or <converter:name> of a template or flask url rule
+_PLACEHOLDER = re.compile(r"<(?:(\w+)(?:\([^)]*\))?:)?(\w+)>")
+
+
+def _trie_pattern(literals: Dict[str, str]) -> str:
+    """ Regex matching any of {literal: group name}, factored into a trie so that the regex engine can skip ahead
+        to common prefixes. An empty named group marks the end of each literal, so match.lastgroup tells which one
+        matched; a literal ends the match even if longer literals start with it.
+    """
+    trie = {}
+    for literal, name in literals.items():
+        node = trie
+        for character in literal:
+            node = node.setdefault(character, {})
+        node[None] = name
+
+    def pattern(node: dict) -> str:
+        if None in node:
+            return f"(?P<{node[None]}>)"
+        branches = []
+        for character, child in node.items():
+            # Collapse chains of single children into one literal
+            literal = character
+            while None not in child and len(child) == 1:
+                character, child = next(iter(child.items()))
+                literal += character
+            branches.append(re.escape(literal) + pattern(child))
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return pattern(trie)
+
+
+class _RuleSet:
+    """ Rules compiled into one regex matched at the start of a path (prefixes as a trie, globs and regexes) and one
+        searched in it (substrings as a trie), evaluated once per path instead of once per rule
+    """
+
+    def __init__(self, rules: Iterable[str], group: str):
+        prefixes = {}
+        contained = {}
+        anchored = []
+        for index, rule in enumerate(rules):
+            kind, _, pattern = rule.partition(":")
+            if kind not in RULE_KINDS:
+                kind, pattern = "prefix", rule
+            name = f"{group}{index}"
+            if kind == "prefix":
+                prefixes.setdefault(pattern, name)
+            elif kind == "contains":
+                contained.setdefault(pattern, name)
+            else:
+                anchored.append(f"(?:{fnmatch.translate(pattern) if kind == 'glob' else pattern})(?P<{name}>)")
+        if prefixes:
+            anchored.insert(0, _trie_pattern(prefixes))
+
+        self._anchored = re.compile("|".join(anchored), re.DOTALL) if anchored else None
+        self._contained = re.compile(_trie_pattern(contained), re.DOTALL) if contained else None
+        self.empty = self._anchored is None and self._contained is None
+
+    def match(self, path: str) -> Optional[str]:
+        """ Group name of a rule matching path, None if none does """
+        if self._anchored is not None:
+            match = self._anchored.match(path)
+            if match is not None:
+                return match.lastgroup
+        if self._contained is not None:
+            match = self._contained.search(path)
+            if match is not None:
+                return match.lastgroup
+        return None
+
+
+def template_pattern(template: str) -> str:
+    """ Regex of a route template: <name> matches one path segment, <path:name> the rest of the path """
+    parts = []
+    position = 0
+    for placeholder in _PLACEHOLDER.finditer(template):
+        parts.append(re.escape(template[position:placeholder.start()]))
+        parts.append(".+" if placeholder.group(1) == "path" else "[^/]+")
+        position = placeholder.end()
+    parts.append(re.escape(template[position:]))
+    return "".join(parts)
+
+
+def normalize_template(rule: str) -> str:
+    """ Template without converters, e.g. /user/<int:id> -> /user/<id> """
+    return _PLACEHOLDER.sub(lambda placeholder: f"<{placeholder.group(2)}>", rule)
+
+
+class PathRules:
+    """ Decides which paths are recorded and into which route template they are stored. The rules are compiled into
+        combined regexes, so a path is matched once per request instead of once per rule.
+
+        Rules are strings "prefix:/static/", "glob:*.png" (* also matches /), "regex:/api/v[0-9]+/health" (matched at
+        the start of the path) or "contains:_dash-layout"; a rule without a kind is a prefix. Prefixes and substrings
+        are matched with a trie, so their cost hardly grows with their number.
+
+        :param exclude: paths matching any of these rules are not recorded
+        :param include: if given, only paths matching any of these rules (and no exclude rule) are recorded
+        :param templates: route templates like "/user/<id>" or "/files/<path:name>", a path matching one is stored
+                          as the template, so that e.g. ids don't make every path a route of its own. The first
+                          matching template is used.
+    """
+
+    def __init__(self, exclude: Iterable[str] = (), include: Iterable[str] = (), templates: Iterable[str] = ()):
+        self.exclude = list(exclude)
+        self.include = list(include)
+        templates = list(templates)
+        self.templates = [normalize_template(template) for template in templates]
+
+        self._exclude = _RuleSet(self.exclude, "exclude")
+        self._include = _RuleSet(self.include, "include")
+        self._templates = None
+        if templates:
+            self._templates = re.compile("|".join(f"{template_pattern(template)}(?P<template{index}>)"
+                                                  for index, template in enumerate(templates)), re.DOTALL)
+
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def is_recorded(self, path: str) -> bool:
+        rule = self._exclude.match(path)
+        if rule is not None:
+            self._count(rule)
+            return False
+        if not self._include.empty:
+            rule = self._include.match(path)
+            if rule is None:
+                self._count("not_included")
+                return False
+            self._count(rule)
+        return True
+
+    def template(self, path: str, url_rule: str = None) -> str:
+        """ Path to store for a recorded path: its template, else the flask url rule if given, else the path itself
+
+            :param url_rule: rule of the flask route which served the path, e.g. request.url_rule.rule
+        """
+        if self._templates is not None:
+            match = self._templates.fullmatch(path)
+            if match is not None:
+                self._count(match.lastgroup)
+                return self.templates[int(match.lastgroup[len("template"):])]
+        if url_rule is not None:
+            return normalize_template(url_rule)
+        return path
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """ How often every rule matched: {"excluded": {rule: hits}, "included": ..., "templated": ...,
+            "not_included": hits}
+        """
+        with self._lock:
+            counters = dict(self.counters)
+        result = {"not_included": counters.get("not_included", 0)}
+        for key, group, rules in (("excluded", "exclude", self.exclude), ("included", "include", self.include),
+                                  ("templated", "template", self.templates)):
+            result[key] = {rule: counters.get(f"{group}{index}", 0) for index, rule in enumerate(rules)}
+        return result
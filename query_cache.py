@@ -0,0 +1,159 @@
+import datetime
+import hashlib
+import inspect
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+
+from .StatisticsQueries import StatisticsQueries, date_bounds
+from .lru import LRUCache, MISSING
+
+# Methods of StatisticsQueries whose results are cached
+CACHED_METHODS = ("get_number_of_unique_visitors", "get_statistic_data", "get_statistic_breakdowns", "get_routes_data",
+                  "get_requests_page", "get_user_chart_data", "get_response_time_percentiles",
+                  "get_route_percentiles", "get_response_time_chart_data", "get_sampling_errors", "get_top_values")
+
+
+def _sizeof(value) -> int:
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class DiskCache:
+    """ Cache entries in a local sqlite file, so that worker processes share them.
+        When the file grows over maxbytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, path: str, maxbytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.maxbytes = maxbytes
+        self._local = threading.local()
+
+        self._connection().execute("CREATE TABLE IF NOT EXISTS cache ("
+                                   "key TEXT PRIMARY KEY, watermark TEXT, value BLOB, size INTEGER, accessed REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def get(self, key: str):
+        """ (watermark, value) of an entry or MISSING """
+        connection = self._connection()
+        row = connection.execute("SELECT watermark, value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return MISSING
+
+        connection.execute("UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0], pickle.loads(row[1])
+
+    def put(self, key: str, watermark: str, value) -> None:
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                           (key, watermark, data, len(data), time.time()))
+
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        while total > self.maxbytes:
+            row = connection.execute("SELECT key, size FROM cache ORDER BY accessed LIMIT 1").fetchone()
+            connection.execute("DELETE FROM cache WHERE key = ?", (row[0],))
+            total -= row[1]
+
+
+class CachedStatisticsQueries:
+    """ Caches the results of the dashboard queries of a StatisticsQueries object by (method, arguments).
+
+        Results for ranges touching today are tagged with the write watermark (the highest hit index) and recomputed
+        once new hits were written. Results for ranges which ended before today are tagged with the late write
+        watermark, which only changes when hits dated before today are written (e.g. imported), so they stay cached
+        until then. Everything but the CACHED_METHODS is passed through to the wrapped object.
+
+        :param maxbytes: memory budget of the in process LRU cache
+        :param disk_path: optional sqlite file shared by all worker processes as a second level cache
+        :param watermark_ttl: seconds for which the watermarks are reused instead of queried again
+    """
+
+    def __init__(self, api: StatisticsQueries, maxbytes: int = 64 * 1024 * 1024, disk_path: str = None,
+                 disk_maxbytes: int = 256 * 1024 * 1024, watermark_ttl: float = 1.0):
+        self.api = api
+        self.cache = LRUCache(maxsize=100000, maxbytes=maxbytes, sizeof=_sizeof)
+        self.disk = DiskCache(disk_path, disk_maxbytes) if disk_path else None
+        self.watermark_ttl = watermark_ttl
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.api, name)
+        if name not in CACHED_METHODS:
+            return attribute
+
+        def cached(*args, **kwargs):
+            return self._call(name, attribute, args, kwargs)
+        return cached
+
+    def watermark(self, past: bool = False) -> str:
+        """ Write watermark, or the late write watermark for ranges which ended before today """
+        checked, watermark = self._watermarks.get(past, (0.0, None))
+        if watermark is None or time.monotonic() - checked > self.watermark_ttl:
+            if past:
+                watermark = "late:" + self.api.get_late_write_watermark()
+            else:
+                watermark = str(self.api.get_write_watermark())
+            self._watermarks[past] = (time.monotonic(), watermark)
+        return watermark
+
+    def _call(self, name: str, method, args: tuple, kwargs: dict):
+        arguments = inspect.signature(method).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        key = repr((name, sorted(arguments.arguments.items())))
+
+        start_date, end_date = arguments.arguments.get("start_date"), arguments.arguments.get("end_date")
+        today = datetime.datetime.combine(datetime.datetime.utcnow().date(), datetime.time.min)
+        past = start_date is not None and end_date is not None and date_bounds(start_date, end_date)[1] <= today
+        watermark = self.watermark(past)
+
+        entry = self.cache.get(key, MISSING)
+        if entry is not MISSING and entry[0] == watermark:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        if self.disk is not None:
+            disk_key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            entry = self.disk.get(disk_key)
+            if entry is not MISSING and entry[0] == watermark:
+                self.cache.put(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+                return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        result = method(*args, **kwargs)
+
+        self.cache.put(key, (watermark, result))
+        if self.disk is not None:
+            self.disk.put(disk_key, watermark, result)
+        return result
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.cache.evictions, "entries": len(self.cache), "bytes": self.cache.bytes}
@@ -0,0 +1,131 @@
+import datetime
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from .StatisticsQueries import StatisticsQueries
+from .charts import Charts
+
+
+class RenderContext:
+    """ Results of the queries needed by one dashboard render, so that every part of the page reads the same data
+        instead of querying it again. Used as a context manager with a logger enabled for debug messages, e.g. the
+        app's logger in debug mode, it records the sql statements executed by the current thread and logs their
+        number and duration once the render is done.
+
+        :param api: reference to StatisticsQueries (or a CachedStatisticsQueries)
+        :param path: route of a route view, None for the index view
+        :param logger: e.g. flask.current_app.logger
+        :param top_k: breakdowns only contain the top_k most frequent values and heavy_hitters.OTHER
+        :param route_limit: only read this many of the most requested routes
+        :param charts: granularity, downsampling and cache of the time series figures, default: uncached
+    """
+
+    def __init__(self, api: StatisticsQueries, start_date: datetime.date, end_date: datetime.date,
+                 path: str = None, logger=None, top_k: int = None, route_limit: int = None, charts: Charts = None):
+        self.api = api
+        self.start_date = start_date
+        self.end_date = end_date
+        self.path = path
+        self.top_k = top_k
+        self.route_limit = route_limit
+        self.charts = charts if charts is not None else Charts(cache_bytes=0)
+        self.logger = logger
+        self.recording = logger is not None and logger.isEnabledFor(logging.DEBUG)
+
+        self.queries = []
+        self._results = {}
+        self._thread = None
+        self._started = None
+
+    def _memoized(self, key, compute):
+        if key not in self._results:
+            self._results[key] = compute()
+        return self._results[key]
+
+    def routes(self) -> list:
+        return self._memoized("routes", lambda: self.api.get_routes_data(self.start_date, self.end_date,
+                                                                         limit=self.route_limit))
+
+    def total_hits(self) -> int:
+        if self.route_limit is None:
+            return sum(route.hits for route in self.routes())
+        # The top path and OTHER add up to all hits
+        return self._memoized("total_hits",
+                              lambda: sum(self.api.get_top_values("path", self.start_date, self.end_date, 1)[1]))
+
+    def unique_visitors(self) -> int:
+        return self._memoized("unique_visitors",
+                              lambda: self.api.get_number_of_unique_visitors(self.start_date, self.end_date))
+
+    def statistic_breakdowns(self, column_names: List[str]) -> Dict[str, Tuple[list, list]]:
+        """ {column_name: (labels, frequencies)} of all columns, read at once unless limited to the top_k values """
+        if self.top_k is not None:
+            return self._memoized(("top_values", tuple(column_names)),
+                                  lambda: {column_name: self.api.get_top_values(column_name, self.start_date,
+                                                                                self.end_date, self.top_k)
+                                           for column_name in column_names})
+        return self._memoized(("breakdowns", tuple(column_names)),
+                              lambda: self.api.get_statistic_breakdowns(list(column_names), self.start_date,
+                                                                        self.end_date))
+
+    def user_chart_data(self, granularity: str) -> list:
+        return self._memoized(("chart", granularity),
+                              lambda: self.api.get_user_chart_data(self.start_date, self.end_date, self.path,
+                                                                   granularity))
+
+    def sampling_errors(self) -> Optional[Dict[str, Optional[float]]]:
+        return self._memoized("sampling_errors",
+                              lambda: self.api.get_sampling_errors(self.start_date, self.end_date, self.path))
+
+    def route_percentiles(self) -> Dict[str, list]:
+        return self._memoized("route_percentiles",
+                              lambda: self.api.get_route_percentiles(self.start_date, self.end_date))
+
+    def response_time_percentiles(self) -> list:
+        return self._memoized("percentiles",
+                              lambda: self.api.get_response_time_percentiles(self.start_date, self.end_date,
+                                                                             self.path))
+
+    def response_time_chart_data(self, granularity: str) -> list:
+        return self._memoized(("response_time_chart", granularity),
+                              lambda: self.api.get_response_time_chart_data(self.start_date, self.end_date,
+                                                                            self.path, granularity))
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            conn.info.setdefault("statistics_render_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            started = conn.info["statistics_render_start"].pop()
+            self.queries.append((statement, time.perf_counter() - started))
+
+    def __enter__(self) -> "RenderContext":
+        if self.recording:
+            self._thread = threading.get_ident()
+            self._started = time.perf_counter()
+            engine = self.api.engine()
+            event.listen(engine, "before_cursor_execute", self._before_execute)
+            event.listen(engine, "after_cursor_execute", self._after_execute)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.recording:
+            return
+
+        engine = self.api.engine()
+        event.remove(engine, "before_cursor_execute", self._before_execute)
+        event.remove(engine, "after_cursor_execute", self._after_execute)
+        self.logger.debug(self.report(time.perf_counter() - self._started))
+
+    def report(self, duration: float) -> str:
+        lines = [f"dash-statistics render of {self.path or 'index'} ({self.start_date} - {self.end_date}): "
+                 f"{len(self.queries)} queries in {sum(d for _, d in self.queries) * 1000:.1f} ms, "
+                 f"{duration * 1000:.1f} ms total"]
+        for statement, query_duration in self.queries:
+            lines.append(f"  {query_duration * 1000:8.1f} ms  {' '.join(statement.split())[:200]}")
+        return "\n".join(lines)
@@ -0,0 +1,285 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask_sqlalchemy import Model, SQLAlchemy
+from sqlalchemy import and_, case, desc, func, null
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from .aggregates import Aggregate
+from .buckets import sql_bucket, truncate, zero_filled
+from .hyperloglog import HyperLogLog
+from .interning import NORMALIZED_COLUMNS
+from .sketches import ALL_PATHS, SketchStore
+
+BUCKET_SIZES = ("hour", "day")
+# Columns with a rollup of their own, answering StatisticsQueries.get_statistic_data
+DIMENSIONS = ("browser", "platform", "user_country_name", "status_code")
+# INSERT constructs of the dialects with an atomic upsert clause, others update and insert
+UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert, "mysql": mysql.insert}
+
+
+def _key(value) -> str:
+    # NULLs never conflict in a unique index, so missing values are stored as ""
+    return "" if value is None else str(value)
+
+
+def _label(key: str):
+    return None if key == "" else key
+
+
+def sorted_breakdown(counts: dict) -> Tuple[list, list]:
+    """ Labels and values of {label: count}, ordered by label descending with None last. Hits without a value are
+        not counted, the None label has 0 like count(column) in StatisticsQueries.get_statistic_data.
+    """
+    items = sorted(counts.items(), key=lambda item: (item[0] is not None, item[0]), reverse=True)
+    return [label for label, _ in items], [0 if label is None else count for label, count in items]
+
+
+def _upsert(session, dialect: str, table, key_columns: Sequence[str], rows: List[dict], additive: Sequence[str],
+            maximum: Sequence[str] = (), null_as: dict = None) -> None:
+    """ Add the additive columns of rows to (and take the maximum of the maximum columns with) the stored rows of the
+        same key, inserting the rows which don't exist yet. Safe against concurrent writers, the caller commits.
+
+        :param null_as: {additive column: column whose value it has while it is NULL}, for columns added later
+    """
+    null_as = null_as or {}
+
+    def merged(column: str, value):
+        if column in maximum:
+            return case([(table.c[column] < value, value)], else_=table.c[column])
+        current = func.coalesce(table.c[column], table.c[null_as[column]]) if column in null_as else table.c[column]
+        return current + value
+
+    # MySQL assigns from left to right, columns which others default to (null_as) are assigned last
+    columns = sorted([*additive, *maximum], key=lambda column: column in null_as.values())
+    if dialect in UPSERT_DIALECTS:
+        statement = UPSERT_DIALECTS[dialect](table)
+        new = statement.inserted if dialect == "mysql" else statement.excluded
+        values = [(column, merged(column, new[column])) for column in columns]
+        if dialect == "mysql":
+            statement = statement.on_duplicate_key_update(values)
+        else:
+            statement = statement.on_conflict_do_update(index_elements=list(key_columns), set_=dict(values))
+        session.execute(statement, rows)
+        return
+
+    for row in rows:
+        update = (table.update()
+                  .where(and_(*[table.c[column] == row[column] for column in key_columns]))
+                  .values({column: merged(column, row[column]) for column in columns}))
+        if session.execute(update).rowcount == 0:
+            try:
+                with session.begin_nested():
+                    session.execute(table.insert().values(**row))
+            except IntegrityError:
+                # Inserted by a concurrent writer since the update
+                session.execute(update)
+
+
+class Rollups(Aggregate):
+    """ Hourly and daily pre-aggregated hits, maintained incrementally as hits are written
+
+        - per (bucket, path): hits, response time sum/count and last request
+        - per (bucket, dimension value) for the DIMENSIONS
+        - per (bucket, path) and per bucket: a HyperLogLog sketch of the visitors in the SketchStore, so that
+          unique visitors are estimated without the raw table in a bounded amount of space
+
+        Hits and response time counts are sums of the sample weights of the hits (1 without sampling). Unique
+        visitors of sampled hits are estimated from the raw table, see sampling.visitor_estimates.
+    """
+
+    since_key = "rollups_since"
+    columns = ("date", "path", "remote_address", "response_time", "sample_weight", *DIMENSIONS)
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model, store: SketchStore, precision: int = 12):
+        super().__init__(db, model, meta_model)
+        self.store = store
+        self.precision = precision
+
+        class RouteRollup(db.Model):
+            __tablename__ = "statistics_rollup"
+            __table_args__ = (db.Index("ix_statistics_rollup_key", "bucket_size", "bucket", "path", unique=True),)
+
+            id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+            bucket_size = db.Column(db.String, nullable=False)
+            bucket = db.Column(db.DateTime, nullable=False)
+            path = db.Column(db.String, nullable=False)
+            hits = db.Column(db.Float, nullable=False, default=0)
+            response_time_sum = db.Column(db.Float, nullable=False, default=0)
+            response_time_count = db.Column(db.Float, nullable=False, default=0)
+            last_requested = db.Column(db.DateTime)
+
+        class DimensionRollup(db.Model):
+            __tablename__ = "statistics_rollup_dimension"
+            __table_args__ = (db.Index("ix_statistics_rollup_dimension_key",
+                                       "bucket_size", "bucket", "dimension", "value", unique=True),)
+
+            id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+            bucket_size = db.Column(db.String, nullable=False)
+            bucket = db.Column(db.DateTime, nullable=False)
+            dimension = db.Column(db.String, nullable=False)
+            value = db.Column(db.String, nullable=False)
+            hits = db.Column(db.Float, nullable=False, default=0)
+
+        self.route_model = RouteRollup
+        self.dimension_model = DimensionRollup
+
+    def _kind(self, bucket_size: str) -> str:
+        """ SketchStore kind of the visitor sketches of a bucket size """
+        return f"rollup_hll:{bucket_size}"
+
+    def bucket_size_for(self, lower: datetime.datetime, upper: datetime.datetime) -> Optional[str]:
+        """ Largest bucket size which the half open range [lower, upper) consists of, None if the range
+            is not made of whole buckets or not covered by the rollups
+        """
+        if not self.covers(lower):
+            return None
+        for bucket_size in reversed(BUCKET_SIZES):
+            if truncate(lower, bucket_size) == lower and truncate(upper, bucket_size) == upper:
+                return bucket_size
+        return None
+
+    def update(self, session, rows: List[dict]) -> None:
+        routes = {}
+        dimensions = defaultdict(int)
+        visitors = {bucket_size: defaultdict(lambda: HyperLogLog(self.precision)) for bucket_size in BUCKET_SIZES}
+
+        for row in rows:
+            weight = row.get("sample_weight") or 1
+            for bucket_size in BUCKET_SIZES:
+                bucket = truncate(row["date"], bucket_size)
+
+                route = routes.get((bucket_size, bucket, row["path"]))
+                if route is None:
+                    route = routes[(bucket_size, bucket, row["path"])] = {
+                        "hits": 0, "response_time_sum": 0.0, "response_time_count": 0, "last_requested": row["date"]}
+                route["hits"] += weight
+                if row.get("response_time") is not None:
+                    route["response_time_sum"] += row["response_time"] * weight
+                    route["response_time_count"] += weight
+                route["last_requested"] = max(route["last_requested"], row["date"])
+
+                for path in (row["path"], ALL_PATHS):
+                    visitors[bucket_size][(bucket, path)].add(row.get("remote_address") or "")
+                for dimension in DIMENSIONS:
+                    dimensions[(bucket_size, bucket, dimension, _key(row.get(dimension)))] += weight
+
+        dialect = self.engine().dialect.name
+        _upsert(session, dialect, self.route_model.__table__, ("bucket_size", "bucket", "path"),
+                [{"bucket_size": bucket_size, "bucket": bucket, "path": path, **route}
+                 for (bucket_size, bucket, path), route in routes.items()],
+                ("hits", "response_time_sum", "response_time_count"), ("last_requested",))
+
+        _upsert(session, dialect, self.dimension_model.__table__, ("bucket_size", "bucket", "dimension", "value"),
+                [{"bucket_size": bucket_size, "bucket": bucket, "dimension": dimension, "value": value, "hits": hits}
+                 for (bucket_size, bucket, dimension, value), hits in dimensions.items()],
+                ("hits",))
+
+        for bucket_size, sketches in visitors.items():
+            self.store.merge_into(session, self._kind(bucket_size), sketches)
+
+    def clear(self, session) -> None:
+        for rollup_model in (self.route_model, self.dimension_model):
+            session.query(rollup_model).delete(synchronize_session=False)
+        for bucket_size in BUCKET_SIZES:
+            self.store.clear(session, self._kind(bucket_size))
+
+    def _filter(self, query, model, lower: datetime.datetime, upper: datetime.datetime, bucket_size: str):
+        return query.filter(model.bucket_size == bucket_size, model.bucket >= lower, model.bucket < upper)
+
+    def _visitor_sketches(self, lower: datetime.datetime, upper: datetime.datetime, bucket_size: str,
+                          path: str = None):
+        """ Yield (bucket, path, sketch) of the visitors of a path (all paths: ALL_PATHS, each path: None) """
+        return self.store.load(self._kind(bucket_size), HyperLogLog, lower, upper, path)
+
+    def get_number_of_unique_visitors(self, lower: datetime.datetime, upper: datetime.datetime,
+                                      bucket_size: str) -> int:
+        """ Estimated number of unique visitors """
+        result = HyperLogLog(self.precision)
+        for _, _, sketch in self._visitor_sketches(lower, upper, bucket_size, ALL_PATHS):
+            result.merge(sketch)
+        return round(result.count())
+
+    def unique_visitors_per_path(self, lower: datetime.datetime, upper: datetime.datetime,
+                                 bucket_size: str) -> Dict[str, int]:
+        """ Estimated number of unique visitors of every path """
+        merged = {}
+        for _, path, sketch in self._visitor_sketches(lower, upper, bucket_size):
+            if path == ALL_PATHS:
+                continue
+            if path in merged:
+                merged[path].merge(sketch)
+            else:
+                merged[path] = sketch
+        return {path: round(sketch.count()) for path, sketch in merged.items()}
+
+    def get_statistic_breakdowns(self, column_names: List[str], lower: datetime.datetime,
+                                 upper: datetime.datetime, bucket_size: str) -> Dict[str, Tuple[list, list]]:
+        """ Labels and hits of several DIMENSIONS, read with a single query """
+        query = (self.db.session.query(self.dimension_model.dimension,
+                                       self.dimension_model.value,
+                                       func.sum(self.dimension_model.hits))
+                 .filter(self.dimension_model.dimension.in_(column_names))
+                 .group_by(self.dimension_model.dimension, self.dimension_model.value))
+
+        counts = {column_name: {} for column_name in column_names}
+        for dimension, value, hits in self._filter(query, self.dimension_model, lower, upper, bucket_size).all():
+            # Restore the raw column's type, e.g. for status codes. Normalized columns store ids of strings.
+            python_type = getattr(self.model, dimension).type.python_type
+            if self.interner is not None and dimension in NORMALIZED_COLUMNS:
+                python_type = str
+            counts[dimension][None if _label(value) is None else python_type(value)] = round(hits)
+
+        return {column_name: sorted_breakdown(counts[column_name]) for column_name in column_names}
+
+    def get_routes_data(self, lower: datetime.datetime, upper: datetime.datetime, bucket_size: str,
+                        limit: int = None) -> List:
+        """ Routes without unique hits (None), see unique_visitors_per_path
+
+            :param limit: only return this many of the most requested routes
+        """
+        routes = self._filter(self.db.session.query(
+            self.route_model.path,
+            func.sum(self.route_model.hits).label("hits"),
+            func.max(self.route_model.last_requested).label("last_requested"),
+            (func.sum(self.route_model.response_time_sum) /
+             func.nullif(func.sum(self.route_model.response_time_count), 0)).label("average_response_time"),
+            func.sum(self.route_model.response_time_count).label("response_time_count")),
+            self.route_model, lower, upper, bucket_size).group_by(self.route_model.path).subquery()
+
+        return (self.db.session.query(routes.c.path,
+                                      routes.c.hits,
+                                      null().label("unique_hits"),
+                                      routes.c.last_requested,
+                                      routes.c.average_response_time,
+                                      routes.c.response_time_count)
+                .order_by(desc(routes.c.hits))
+                .limit(limit)
+                .all())
+
+    def get_user_chart_data(self, lower: datetime.datetime, upper: datetime.datetime, path: str,
+                            granularity: str, bucket_size: str, dialect: str, unique: bool = True
+                            ) -> Tuple[List[dict], List[dict]]:
+        """ Hits and estimated unique hits per bucket of the given granularity, which must be a multiple of
+            bucket_size. Unique hits are None if not requested.
+        """
+        hits_bucket = sql_bucket(self.route_model.bucket, granularity, dialect).label("bucket")
+        hits_query = self._filter(self.db.session.query(hits_bucket, func.sum(self.route_model.hits)),
+                                  self.route_model, lower, upper, bucket_size)
+        if path is not None:
+            hits_query = hits_query.filter(self.route_model.path == path)
+        hits = zero_filled(((bucket, round(count)) for bucket, count in hits_query.group_by(hits_bucket).all()),
+                           lower, upper, granularity)
+
+        if not unique:
+            return hits, None
+
+        sketches = defaultdict(lambda: HyperLogLog(self.precision))
+        for bucket, _, sketch in self._visitor_sketches(lower, upper, bucket_size, ALL_PATHS if path is None else path):
+            sketches[truncate(bucket, granularity)].merge(sketch)
+        unique_hits = zero_filled(((bucket, round(sketch.count())) for bucket, sketch in sketches.items()),
+                                  lower, upper, granularity)
+
+        return hits, unique_hits
@@ -1,14 +1,49 @@
 import datetime
+import math
+import re
+from typing import List, Tuple
 
 import dash_html_components as html
 # from .statistics import colors
 
-from .utils import header, search_section, hits_chart, stats_table, initial_date
+from .utils import (header, search_section, hits_chart, hits_title, paged_stats_table, initial_date,
+                    percentile_label, response_time_chart)
+from .ddsketch import PERCENTILES
+from .render_context import RenderContext
+
+from flask import current_app
 
 from dash.dependencies import Output, Input, State
 
 
-def callbacks(app, api, dash_prefix):
+# Default columns of the request table: {"column_name": "displayed title"}
+COLUMN_NAMES = {
+    "path": "URL",
+    "method": "Method",
+    "status_code": "Status",
+    "response_time": "Duration in [s]",
+    "date": "Date [UTC]",
+    "remote_address": "IP Address",
+    "user_country_name": "Location",
+    "platform": "Operating System",
+    "browser": "Browser"
+}
+PAGE_SIZE = 50
+
+# Dash DataTable filter query operators and their StatisticsQueries.FILTER_OPERATORS counterpart
+FILTER_OPERATORS = {
+    "eq": "=", "=": "=",
+    "ne": "!=", "!=": "!=",
+    "lt": "<", "<": "<",
+    "le": "<=", "<=": "<=",
+    "gt": ">", ">": ">",
+    "ge": ">=", ">=": ">=",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+
+
+def callbacks(app, api, dash_prefix, charts=None):
     """ Updates route view with new datetime data """
     @app.callback(
         Output('route_view', 'children'),
@@ -19,73 +54,92 @@ def callbacks(app, api, dash_prefix):
     )
     def update(n_clicks, start_date, end_date, search):
         return view(api, datetime.datetime.strptime(start_date, "%Y-%m-%d"),
-                    datetime.datetime.strptime(end_date, "%Y-%m-%d"), search.split("?path=")[1], dash_prefix)
+                    datetime.datetime.strptime(end_date, "%Y-%m-%d"), search.split("?path=")[1], dash_prefix, charts)
 
+    @app.callback(
+        [Output('route-table', 'data'),
+         Output('route-table', 'page_count')],
+        [Input('route-table', 'page_current'),
+         Input('route-table', 'page_size'),
+         Input('route-table', 'sort_by'),
+         Input('route-table', 'filter_query'),
+         State('startdate-input', 'value'),
+         State('enddate-input', 'value'),
+         State("url", "search")]
+    )
+    def update_table(page_current, page_size, sort_by, filter_query, start_date, end_date, search):
+        return table_data(api, datetime.datetime.strptime(start_date, "%Y-%m-%d").date(),
+                          datetime.datetime.strptime(end_date, "%Y-%m-%d").date(), search.split("?path=")[1],
+                          page_current, page_size, sort_by, filter_query)
 
-def table_data(api, start_date: datetime.datetime, end_date: datetime.datetime, path: str, column_names: dict = None):
-    """  Format information of a single route/path/url for the Dash Datatable
+
+def parse_filter_query(filter_query: str) -> List[Tuple[str, str, str]]:
+    """ Split a Dash DataTable filter query like '{status_code} >= 400 && {browser} contains firefox'
+        into (column name, operator, value) tuples
+    """
+    filters = []
+    for part in (filter_query or "").split(" && "):
+        match = re.match(r"\s*\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s+(?P<value>.*?)\s*$", part)
+        if match is None or match.group("operator") not in FILTER_OPERATORS:
+            continue
+
+        value = match.group("value")
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"`":
+            value = value[1:-1]
+        filters.append((match.group("column"), FILTER_OPERATORS[match.group("operator")], value))
+    return filters
+
+
+def table_data(api, start_date: datetime.date, end_date: datetime.date, path: str, page_current: int = 0,
+               page_size: int = PAGE_SIZE, sort_by: list = None, filter_query: str = "", column_names: dict = None):
+    """  Fetch one page of the requests of a single route/path/url for the Dash Datatable
 
     :param api: reference to StatisticQueries
     :param start_date: date range start
     :param end_date: date range end
     :param path: route for which the data should be shown
-    :param column_names: Dictionary specifying which database columns and the according text/title should be displayed
-                         in the html table. Structure: {"column_name": "displayed title"}
-                         Default: {
-                                "path": "URL",
-                                "method": "Method",
-                                "status_code": "Status",
-                                "response_time": "Duration",
-                                "date": "Date",
-                                "remote_address": "IP Address",
-                                "user_country_name": "Location",
-                                "platform": "Operating System",
-                                "browser": "Browser"
-                                }
-    :return:    List with lists containing column values:
-                e.g: [
-                        ["path url"],
-                        ["method"],
-                        ["the status code"]
-                ] and the corresponding titles which should be displayed
+    :param page_current: page of the table, starting at 0
+    :param page_size: rows per page
+    :param sort_by: sort_by property of the DataTable: [{"column_id": "date", "direction": "desc"}, ...]
+    :param filter_query: filter_query property of the DataTable
+    :param column_names: Dictionary specifying which database columns should be displayed. Default: COLUMN_NAMES
+    :return:    List with a dict per row: {"column_name": value} and the number of pages
     """
     if column_names is None:
-        column_names = {
-            "path": "URL",
-            "method": "Method",
-            "status_code": "Status",
-            "response_time": "Duration in [s]",
-            "date": "Date [UTC]",
-            "remote_address": "IP Address",
-            "user_country_name": "Location",
-            "platform": "Operating System",
-            "browser": "Browser"
-        }
-
-    requests = api.get_requests_for_path(path, start_date, end_date)
-
-    # performance issues?
-    # Purpose: Only use specified column_names
-    return [
-               [vars(request).get(column_name) for column_name in column_names]
-               for request in requests
-           ], column_names.values()
-
-
-def view(api, start_date, end_date, path, dash_prefix):
+        column_names = COLUMN_NAMES
+
+    rows, total = api.get_requests_page(path, start_date, end_date, list(column_names), page_current or 0,
+                                        page_size, [(s["column_id"], s["direction"] == "desc") for s in sort_by or []],
+                                        parse_filter_query(filter_query))
+
+    # New dicts, the rows may be shared by the query cache
+    rows = [{**row, "date": row["date"].strftime("%H:%M:%S %Y-%m-%d")} if row.get("date") is not None else row
+            for row in rows]
+
+    return rows, max(1, math.ceil(total / page_size))
+
+
+def view(api, start_date, end_date, path, dash_prefix, charts=None):
     if start_date is None:
         start_date = initial_date(api)
 
     start_date = start_date.date()
     end_date = end_date.date()
 
-    data_values, data_labels = table_data(api, start_date, end_date, path)
+    with RenderContext(api, start_date, end_date, path, logger=current_app.logger, charts=charts) as context:
+        graphs = [hits_chart(context, plot_title=hits_title(context))]
+        if api.latency_sketches is not None:
+            percentiles = ", ".join(f"{percentile_label(quantile)}: {value:.4f} s"
+                                    for quantile, value in zip(PERCENTILES, context.response_time_percentiles())
+                                    if value is not None)
+            graphs.append(response_time_chart(context, plot_title=f"Response Times for {path}"
+                                                                  + (f" ({percentiles})" if percentiles else "")))
 
-    return html.Div(id="route_view", children=[
-        header(path, dash_prefix),
-        html.Div(className="container-fluid px-1", style={}, children=[
-            search_section(api, start_date, end_date),
-            hits_chart(api, start_date, end_date, path, plot_title=f"Total Hits for {path}"),
-            stats_table(data=data_values, data_labels=data_labels),
+        return html.Div(id="route_view", children=[
+            header(path, dash_prefix),
+            html.Div(className="container-fluid px-1", style={}, children=[
+                search_section(api, start_date, end_date),
+                *graphs,
+                paged_stats_table("route-table", COLUMN_NAMES, PAGE_SIZE),
+            ])
         ])
-    ])
@@ -0,0 +1,106 @@
+import hashlib
+import math
+import random
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import func
+
+# z value of the 95% confidence intervals of the estimates
+CONFIDENCE_Z = 1.96
+
+
+class SamplingPolicy:
+    """ Decides which hits are recorded and stores each with the weight 1 / probability of recording it, so that
+        summing the weights estimates the totals of all hits without bias.
+
+        :param rate: fraction of the hits which is recorded
+        :param path_rates: {path prefix: rate}, the longest prefix matching a path takes precedence over rate
+        :param keep_errors: record every hit with a status code >= 500 or an exception (with weight 1)
+        :param per_visitor: sample visitors instead of hits: all hits of a visitor are recorded or none, decided by a
+                            hash of the remote address. Needed for unbiased unique visitor estimates.
+    """
+
+    def __init__(self, rate: float = 1.0, path_rates: Dict[str, float] = None, keep_errors: bool = True,
+                 per_visitor: bool = False):
+        for value in (rate, *(path_rates or {}).values()):
+            if not 0 <= value <= 1:
+                raise ValueError("Sampling rates must be between 0 and 1")
+
+        self.rate = rate
+        # Longest prefixes first
+        self.path_rates = sorted((path_rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.keep_errors = keep_errors
+        self.per_visitor = per_visitor
+
+        self.recorded = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.path_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.rate
+
+    @staticmethod
+    def visitor_fraction(remote_address: str) -> float:
+        """ Position of a visitor in [0, 1). Personalized, so that it is independent of the HyperLogLog hashes. """
+        digest = hashlib.blake2b((remote_address or "").encode("utf-8"), digest_size=8,
+                                 person=b"dash-sampling").digest()
+        return int.from_bytes(digest, "big") / 2 ** 64
+
+    def weight(self, path: str, remote_address: str, status_code: int, exception: Exception = None
+               ) -> Optional[float]:
+        """ Sample weight to record a hit with, None if it is not recorded """
+        if self.keep_errors and (exception is not None or (status_code or 0) >= 500):
+            rate = 1.0
+        else:
+            rate = self.rate_for(path)
+            fraction = self.visitor_fraction(remote_address) if self.per_visitor else random.random()
+            if fraction >= rate:
+                with self._lock:
+                    self.skipped += 1
+                return None
+
+        with self._lock:
+            self.recorded += 1
+        return 1 / rate
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"recorded": self.recorded, "skipped": self.skipped}
+
+
+def unique_visitor_estimates(session, visitors) -> dict:
+    """ {key: estimated unique visitors} of a visitors subquery (see error_bounds) which may have a "key" column to
+        group by, {None: estimate} without it. Every visitor counts with the inverse of its sample_rate.
+    """
+    weight = func.sum(1 / visitors.c.sample_rate)
+    if "key" not in visitors.c:
+        return {None: round(session.query(weight).scalar() or 0)}
+    return {key: round(estimate) for key, estimate in session.query(visitors.c.key, weight).group_by(visitors.c.key)}
+
+
+def error_bounds(session, visitors, clustered: bool) -> Dict[str, Optional[float]]:
+    """ 95% error bounds {"hits": ..., "unique_visitors": ...} of the estimated totals of sampled hits, from a subquery
+        with a row per visitor and the columns hits (sum of the weights), squared_weights (sum of the squared weights),
+        sample_rate (probability that the visitor was recorded, the largest rate of its hits) and max_weight.
+
+        The variances are the Horvitz-Thompson estimates: of independently sampled hits sum(w * (w - 1)), of sampled
+        visitors (clustered) sum((1 - 1 / max_weight) * hits ** 2), which is exact for visitors whose hits share a
+        rate and overestimates the variance of the others. The unique visitor bound is None without clustering, since
+        visitors of independently sampled hits are not recorded with a known probability.
+    """
+    weight = 1 / visitors.c.sample_rate
+    hits_variance = (visitors.c.squared_weights - visitors.c.hits if not clustered else
+                     (1 - 1 / visitors.c.max_weight) * visitors.c.hits * visitors.c.hits)
+    hits_variance, unique_variance = session.query(func.sum(hits_variance), func.sum(weight * (weight - 1))).one()
+    return bounds(hits_variance, unique_variance, clustered)
+
+
+def bounds(hits_variance: Optional[float], unique_variance: Optional[float], clustered: bool
+           ) -> Dict[str, Optional[float]]:
+    """ Error bounds of error_bounds() from the estimated variances """
+    return {"hits": CONFIDENCE_Z * math.sqrt(max(hits_variance or 0, 0)),
+            "unique_visitors": CONFIDENCE_Z * math.sqrt(max(unique_variance or 0, 0)) if clustered else None}
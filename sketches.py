@@ -0,0 +1,283 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from flask_sqlalchemy import Model, SQLAlchemy
+from sqlalchemy import bindparam, select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from .aggregates import Aggregate
+from .buckets import label, bucket_range, truncate
+from .ddsketch import PERCENTILES, DDSketch
+from .heavy_hitters import HeavyHitters, top_with_other
+from .hyperloglog import HyperLogLog
+
+# Path of the sketches which summarize all paths of a bucket
+ALL_PATHS = ""
+
+# Columns with top value sketches by default
+TOP_VALUE_COLUMNS = ("path", "referrer", "browser", "platform", "user_country_name")
+
+# (bucket, path) keys per IN (...) clause
+_CHUNK = 400
+
+
+class SketchStore:
+    """ Serialized, mergeable sketches per (kind, bucket, path) in the statistics_sketch table
+
+        Sketch classes implement merge(other), to_bytes() and the classmethod from_bytes(data).
+    """
+
+    def __init__(self, db: SQLAlchemy):
+        self.db = db
+
+        class Sketch(db.Model):
+            __tablename__ = "statistics_sketch"
+            __table_args__ = (db.Index("ix_statistics_sketch_key", "kind", "bucket", "path", unique=True),)
+
+            id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+            kind = db.Column(db.String, nullable=False)
+            bucket = db.Column(db.DateTime, nullable=False)
+            path = db.Column(db.String, nullable=False)
+            data = db.Column(db.LargeBinary, nullable=False)
+
+        self.model = Sketch
+
+    def merge_into(self, session, kind: str, sketches: Dict[Tuple[datetime.datetime, str], object]) -> None:
+        """ Merge sketches per (bucket, path) into the stored ones, the caller commits. The stored rows are locked
+            until then where the database supports it, keys inserted by a concurrent writer meanwhile are merged
+            into its rows.
+        """
+        table = self.model.__table__
+        for attempt in range(2):
+            keys = list(sketches)
+            stored = {}
+            for start in range(0, len(keys), _CHUNK):
+                rows = session.execute(select(table.c.id, table.c.bucket, table.c.path, table.c.data)
+                                       .where(table.c.kind == kind,
+                                              tuple_(table.c.bucket, table.c.path).in_(keys[start:start + _CHUNK]))
+                                       .with_for_update())
+                for sketch_id, bucket, path, data in rows:
+                    stored[(bucket, path)] = (sketch_id, data)
+
+            inserts, updates = [], []
+            for (bucket, path), sketch in sketches.items():
+                if (bucket, path) in stored:
+                    sketch_id, data = stored[(bucket, path)]
+                    updates.append({"sketch_id": sketch_id,
+                                    "data": type(sketch).from_bytes(data).merge(sketch).to_bytes()})
+                else:
+                    inserts.append({"kind": kind, "bucket": bucket, "path": path, "data": sketch.to_bytes()})
+
+            if updates:
+                session.execute(table.update().where(table.c.id == bindparam("sketch_id")), updates)
+            if not inserts:
+                return
+            try:
+                with session.begin_nested():
+                    session.execute(table.insert(), inserts)
+                return
+            except IntegrityError:
+                if attempt:
+                    raise
+                sketches = {(row["bucket"], row["path"]): sketches[(row["bucket"], row["path"])] for row in inserts}
+
+    def load(self, kind: str, cls, lower: datetime.datetime, upper: datetime.datetime, path: str = None):
+        """ Yield (bucket, path, sketch) for the buckets in [lower, upper), only of one path if given """
+        query = (self.db.session.query(self.model.bucket, self.model.path, self.model.data)
+                 .filter(self.model.kind == kind, self.model.bucket >= lower, self.model.bucket < upper))
+        if path is not None:
+            query = query.filter(self.model.path == path)
+
+        for bucket, sketch_path, data in query.yield_per(1000):
+            yield bucket, sketch_path, cls.from_bytes(data)
+
+    def clear(self, session, kind: str) -> None:
+        session.query(self.model).filter(self.model.kind == kind).delete(synchronize_session=False)
+
+
+class SketchAggregate(Aggregate):
+    """ Aggregate kept as one sketch per (day, path) plus one per day for ALL_PATHS """
+
+    kind = None
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model, store: SketchStore):
+        super().__init__(db, model, meta_model)
+        self.store = store
+
+    def covers_range(self, lower: datetime.datetime, upper: datetime.datetime) -> bool:
+        """ Whether [lower, upper) consists of whole days which are covered by the sketches """
+        return self.covers(lower) and truncate(lower, "day") == lower and truncate(upper, "day") == upper
+
+    def new_sketch(self):
+        raise NotImplementedError
+
+    def add(self, sketch, row: dict) -> None:
+        raise NotImplementedError
+
+    def update(self, session, rows: List[dict]) -> None:
+        sketches = {}
+        for row in rows:
+            day = truncate(row["date"], "day")
+            for path in (row["path"], ALL_PATHS):
+                sketch = sketches.get((day, path))
+                if sketch is None:
+                    sketch = sketches[(day, path)] = self.new_sketch()
+                self.add(sketch, row)
+
+        self.store.merge_into(session, self.kind, sketches)
+
+    def clear(self, session) -> None:
+        self.store.clear(session, self.kind)
+
+    def merged(self, lower: datetime.datetime, upper: datetime.datetime, path: str = None):
+        """ Sketch of all hits of a path (default: all paths) in [lower, upper) """
+        result = self.new_sketch()
+        for _, _, sketch in self.store.load(self.kind, type(result), lower, upper,
+                                            ALL_PATHS if path is None else path):
+            result.merge(sketch)
+        return result
+
+    def merged_per_path(self, lower: datetime.datetime, upper: datetime.datetime) -> Dict[str, object]:
+        result = {}
+        for _, path, sketch in self.store.load(self.kind, type(self.new_sketch()), lower, upper):
+            if path == ALL_PATHS:
+                continue
+            if path in result:
+                result[path].merge(sketch)
+            else:
+                result[path] = sketch
+        return result
+
+    def merged_per_bucket(self, lower: datetime.datetime, upper: datetime.datetime, path: str,
+                          granularity: str) -> Dict[datetime.datetime, object]:
+        """ Sketches merged per bucket of a granularity of at least a day, for every bucket in [lower, upper) """
+        result = defaultdict(self.new_sketch)
+        for bucket, _, sketch in self.store.load(self.kind, type(self.new_sketch()), lower, upper,
+                                                 ALL_PATHS if path is None else path):
+            result[truncate(bucket, granularity)].merge(sketch)
+        return {bucket: result[bucket] for bucket in bucket_range(lower, upper, granularity)}
+
+
+class UniqueVisitorSketches(SketchAggregate):
+    """ HyperLogLog sketches of the visitors' ip addresses, answering unique visitor counts for any range and path
+        by merging the daily sketches instead of a distinct scan of the hits
+    """
+
+    kind = "hll"
+    since_key = "unique_sketches_since"
+    columns = ("date", "path", "remote_address")
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model, store: SketchStore, precision: int = 12):
+        super().__init__(db, model, meta_model, store)
+        self.precision = precision
+
+    def new_sketch(self) -> HyperLogLog:
+        return HyperLogLog(self.precision)
+
+    def add(self, sketch: HyperLogLog, row: dict) -> None:
+        sketch.add(row.get("remote_address") or "")
+
+    def count(self, lower: datetime.datetime, upper: datetime.datetime, path: str = None) -> int:
+        return round(self.merged(lower, upper, path).count())
+
+    def count_per_path(self, lower: datetime.datetime, upper: datetime.datetime) -> Dict[str, int]:
+        return {path: round(sketch.count()) for path, sketch in self.merged_per_path(lower, upper).items()}
+
+    def count_per_bucket(self, lower: datetime.datetime, upper: datetime.datetime, path: str,
+                         granularity: str) -> List[dict]:
+        """ Chart points {"x": label, "y": unique visitors} for every bucket """
+        return [{"x": label(bucket, granularity), "y": round(sketch.count())}
+                for bucket, sketch in self.merged_per_bucket(lower, upper, path, granularity).items()]
+
+
+class LatencySketches(SketchAggregate):
+    """ DDSketch quantile sketches of the response times, answering percentiles for any range and path by merging
+        the daily sketches instead of sorting the hits. Sampled hits count as often as their rounded sample weight.
+    """
+
+    kind = "ddsketch"
+    since_key = "latency_sketches_since"
+    columns = ("date", "path", "response_time", "sample_weight")
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model, store: SketchStore,
+                 relative_accuracy: float = 0.01):
+        super().__init__(db, model, meta_model, store)
+        self.relative_accuracy = relative_accuracy
+
+    def new_sketch(self) -> DDSketch:
+        return DDSketch(self.relative_accuracy)
+
+    def add(self, sketch: DDSketch, row: dict) -> None:
+        if row.get("response_time") is not None:
+            sketch.add(row["response_time"], round(row.get("sample_weight") or 1))
+
+    def percentiles(self, lower: datetime.datetime, upper: datetime.datetime, path: str = None,
+                    quantiles: Sequence[float] = PERCENTILES) -> List[Optional[float]]:
+        return self.merged(lower, upper, path).quantiles(quantiles)
+
+    def percentiles_per_path(self, lower: datetime.datetime, upper: datetime.datetime,
+                             quantiles: Sequence[float] = PERCENTILES) -> Dict[str, List[Optional[float]]]:
+        return {path: sketch.quantiles(quantiles) for path, sketch in self.merged_per_path(lower, upper).items()}
+
+    def percentiles_per_bucket(self, lower: datetime.datetime, upper: datetime.datetime, path: str,
+                               granularity: str, quantiles: Sequence[float] = PERCENTILES) -> List[dict]:
+        """ Chart points {"x": label, "y": [percentiles]} for every bucket """
+        return [{"x": label(bucket, granularity), "y": sketch.quantiles(quantiles)}
+                for bucket, sketch in self.merged_per_bucket(lower, upper, path, granularity).items()]
+
+
+class TopValueSketches(SketchAggregate):
+    """ Heavy hitter summaries of the most frequent values of some columns (paths, referrers, browsers, ...) per day,
+        answering top k breakdowns for any range by merging the daily summaries instead of grouping all hits.
+        Every column is stored as its own kind. Sampled hits count with their sample weight.
+    """
+
+    kind = "topk"
+    since_key = "top_value_sketches_since"
+
+    def __init__(self, db: SQLAlchemy, model: Model, meta_model: Model, store: SketchStore,
+                 column_names: Sequence[str] = TOP_VALUE_COLUMNS, capacity: int = 1000):
+        super().__init__(db, model, meta_model, store)
+        self.column_names = tuple(column_names)
+        self.columns = ("date", *self.column_names, "sample_weight")
+        self.capacity = capacity
+
+    def new_sketch(self) -> HeavyHitters:
+        return HeavyHitters(self.capacity)
+
+    def _kind(self, column_name: str) -> str:
+        return f"{self.kind}:{column_name}"
+
+    def update(self, session, rows: List[dict]) -> None:
+        sketches = {column_name: {} for column_name in self.column_names}
+        for row in rows:
+            day = truncate(row["date"], "day")
+            weight = row.get("sample_weight") or 1
+            for column_name in self.column_names:
+                sketch = sketches[column_name].get(day)
+                if sketch is None:
+                    sketch = sketches[column_name][day] = self.new_sketch()
+                # Hits without a value aren't counted, like in StatisticsQueries.get_statistic_data
+                if row.get(column_name) is not None:
+                    sketch.add(row[column_name], weight)
+
+        for column_name, days in sketches.items():
+            self.store.merge_into(session, self._kind(column_name),
+                                  {(day, ALL_PATHS): sketch for day, sketch in days.items()})
+
+    def clear(self, session) -> None:
+        for column_name in self.column_names:
+            self.store.clear(session, self._kind(column_name))
+
+    def merged_column(self, column_name: str, lower: datetime.datetime, upper: datetime.datetime) -> HeavyHitters:
+        """ Summary of a column's values of all hits in [lower, upper) """
+        result = self.new_sketch()
+        for _, _, sketch in self.store.load(self._kind(column_name), HeavyHitters, lower, upper, ALL_PATHS):
+            result.merge(sketch)
+        return result
+
+    def top(self, column_name: str, lower: datetime.datetime, upper: datetime.datetime, k: int) -> Tuple[list, list]:
+        """ Labels and (approximate) counts of the k most frequent values, followed by OTHER with the rest """
+        sketch = self.merged_column(column_name, lower, upper)
+        return top_with_other(sketch.top(k), sketch.total, k)
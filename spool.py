@@ -0,0 +1,345 @@
+import atexit
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import meta
+from .writer import SyncWriter
+
+# Hit columns written to the spool, in this order. Browser, platform and geo columns are derived by the aggregator.
+SPOOL_COLUMNS = ("date", "response_time", "status_code", "size", "method", "path", "referrer", "user_agent",
+                 "mimetype", "exception", "remote_address", "sample_weight")
+
+# Suffixes of the file a process appends to and of files which are complete
+ACTIVE_SUFFIX = ".spool"
+SEALED_SUFFIX = ".sealed"
+STATUS_FILE = "aggregator.json"
+LOCK_FILE = "aggregator.lock"
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def encode_hit(obj: dict) -> bytes:
+    """ Spool line of a hit: a json array of the SPOOL_COLUMNS, the date in microseconds since the epoch """
+    values = [obj.get(column) for column in SPOOL_COLUMNS]
+    values[0] = (values[0] - EPOCH) // MICROSECOND
+    return json.dumps(values, separators=(",", ":"), default=str).encode("utf-8") + b"\n"
+
+
+def decode_hit(line: bytes) -> dict:
+    row = dict(zip(SPOOL_COLUMNS, json.loads(line)))
+    row["date"] = EPOCH + row["date"] * MICROSECOND
+    return row
+
+
+def read_status(directory: str) -> Optional[dict]:
+    """ Metrics last written by the aggregator draining a spool directory, None if it never ran """
+    try:
+        with open(os.path.join(directory, STATUS_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+class SpoolWriter(SyncWriter):
+    """ Appends every hit to a spool file of the worker process instead of writing it to the database. A single
+        aggregator process (`flask statistics aggregate`) stores the spooled hits in batches.
+
+        Every process appends to files of its own, so workers neither wait for each other nor for the database's
+        write lock: a hit costs one json encoding and one write(2). Geo data, browser, platform, ... are derived by
+        the aggregator. Files are sealed (renamed to .sealed) once they reach max_file_bytes or rotate_interval seconds.
+
+        :param directory: spool directory, relative to the app's root path
+        :param max_file_bytes: size after which a file is sealed and a new one started
+        :param rotate_interval: seconds after which a file is sealed and a new one started (checked on writes)
+    """
+
+    def __init__(self, app, db, model, directory: str = "statistics_spool", max_file_bytes: int = 16 * 1024 * 1024,
+                 rotate_interval: float = 60.0):
+        super().__init__(app, db, model)
+        self.directory = os.path.join(app.root_path, directory)
+        self.max_file_bytes = max_file_bytes
+        self.rotate_interval = rotate_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._pid = None
+        self._fd = None
+        self._name = None
+        self._token = None
+        self._sequence = 0
+        self._size = 0
+        self._opened = 0.0
+
+        atexit.register(self.close)
+
+    def _open(self) -> None:
+        self._sequence += 1
+        self._name = os.path.join(self.directory, f"{self._pid}-{self._token}-{self._sequence:06d}")
+        self._fd = os.open(self._name + ACTIVE_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = 0
+        self._opened = time.monotonic()
+
+    def _seal(self) -> None:
+        os.close(self._fd)
+        self._fd = None
+        os.rename(self._name + ACTIVE_SUFFIX, self._name + SEALED_SUFFIX)
+
+    def write(self, obj: dict) -> None:
+        line = encode_hit(obj)
+        with self._lock:
+            try:
+                if self._pid != os.getpid():
+                    # A forked worker, the inherited file belongs to the parent
+                    if self._fd is not None:
+                        os.close(self._fd)
+                        self._fd = None
+                    self._pid = os.getpid()
+                    self._token = uuid.uuid4().hex[:8]
+                    self._sequence = 0
+                elif self._fd is not None and (self._size >= self.max_file_bytes or
+                                               time.monotonic() - self._opened >= self.rotate_interval):
+                    self._seal()
+                if self._fd is None:
+                    self._open()
+
+                os.write(self._fd, line)
+                self._size += len(line)
+            except OSError:
+                self.failed += 1
+                raise
+            self.queued += 1
+            self.flushed += 1
+
+    def close(self) -> None:
+        """ Seal the file of this process """
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                self._seal()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self.queued, "flushed": self.flushed, "dropped": self.dropped, "failed": self.failed,
+                    "file": None if self._fd is None else self._name + ACTIVE_SUFFIX}
+
+
+class SpoolAggregator:
+    """ Drains the spool files of all worker processes into the database: reads the hits, runs the enrichment
+        pipeline on them and writes them in batches through a SyncWriter, so rollups, sketches, partitions, ...
+        are maintained as usual.
+
+        The read offset of every file is stored in the meta table within the transaction of each batch, so every hit
+        is stored once even if the aggregator is killed. Files are removed once they are sealed (or the process
+        writing them exited) and completely stored. Only one aggregator can drain a directory at a time.
+
+        :param batch_size: hits written per transaction
+        :param geo: resolve the geo columns with the geo resolver of the DashStatistics instance
+        :param read_bytes: bytes read from a file at once
+        :param window: seconds over which the throughput is measured
+    """
+
+    offsets_key = "spool_offsets"
+
+    def __init__(self, stats, directory: str = None, batch_size: int = 5000, geo: bool = True,
+                 read_bytes: int = 4 * 1024 * 1024, window: float = 60.0):
+        self.stats = stats
+        self.directory = directory or stats.writer.directory
+        self.batch_size = batch_size
+        self.geo = geo
+        self.read_bytes = read_bytes
+        self.window = window
+        self.writer = stats.configure_writer(SyncWriter(stats.app, stats.db, stats.model))
+
+        self.hits = 0
+        self.batches = 0
+        self.invalid = 0
+        self.removed_files = 0
+        self.files = 0
+        self.backlog_bytes = 0
+        self.lag_seconds = 0.0
+        self.last_batch_seconds = 0.0
+        self._offsets = None
+        self._recent = collections.deque()
+        self._started = time.monotonic()
+        self._lock_file = None
+
+    def acquire(self) -> None:
+        """ Take the directory's aggregator lock, raises RuntimeError if another aggregator holds it """
+        # Only available on unix, like the aggregator's use of os.kill
+        import fcntl
+
+        if self._lock_file is not None:
+            return
+        lock_file = open(os.path.join(self.directory, LOCK_FILE), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f"Another aggregator is draining {self.directory}")
+        self._lock_file = lock_file
+
+    def _files(self) -> Dict[str, str]:
+        """ {name without suffix: path} of the spool files """
+        files = {}
+        for name in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix == SEALED_SUFFIX or (suffix == ACTIVE_SUFFIX and stem not in files):
+                files[stem] = os.path.join(self.directory, name)
+        return files
+
+    @staticmethod
+    def _is_sealed(stem: str, path: str) -> bool:
+        """ Whether nothing is appended to a file anymore: it was sealed or its process exited """
+        if path.endswith(SEALED_SUFFIX):
+            return True
+        try:
+            os.kill(int(stem.split("-")[0]), 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def _read(self, files: Dict[str, str]) -> Tuple[List[dict], Dict[str, int], List[str]]:
+        """ Up to batch_size hits after the stored offsets, their new offsets and the files read completely """
+        rows = []
+        offsets = dict(self._offsets)
+        finished = []
+        for stem, path in sorted(files.items()):
+            if len(rows) >= self.batch_size:
+                break
+            # Checked before reading, everything appended until then is read below
+            sealed = self._is_sealed(stem, path)
+            offset = self._offsets.get(stem, 0)
+            try:
+                with open(path, "rb") as file:
+                    file.seek(offset)
+                    data = file.read(self.read_bytes)
+            except FileNotFoundError:
+                # Sealed in the meantime, read under its new name next time
+                continue
+
+            position = 0
+            while position < len(data) and len(rows) < self.batch_size:
+                end = data.find(b"\n", position)
+                if end == -1:
+                    if not sealed or len(data) == self.read_bytes:
+                        break
+                    # Incomplete last line of a process which died while writing it
+                    end = len(data) - 1
+                try:
+                    rows.append(decode_hit(data[position:end + 1]))
+                except (ValueError, TypeError):
+                    self.invalid += 1
+                position = end + 1
+
+            offsets[stem] = offset + position
+            if sealed and position == len(data) < self.read_bytes:
+                finished.append(stem)
+        return rows, offsets, finished
+
+    def _enrich(self, rows: List[dict]) -> None:
+        self.stats.enrichment.enrich(rows, skip=() if self.geo else ("geo",))
+
+    def drain(self) -> int:
+        """ Store one batch of spooled hits, returns the number of hits read """
+        with self.stats.app.app_context():
+            return self._drain()
+
+    def _drain(self) -> int:
+        started = time.perf_counter()
+        session = self.stats.db.session
+        if self._offsets is None:
+            self._offsets = json.loads(meta.get_value(session, self.stats.meta_model, self.offsets_key, "{}"))
+            session.commit()
+
+        files = self._files()
+        rows, offsets, finished = self._read(files)
+        # Offsets of removed files aren't needed anymore
+        offsets = {stem: offset for stem, offset in offsets.items() if stem in files}
+
+        if offsets != self._offsets:
+            def store_offsets(session):
+                meta.set_value(session, self.stats.meta_model, self.offsets_key, json.dumps(offsets))
+
+            if rows:
+                self._enrich(rows)
+                self.writer.write_many(rows, before_commit=store_offsets)
+            else:
+                store_offsets(session)
+                session.commit()
+            self._offsets = offsets
+
+        for stem in finished:
+            try:
+                os.remove(files[stem])
+                self.removed_files += 1
+            except FileNotFoundError:
+                pass
+
+        self.files = len(files) - len(finished)
+        self.backlog_bytes = 0
+        for stem, path in files.items():
+            if stem not in finished:
+                try:
+                    self.backlog_bytes += max(0, os.path.getsize(path) - offsets.get(stem, 0))
+                except FileNotFoundError:
+                    pass
+
+        now = time.monotonic()
+        if rows:
+            self.hits += len(rows)
+            self.batches += 1
+            self._recent.append((now, len(rows)))
+            self.last_batch_seconds = time.perf_counter() - started
+        # Age of the newest stored hit while there are hits waiting
+        self.lag_seconds = 0.0
+        if self.backlog_bytes and rows:
+            self.lag_seconds = (datetime.datetime.utcnow() - max(row["date"] for row in rows)).total_seconds()
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+        self._write_status()
+        return len(rows)
+
+    def run(self, poll_interval: float = 0.5, stop: threading.Event = None, report: Callable = None,
+            report_interval: float = 10.0) -> None:
+        """ Drain the spool until stop is set, waiting poll_interval seconds whenever it is empty
+
+            :param report: called with metrics() every report_interval seconds
+        """
+        self.acquire()
+        stop = stop or threading.Event()
+        reported = time.monotonic()
+        while not stop.is_set():
+            try:
+                read = self.drain()
+            except Exception as e:
+                self.stats.app.logger.warning("Error in dash-statistics aggregator: " + str(e))
+                read = 0
+            if report is not None and time.monotonic() - reported >= report_interval:
+                report(self.metrics())
+                reported = time.monotonic()
+            if read < self.batch_size:
+                stop.wait(poll_interval)
+
+    def metrics(self) -> dict:
+        """ Lag and throughput metrics """
+        elapsed = min(self.window, time.monotonic() - self._started)
+        recent = sum(hits for _, hits in self._recent)
+        return {"hits": self.hits, "batches": self.batches, "invalid": self.invalid, "files": self.files,
+                "removed_files": self.removed_files, "backlog_bytes": self.backlog_bytes,
+                "lag_seconds": self.lag_seconds, "hits_per_second": recent / elapsed if elapsed > 0 else 0.0,
+                "last_batch_seconds": self.last_batch_seconds}
+
+    def _write_status(self) -> None:
+        status = {**self.metrics(), "pid": os.getpid(), "updated": datetime.datetime.utcnow().isoformat()}
+        path = os.path.join(self.directory, STATUS_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(status, file)
+        os.replace(path + ".tmp", path)
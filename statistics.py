@@ -1,26 +1,133 @@
 import time
 import datetime
+import os
 import time
+from typing import List, Optional
 
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
 import flask
-import requests
-from dash.dependencies import Input, Output, State
 from flask import Response, g, request
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import exc
 from sqlalchemy.sql import sqltypes
+from werkzeug.exceptions import HTTPException
 
-from . import index_view, route_view
+from . import interning, meta, migrations
 from .StatisticsQueries import StatisticsQueries
+from .charts import Charts
+from .cli import register_commands
+from .columnar import ArchivedStatisticsQueries, ColumnarArchive
+from .database import BIND_KEY, DEFAULT_URI, StatisticsSQLAlchemy
+from .enrichment import EnrichmentPipeline, EnrichmentStage, default_stages
+from .geo import CachedGeoResolver, GeoResolver, RemoteGeoResolver
+from .interning import Interner
+from .lazy_dashboard import LazyDashboard
+from .live import LiveBuffer
+from .partitions import Partitions
+from .path_rules import DASH_RULES, PathRules
+from .query_cache import CachedStatisticsQueries
+from .rollups import Rollups
+from .sampling import SamplingPolicy
+from .sketches import TOP_VALUE_COLUMNS, LatencySketches, SketchStore, TopValueSketches, UniqueVisitorSketches
+from .spool import SpoolWriter
+from .writer import BufferedWriter, SyncWriter
 
 
 class DashStatistics:
 
-    def __init__(self, app: flask.app.Flask, prefix: str, db_colums: dict = None, app_name: str = "", **kwargs):
-        self.BLACKLIST = ["_dash-component-suites", "_dash-dependencies", "_dash-layout", "_dash-update-component"]
+    def __init__(self, app: flask.app.Flask, prefix: str, db_colums: dict = None, app_name: str = "",
+                 writer_mode: str = "sync", writer_options: dict = None, geo_resolver: GeoResolver = None,
+                 rollups: bool = False, unique_visitors: str = "exact", sketch_precision: int = 12,
+                 query_cache: bool = False, query_cache_options: dict = None, database_uri: str = DEFAULT_URI,
+                 engine_options: dict = None, pool_size: int = None, sqlite_pragmas: dict = None,
+                 partitioning: str = None, retention_months: int = None, retention_action: str = "drop",
+                 archive_directory: str = "statistics_archive", compact_after_months: int = None,
+                 columnar_archive: str = None, normalized: bool = False, response_time_percentiles: bool = False,
+                 percentile_accuracy: float = 0.01, dashboard: str = "eager", sampling: SamplingPolicy = None,
+                 exclude_paths: List[str] = (), include_paths: List[str] = (), path_templates: List[str] = (),
+                 url_rule_templates: bool = False, enrichment_stages: List[EnrichmentStage] = (),
+                 exclude_bots: bool = False, live_view: bool = False, live_options: dict = None,
+                 top_k: int = None, route_limit: int = None, top_value_sketches: bool = False,
+                 top_value_options: dict = None, chart_options: dict = None, **kwargs):
+        """
+        :param dashboard: "eager" builds the dashboard under prefix right away, "lazy" imports and builds it on the
+                          first request under prefix, so the host app starts without importing dash, plotly and
+                          pandas. None serves no dashboard, e.g. when `flask statistics dashboard` serves it from a
+                          separate process.
+        :param live_view: keep the most recent hits in memory and serve a live view of the last minutes under
+                          prefix + "live", which polls for new hits instead of querying the database
+        :param live_options: {"capacity": recent hits kept, "minutes": minutes charted, "interval": milliseconds
+                             between polls}, default {"capacity": 2000, "minutes": 60, "interval": 2000}
+        :param database_uri: database of the statistics, stored in the "statistics" bind.
+                             app.config["SQLALCHEMY_BINDS"]["statistics"] takes precedence if it is set.
+        :param engine_options: keyword arguments for sqlalchemy.create_engine of the statistics database
+        :param pool_size: number of pooled connections to the statistics database
+        :param sqlite_pragmas: pragmas set on every SQLite connection, default: database.SQLITE_PRAGMAS (WAL, ...)
+        :param writer_mode: "sync" stores every hit while tearing down the request,
+                            "buffered" queues hits and stores them in batches from a background thread,
+                            "spool" appends hits to a file per worker process, which `flask statistics aggregate`
+                            stores from a single process
+        :param exclude_paths: rules of paths which are not recorded, e.g. ["/static/", "glob:*.ico", "regex:/health$"],
+                              see PathRules. The dashboard's own requests are never recorded.
+        :param include_paths: if given, only paths matching one of these rules are recorded
+        :param path_templates: route templates like "/user/<id>", paths matching one are stored as the template
+        :param url_rule_templates: store the rule of the flask route which served a request (e.g. /user/<id> for
+                                   @app.route("/user/<int:id>")) instead of its path, unless path_templates match
+        :param sampling: record only a sample of the hits, e.g. SamplingPolicy(rate=0.1, per_visitor=True). Every
+                         hit is stored with its sample weight and the queries estimate totals from the weights. Once
+                         hits were sampled, sampling must stay set (with rate=1 to record all hits again).
+        :param writer_options: keyword arguments for the writer, e.g. for the buffered writer
+                               {"batch_size": 500, "flush_interval": 1000, "max_queue": 10000, "overflow": "drop"}
+                               or for the spool writer {"directory": "statistics_spool", "max_file_bytes": ...}
+        :param geo_resolver: backend filling the user_country_*, user_region_*, ... columns.
+                             Default: cached lookups with the freegeoip http api, which don't wait for the api: hits
+                             of an ip are stored without geo data until its lookup finished
+        :param enrichment_stages: stages run after the user agent, bot and geo stages of the enrichment pipeline,
+                                  e.g. to derive columns differently. They may only set columns of the hits table.
+        :param exclude_bots: leave hits flagged as bots (is_bot) out of every dashboard query, rollup and sketch.
+                             Run `flask statistics rebuild-rollups` / `rebuild-sketches` after changing it.
+        :param rollups: maintain hourly/daily rollup tables and answer dashboard queries from them, with unique
+                        visitors estimated from HyperLogLog sketches of sketch_precision.
+                        Run `flask statistics rebuild-rollups` once to include existing hits.
+        :param unique_visitors: "exact" counts distinct ip addresses, "sketch" estimates unique visitors by merging
+                                daily HyperLogLog sketches per path. Run `flask statistics rebuild-sketches` once to
+                                include existing hits.
+        :param sketch_precision: HyperLogLog precision of the unique visitor sketches and rollups, the standard error is
+                                 1.04 / sqrt(2 ** precision)
+        :param response_time_percentiles: keep daily DDSketch quantile sketches of the response times per path and
+                                          show the p50/p90/p95/p99 response times on the dashboard. Run
+                                          `flask statistics rebuild-sketches` once to include existing hits.
+        :param percentile_accuracy: relative error of the response time percentiles
+        :param top_k: show only the top_k most frequent values (and "Other") in the dashboard's pie charts
+        :param route_limit: show only this many of the most requested routes in the dashboard's routes table
+        :param top_value_sketches: keep daily heavy hitter summaries of the most frequent values of some columns,
+                                   answering the top_k queries in bounded memory. Run
+                                   `flask statistics rebuild-sketches` once to include existing hits.
+        :param top_value_options: {"columns": columns summarized, "capacity": counters per day and column}, default
+                                  {"columns": TOP_VALUE_COLUMNS, "capacity": 1000}
+        :param chart_options: keyword arguments for charts.Charts, e.g. {"points": 400, "max_buckets": 1600,
+                              "cache_bytes": 16 * 1024 * 1024}: the charts are queried with up to max_buckets buckets,
+                              downsampled to points per trace and their figures cached in cache_bytes
+        :param query_cache: cache the results of the dashboard queries
+        :param query_cache_options: keyword arguments for CachedStatisticsQueries, e.g.
+                                    {"maxbytes": 64 * 1024 * 1024, "disk_path": "statistics_cache.db"}
+        :param partitioning: "month" stores the hits in one table per month, queries only read the months of their
+                             range. Hits recorded before stay in the statistics table.
+        :param retention_months: with partitioning, `flask statistics apply-retention` removes the partitions of
+                                 months which ended more than this many months ago
+        :param retention_action: "drop" deletes expired partitions, "archive" moves them into one SQLite file per
+                                 month in archive_directory (relative to the app's root path)
+        :param compact_after_months: with partitioning and rollups, `flask statistics apply-retention` drops the
+                                     raw hits of older months once the rollups cover them
+        :param normalized: store path, user agent, browser, platform, geo names, ... as ids into the statistics_string
+                           lookup table instead of repeating them in every hit. An existing database is converted
+                           on startup.
+        :param columnar_archive: directory (relative to the app's root path) of a columnar copy of closed months,
+                                 written by `flask statistics export-columnar`. Dashboard queries read archived
+                                 months from it instead of the database.
+        """
+        self.path_rules = PathRules(exclude=DASH_RULES + list(exclude_paths), include=include_paths,
+                                    templates=path_templates)
+        self.url_rule_templates = url_rule_templates
+        self._url_adapter = None
 
         if db_colums is None:
             db_colums = {
@@ -53,26 +160,85 @@ class DashStatistics:
         self.app = app
         self.prefix = prefix
         self.app_name = app_name
-
+        self.use_rollups = rollups
+        if unique_visitors not in ("exact", "sketch"):
+            raise ValueError(f"Unknown unique visitor mode: {unique_visitors!r}")
+        self.use_unique_sketches = unique_visitors == "sketch"
+        if self.use_unique_sketches and sampling is not None:
+            raise ValueError("Unique visitors of sampled hits can't be estimated with sketches, "
+                             "use unique_visitors=\"exact\"")
+        self.sampling = sampling
+        self.exclude_bots = exclude_bots
+        live_options = {"capacity": 2000, "minutes": 60, "interval": 2000, **(live_options or {})}
+        self.live = LiveBuffer(live_options["capacity"], live_options["minutes"]) if live_view else None
+        self.live_interval = live_options["interval"]
+        if self.live is not None:
+            self.live.exclude_bots = exclude_bots
+        self.sketch_precision = sketch_precision
+        self.use_latency_sketches = response_time_percentiles
+        self.percentile_accuracy = percentile_accuracy
+        self.top_k = top_k
+        self.route_limit = route_limit
+        self.use_top_value_sketches = top_value_sketches
+        self.top_value_options = {"columns": TOP_VALUE_COLUMNS, "capacity": 1000, **(top_value_options or {})}
+        self.charts = Charts(**(chart_options or {}))
+        if partitioning not in (None, "month"):
+            raise ValueError(f"Unknown partitioning: {partitioning!r}")
+        self.use_partitions = partitioning is not None
+        self.normalized = normalized
+        if retention_action not in ("drop", "archive"):
+            raise ValueError(f"Unknown retention action: {retention_action!r}")
+        self.retention = {"retention_months": retention_months, "action": retention_action,
+                          "archive_directory": os.path.join(app.root_path, archive_directory),
+                          "compact_after_months": compact_after_months}
+
+        self.db = StatisticsSQLAlchemy(self.app, database_uri, engine_options, pool_size, sqlite_pragmas)
         self.create_model(db_colums)
-        self.api = StatisticsQueries(self.db, self.model)
-
-        self.dash_app = self.init_dashboard()
-        self.init_callbacks()
+        self.api = StatisticsQueries(self.db, self.model, rollups=self.rollups, unique_sketches=self.unique_sketches,
+                                     partitions=self.partitions, interner=self.interner,
+                                     latency_sketches=self.latency_sketches, sampling=self.sampling,
+                                     exclude_bots=self.exclude_bots, top_value_sketches=self.top_value_sketches,
+                                     meta_model=self.meta_model)
+        with self.app.app_context():
+            self.api.initialize_late_write_watermark()
+        self.columnar_archive = None
+        if columnar_archive is not None:
+            self.columnar_archive = ColumnarArchive(os.path.join(app.root_path, columnar_archive))
+            self.api = ArchivedStatisticsQueries(self.api, self.columnar_archive)
+        if query_cache:
+            self.api = CachedStatisticsQueries(self.api, **(query_cache_options or {}))
+        self.geo_resolver = geo_resolver if geo_resolver is not None else CachedGeoResolver(RemoteGeoResolver())
+        self.enrichment = EnrichmentPipeline([*default_stages(self.geo_resolver), *enrichment_stages])
+        self.writer = self.configure_writer(self.create_writer(writer_mode, writer_options or {}))
+
+        if dashboard not in ("eager", "lazy", None):
+            raise ValueError(f"Unknown dashboard mode: {dashboard!r}")
+        self.dash_app = None
+        if dashboard == "eager":
+            self.dash_app = self.init_dashboard()
+            self.init_callbacks()
+        elif dashboard == "lazy":
+            self.app.wsgi_app = LazyDashboard(self, self.app.wsgi_app)
 
         self.app.before_request(self.before_request)
         self.app.after_request(self.after_request)
         self.app.teardown_request(self.teardown_request)
+        register_commands(self)
 
         if "disable_f" in kwargs:
             self.disable_f = kwargs["disable_f"]
 
     def create_model(self, db_columns):
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///statistics.db'
-        self.db = SQLAlchemy(self.app)
+        # Type of the NORMALIZED_COLUMNS
+        lookup = self.db.Integer if self.normalized else self.db.String
 
         class Request(self.db.Model):
             __tablename__ = "statistics"
+            __table_args__ = (
+                self.db.Index("ix_statistics_date", "date"),
+                self.db.Index("ix_statistics_path_date", "path", "date"),
+                self.db.Index("ix_statistics_remote_address_date", "remote_address", "date"),
+            )
 
             index = self.db.Column(self.db.Integer, primary_key=True, autoincrement=True)
             """
@@ -83,89 +249,168 @@ class DashStatistics:
             """
             response_time = self.db.Column(self.db.Float)
             date = self.db.Column(self.db.DateTime)
-            method = self.db.Column(self.db.String)
+            method = self.db.Column(lookup)
             size = self.db.Column(self.db.Integer)
             status_code = self.db.Column(self.db.Integer)
-            path = self.db.Column(self.db.String)
-            user_agent = self.db.Column(self.db.String)
+            path = self.db.Column(lookup)
+            user_agent = self.db.Column(lookup)
             remote_address = self.db.Column(self.db.String)
             exception = self.db.Column(self.db.String)
-            referrer = self.db.Column(self.db.String)
-            browser = self.db.Column(self.db.String)
-            platform = self.db.Column(self.db.String)
-            mimetype = self.db.Column(self.db.String)
-
-            user_country_code = self.db.Column(self.db.String)
-            user_country_name = self.db.Column(self.db.String)
-            user_region_code = self.db.Column(self.db.String)
-            user_region_name = self.db.Column(self.db.String)
-            user_city = self.db.Column(self.db.String)
-            user_zip_code = self.db.Column(self.db.String)
-            user_time_zone = self.db.Column(self.db.String)
+            referrer = self.db.Column(lookup)
+            browser = self.db.Column(lookup)
+            platform = self.db.Column(lookup)
+            mimetype = self.db.Column(lookup)
+
+            user_country_code = self.db.Column(lookup)
+            user_country_name = self.db.Column(lookup)
+            user_region_code = self.db.Column(lookup)
+            user_region_name = self.db.Column(lookup)
+            user_city = self.db.Column(lookup)
+            user_zip_code = self.db.Column(lookup)
+            user_time_zone = self.db.Column(lookup)
             user_latitude = self.db.Column(self.db.String)
             user_longitude = self.db.Column(self.db.String)
+            # 1 / probability that the hit was recorded, NULL (counting once) if hits weren't sampled
+            sample_weight = self.db.Column(self.db.Float)
+            # Set by the enrichment pipeline's bot stage, NULL for hits stored before it
+            is_bot = self.db.Column(self.db.Boolean)
+
+        self.meta_model = meta.create_model(self.db)
+        self.interner = Interner(self.db) if self.normalized else None
+        # The rollups keep their visitor sketches in the sketch store too
+        use_sketches = (self.use_rollups or self.use_unique_sketches or self.use_latency_sketches or
+                        self.use_top_value_sketches)
+        self.sketch_store = SketchStore(self.db) if use_sketches else None
+        self.rollups = None
+        if self.use_rollups:
+            self.rollups = Rollups(self.db, Request, self.meta_model, self.sketch_store, self.sketch_precision)
+        self.unique_sketches = None
+        if self.use_unique_sketches:
+            self.unique_sketches = UniqueVisitorSketches(self.db, Request, self.meta_model, self.sketch_store,
+                                                         self.sketch_precision)
+        self.latency_sketches = None
+        if self.use_latency_sketches:
+            self.latency_sketches = LatencySketches(self.db, Request, self.meta_model, self.sketch_store,
+                                                    self.percentile_accuracy)
+        self.top_value_sketches = None
+        if self.use_top_value_sketches:
+            self.top_value_sketches = TopValueSketches(self.db, Request, self.meta_model, self.sketch_store,
+                                                       self.top_value_options["columns"],
+                                                       self.top_value_options["capacity"])
+
+        # Data derived from the hits while they are written
+        self.aggregates = [aggregate for aggregate in (self.rollups, self.unique_sketches, self.latency_sketches,
+                                                       self.top_value_sketches)
+                           if aggregate is not None]
 
         try:
-            self.db.create_all()
+            self.db.create_all(bind=BIND_KEY, app=self.app)
         except (exc.OperationalError, exc.ProgrammingError):
             print("Table already exists!")
         self.model = Request
 
-    def init_dashboard(self) -> dash.Dash:
+        self.partitions = Partitions(self.db, Request, self.meta_model) if self.use_partitions else None
+        with self.app.app_context():
+            if self.partitions is not None:
+                self.partitions.initialize()
+        self.migrate()
+        self.normalize()
+
+        with self.app.app_context():
+            for aggregate in self.aggregates:
+                aggregate.partitions = self.partitions
+                aggregate.interner = self.interner
+                aggregate.exclude_bots = self.exclude_bots
+                aggregate.initialize()
+
+    def migrate(self) -> List[str]:
+        """ Add columns and indexes declared after an existing database was created """
+        with self.app.app_context():
+            engine = self.db.get_engine(self.app, bind=BIND_KEY)
+            changes = migrations.migrate(engine, list(self.db.Model.metadata.sorted_tables))
+        for change in changes:
+            self.app.logger.info("dash-statistics migration: " + change)
+        return changes
+
+    def normalize(self) -> List[str]:
+        """ Convert hit tables which store the NORMALIZED_COLUMNS as text, if normalized storage is enabled """
+        engine = self.db.get_engine(self.app, bind=BIND_KEY)
+        tables = [self.model.__table__]
+        if self.partitions is not None:
+            with self.app.app_context():
+                tables += list(self.partitions.tables().values())
+
+        changes = []
+        for table in tables:
+            normalized = interning.is_normalized(engine, table.name)
+            if normalized is None or normalized == self.normalized:
+                continue
+            if not self.normalized:
+                raise RuntimeError(f"The {table.name} table is normalized, pass normalized=True to DashStatistics")
+            hits = interning.normalize_table(engine, self.interner, table)
+            changes.append(f"normalized {table.name} ({hits} hits)")
+        for change in changes:
+            self.app.logger.info("dash-statistics migration: " + change)
+        return changes
+
+    def apply_retention(self) -> List[str]:
+        """ Drop, archive and compact partitions according to the retention options """
+        with self.app.app_context():
+            changes = self.partitions.apply_retention(**self.retention, rollups=self.rollups)
+        for change in changes:
+            self.app.logger.info("dash-statistics retention: " + change)
+        return changes
+
+    def create_writer(self, writer_mode: str, writer_options: dict) -> SyncWriter:
+        if writer_mode == "sync":
+            return SyncWriter(self.app, self.db, self.model)
+        elif writer_mode == "buffered":
+            return BufferedWriter(self.app, self.db, self.model, **writer_options)
+        elif writer_mode == "spool":
+            return SpoolWriter(self.app, self.db, self.model, **writer_options)
+        raise ValueError(f"Unknown writer mode: {writer_mode!r}")
+
+    def configure_writer(self, writer: SyncWriter) -> SyncWriter:
+        """ Let a writer maintain the partitions, normalized columns and aggregates of this instance and enrich the
+            hits passed to its write()
+        """
+        writer.partitions = self.partitions
+        writer.interner = self.interner
+        writer.enrichment = self.enrichment
+        for aggregate in self.aggregates:
+            writer.batch_hooks.append(aggregate.write_hook)
+        if self.live is not None:
+            writer.batch_hooks.append(self.live.write_hook)
+        writer.batch_hooks.append(self.api.late_write_hook)
+        return writer
+
+    def init_dashboard(self):
         """Create a Plotly Dash dashboard."""
-        dash_app = dash.Dash(
-            name=__name__,
-            server=self.app,
-            routes_pathname_prefix=self.prefix,
-            external_stylesheets=[
-                {
-                    'href': 'https://stackpath.bootstrapcdn.com/bootstrap/4.1.3/css/bootstrap.min.css',
-                    'rel': 'stylesheet',
-                    'integrity': 'sha384-MCw98/SFnGE8fJT3GXwEOngsV7Zt27NXFoaoApmYm81iuXoPkFOJwJ8ERdknLPMO',
-                    'crossorigin': 'anonymous'
-                }
-            ],
-            external_scripts=[
-                {
-                    'src': 'https://cdn.jsdelivr.net/npm/bootstrap@5.0.0-beta3/dist/js/bootstrap.bundle.min.js',
-                    'integrity': 'sha384-JEW9xMcG8R+pH31jmWH6WWP0WintQrMb4s7ZOdauHnUtxwoG2vI5DkLtS3qm9Ekf',
-                    'crossorigin': 'anonymous'
-                }
-            ],
-            meta_tags=[
-                {"name": "viewport", "content": "width=device-width, initial-scale=1"}
-            ],
-        )
-        dash_app.title = f"{self.app_name} - Statistics"
-        dash_app.layout = html.Div([
-            dcc.Location(id='url', refresh=False),
-            html.Div(id='page-content')
-        ])
-
-        return dash_app
+        from . import dashboard
+        return dashboard.create_dash_app(self, self.app)
 
     def init_callbacks(self):
-        index_view.callbacks(self.dash_app, self.api, self.prefix)
-        route_view.callbacks(self.dash_app, self.api, self.prefix)
-
-        @self.dash_app.callback(Output('page-content', 'children'),
-                                [Input('url', 'pathname'), State("url", "search")])
-        def display_page(pathname, search):
-            print(pathname)
-            print(search)
-            if self.prefix == pathname and "path" not in search:
-                return index_view.view(self.api, None, datetime.datetime.now(), self.prefix)
-            elif "?path=" in search:
-                return route_view.view(self.api, None, datetime.datetime.now(), search.split("?path=")[1], self.prefix)
-            else:
-                return index_view.view(self.api, None, datetime.datetime.now(), self.prefix)
+        from . import dashboard
+        dashboard.register_callbacks(self, self.dash_app)
 
     def is_blacklisted(self):
         """ Determine if the requested path is an unwanted url, which should not be counted as a hit """
-        for blacklisted in self.BLACKLIST:
-            if blacklisted in request.path:
-                return True
-        return False
+        return not self.path_rules.is_recorded(request.path)
+
+    def stored_path(self, path: str, url_rule: str = None) -> str:
+        """ Path a recorded hit is stored with, see PathRules.template """
+        return self.path_rules.template(path, url_rule if self.url_rule_templates else None)
+
+    def url_rule_for(self, path: str, method: str = "GET") -> Optional[str]:
+        """ Rule of the flask route serving path, e.g. for imported hits. None if no route matches. """
+        if self._url_adapter is None:
+            self._url_adapter = self.app.url_map.bind("localhost")
+        try:
+            rule, _ = self._url_adapter.match(path, method, return_rule=True)
+        except HTTPException:
+            # NotFound, MethodNotAllowed and RequestRedirect
+            return None
+        return rule.rule
 
     def before_request(
             self
@@ -225,42 +470,30 @@ class DashStatistics:
 
             # Take time when request ended
             end_time = time.time()
+
+            # Decide before deriving anything from the request, most hits may not be recorded
+            sample_weight = None
+            if self.sampling is not None:
+                sample_weight = self.sampling.weight(request.path, request.environ['REMOTE_ADDR'],
+                                                     g.request_status_code, exception)
+                if sample_weight is None:
+                    return None
+
+            url_rule = request.url_rule.rule if request.url_rule is not None else None
+
             # Create object that is later stored in database
             obj = {"response_time": end_time - g.start_time, "status_code": g.request_status_code,
-                   "size": g.request_content_size, "method": request.method, "path": request.path,
-                   "referrer": request.referrer, "browser": "{browser} {version}".format(
-                    browser=request.user_agent.browser,
-                    version=request.user_agent.version), "platform": request.user_agent.platform,
-                   "user_agent": request.user_agent.string, "date": g.request_date, "mimetype": g.mimetype,
-                   "exception": None if exception is None else repr(exception),
+                   "size": g.request_content_size, "method": request.method,
+                   "path": self.stored_path(request.path, url_rule),
+                   "referrer": request.referrer, "user_agent": request.user_agent.string, "date": g.request_date,
+                   "mimetype": g.mimetype, "exception": None if exception is None else repr(exception),
                    "remote_address": (request.environ['REMOTE_ADDR'])}
+            if sample_weight is not None:
+                obj["sample_weight"] = sample_weight
 
-            # Gets geo data based of ip
-            ip = request.remote_addr if request.remote_addr != "127.0.0.1" else ""
-            # the api does not work with '127.0.0.1' but with "" for the localhost
-
-            url = "https://freegeoip.app/json/{0}".format(ip)
-            with requests.get(url) as req:
-                if req.status_code != 403:  # 403 means rate limit was reached
-                    resp = req.json()
-
-                    none_if_empty = lambda s: None if resp.get(s) == "" else resp.get(s)  # noqa F731
-
-                    obj["user_country_code"] = none_if_empty("country_code")
-                    obj["user_country_name"] = none_if_empty("country_name")
-                    obj["user_region_code"] = none_if_empty("region_code")
-                    obj["user_region_name"] = none_if_empty("region_name")
-                    obj["user_city"] = none_if_empty("city")
-                    obj["user_zip_code"] = none_if_empty("zip_code")
-                    obj["user_time_zone"] = none_if_empty("time_zone")
-                    obj["user_latitude"] = none_if_empty("latitude")
-                    obj["user_longitude"] = none_if_empty("longitude")
-
-            # Adds object to db and saves
-            self.db.session.add(
-                self.model(**obj)
-            )
-            self.db.session.commit()
+            # Hands the object to the writer, which derives browser, platform, geo data, ... with the enrichment
+            # pipeline and stores it (now or batched later, off the request thread)
+            self.writer.write(obj)
         except Exception as e:
             self.app.logger.warning("Error in dash-statistics teardown: " + str(e))
 
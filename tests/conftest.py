@@ -0,0 +1,102 @@
+import datetime
+import importlib.util
+import os
+import random
+import sys
+from typing import List
+
+import flask
+import pytest
+
+PACKAGE = "Dash_statistics"
+PREFIX = "/statistics/"
+
+# The tests import the package as Dash_statistics, like applications do, even from a checkout with another name
+if PACKAGE not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "__init__.py"),
+        submodule_search_locations=[os.path.dirname(os.path.dirname(os.path.abspath(__file__)))])
+    sys.modules[PACKAGE] = importlib.util.module_from_spec(spec)
+
+from Dash_statistics.geo import GeoResolver  # noqa: E402
+from Dash_statistics.statistics import DashStatistics  # noqa: E402
+
+# Synthetic hits are spread over the 60 days before TODAY
+TODAY = datetime.datetime.utcnow().date()
+START = datetime.datetime.combine(TODAY - datetime.timedelta(days=59), datetime.time.min)
+END = datetime.datetime.combine(TODAY, datetime.time.min) + datetime.timedelta(hours=12)
+
+# (user agent, browser, platform)
+USER_AGENTS = [
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 "
+     "Safari/537.36", "chrome 91.0.4472.124", "windows"),
+    ("Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+     "Version/14.1.1 Mobile/15E148 Safari/604.1", "safari 14.1.1", "iphone"),
+    ("Mozilla/5.0 (X11; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0", "firefox 89.0", "linux"),
+]
+COUNTRIES = [("US", "United States"), ("DE", "Germany"), ("FR", "France"), ("JP", "Japan")]
+
+
+def pytest_addoption(parser):
+    parser.addoption("--plan-rows", type=int, default=0,
+                     help="hits of the large table whose query plans are checked, e.g. 5000000 (skipped by default)")
+
+
+def synthetic_hits(n: int, start: datetime.datetime = START, end: datetime.datetime = END, seed: int = 0,
+                   paths: int = 50, visitors: int = 500) -> List[dict]:
+    """ n hits in ascending date order. Low path and visitor numbers are the most frequent ones, like on a website. """
+    rng = random.Random(seed)
+    span = (end - start).total_seconds()
+    rows = []
+    for second in sorted(rng.uniform(0, span) for _ in range(n)):
+        path = int(rng.paretovariate(1.2)) - 1
+        visitor = int(rng.paretovariate(1.1)) - 1
+        user_agent, browser, platform = rng.choice(USER_AGENTS)
+        country_code, country_name = rng.choice(COUNTRIES)
+        rows.append({
+            "response_time": rng.lognormvariate(-3.5, 1.0),
+            "date": start + datetime.timedelta(seconds=second),
+            "method": "GET" if rng.random() < 0.9 else "POST",
+            "size": rng.randint(200, 50000),
+            "status_code": rng.choice((200, 200, 200, 200, 304, 404)),
+            "path": "/" if path % paths == 0 else f"/page/{path % paths}",
+            "user_agent": user_agent,
+            "remote_address": f"10.0.{visitor % visitors // 256}.{visitor % visitors % 256}",
+            "exception": None,
+            "referrer": None,
+            "browser": browser,
+            "platform": platform,
+            "mimetype": "text/html",
+            "user_country_code": country_code,
+            "user_country_name": country_name,
+        })
+    return rows
+
+
+def write_hits(stats: DashStatistics, n: int, start: datetime.datetime = START, end: datetime.datetime = END,
+               seed: int = 0) -> None:
+    """ Write synthetic hits through the writer, including its batch hooks """
+    rows = synthetic_hits(n, start, end, seed)
+    with stats.app.app_context():
+        for offset in range(0, n, 5000):
+            stats.writer.write_many(rows[offset:offset + 5000])
+
+
+@pytest.fixture
+def make_stats(tmp_path):
+    """ Factory of DashStatistics instances, each with an app directory (holding its SQLite database) of its own.
+        hits synthetic hits are written right away.
+    """
+    def make(name: str = "statistics", hits: int = 0, **options) -> DashStatistics:
+        root = tmp_path / name
+        root.mkdir()
+        app = flask.Flask(name, root_path=str(root))
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        # No dashboard and no lookups with the remote geo api, unless a test asks for them
+        options.setdefault("dashboard", None)
+        options.setdefault("geo_resolver", GeoResolver())
+        stats = DashStatistics(app, PREFIX, **options)
+        if hits:
+            write_hits(stats, hits)
+        return stats
+    return make
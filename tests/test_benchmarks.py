@@ -0,0 +1,24 @@
+from Dash_statistics.benchmarks.compare import timings
+from Dash_statistics.benchmarks.traffic import TrafficGenerator
+
+from conftest import END, START
+
+
+def test_traffic_generator():
+    chunks = list(TrafficGenerator(START, END, paths=20, returning_visitors=100).hits(2500, chunk_size=1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+
+    dates = [row["date"] for chunk in chunks for row in chunk]
+    assert dates == sorted(dates)
+    assert START <= dates[0] and dates[-1] < END
+    assert len({row["path"] for chunk in chunks for row in chunk}) <= 20
+
+    # The same seed gives the same hits
+    again = list(TrafficGenerator(START, END, paths=20, returning_visitors=100).hits(2500, chunk_size=1000))
+    assert again == chunks
+
+
+def test_timings_of_results():
+    results = {"meta": {"rows": 10}, "load": {"rows": 10},
+               "queries": {"get_routes_data": {"day": {"median": 0.5, "runs": 3}}}}
+    assert timings(results) == {"queries.get_routes_data.day": 0.5}
@@ -0,0 +1,78 @@
+import datetime
+import json
+
+import numpy as np
+
+from Dash_statistics.charts import Charts, downsample, lttb
+
+from conftest import TODAY, synthetic_hits
+
+
+class Figure:
+    """ Stands in for a plotly figure """
+
+    def __init__(self, number: int):
+        self.number = number
+
+    def to_json(self) -> str:
+        return json.dumps({"data": [self.number]})
+
+
+def test_lttb():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[500] = 10
+
+    indices = lttb(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert list(indices) == sorted(set(indices))
+    # Spikes survive downsampling
+    assert 500 in indices
+
+    # Series which are short enough are passed through
+    assert list(lttb(x[:50], y[:50], 100)) == list(range(50))
+    assert list(lttb(x[:50], y[:50], 2)) == list(range(50))
+
+
+def test_downsample_points():
+    start = datetime.datetime(2021, 1, 1)
+    points = [{"x": (start + datetime.timedelta(hours=i)).isoformat(), "y": i % 24} for i in range(1000)]
+    sampled = downsample(points, 100)
+    assert len(sampled) == 100
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert downsample(points[:10], 100) == points[:10]
+
+    percentiles = [{"x": point["x"], "y": [point["y"], point["y"] * 2, None]} for point in points]
+    sampled = downsample(percentiles, 90)
+    assert 3 <= len(sampled) <= 90
+    assert sampled[0] == percentiles[0] and sampled[-1] == percentiles[-1]
+
+
+def test_figure_cache(make_stats):
+    stats = make_stats(hits=100)
+    charts = Charts()
+    built = []
+
+    def build():
+        built.append(True)
+        return Figure(len(built))
+
+    past = datetime.datetime.combine(TODAY, datetime.time.min)
+    future = past + datetime.timedelta(days=1)
+    with stats.app.app_context():
+        assert charts.figure(stats.api, ("hits", "past"), past, build) == {"data": [1]}
+        assert charts.figure(stats.api, ("hits", "today"), future, build) == {"data": [2]}
+        assert charts.figure(stats.api, ("hits", "today"), future, build) == {"data": [2]}
+        assert len(built) == 2
+
+        # Hits of today invalidate the figures of ranges including today only
+        stats.writer.write_many(synthetic_hits(1, start=past, seed=1))
+        assert charts.figure(stats.api, ("hits", "past"), past, build) == {"data": [1]}
+        assert charts.figure(stats.api, ("hits", "today"), future, build) == {"data": [3]}
+
+        # Late hits invalidate the figures of past ranges, too
+        stats.writer.write_many(synthetic_hits(1, end=past - datetime.timedelta(days=1), seed=2))
+        assert charts.figure(stats.api, ("hits", "past"), past, build) == {"data": [4]}
+    assert len(built) == 4
+    assert charts.stats()["hits"] == 4
@@ -0,0 +1,54 @@
+import datetime
+
+from Dash_statistics.buckets import next_bucket
+
+from conftest import START, TODAY
+
+
+def test_archived_months_answer_like_the_database(make_stats):
+    stats = make_stats(columnar_archive="archive", hits=3000)
+    start, end = START.date(), TODAY
+
+    with stats.app.app_context():
+        api = stats.api
+        expected = (api.api.get_routes_data(start, end), api.api.get_statistic_data("browser", start, end),
+                    api.api.get_user_chart_data(start, end, granularity="day"))
+        changes = api.export_closed_months()
+        assert changes
+        assert stats.columnar_archive.months()
+
+        routes = {route.path: route for route in api.get_routes_data(start, end)}
+        assert routes.keys() == {route.path for route in expected[0]}
+        for expected_route in expected[0]:
+            route = routes[expected_route.path]
+            assert (route.hits, route.unique_hits) == (expected_route.hits, expected_route.unique_hits)
+            assert abs(route.average_response_time - expected_route.average_response_time) < 1e-9
+        assert api.get_statistic_data("browser", start, end) == expected[1]
+        assert api.get_user_chart_data(start, end, granularity="day") == expected[2]
+
+
+def test_export_in_chunks_and_merge_untimed_hits(make_stats):
+    stats = make_stats(columnar_archive="archive", hits=3000)
+    start, end = START.date(), TODAY
+    untimed = datetime.datetime.combine(TODAY, datetime.time.min)
+
+    with stats.app.app_context():
+        api = stats.api
+        path = api.api.get_routes_data(start, end)[0].path
+        # Hits of the live month without a response time don't count towards the average
+        stats.writer.write_many([{"date": untimed, "path": path, "method": "GET", "remote_address": "10.0.0.1"}] * 50)
+        expected = {route.path: route for route in api.api.get_routes_data(start, end)}
+
+        assert api.export_closed_months(chunk_size=128)
+        for month, manifest in stats.columnar_archive.months().items():
+            dates = stats.columnar_archive.column(month, "date")
+            assert len(dates) == manifest["rows"] == sum(
+                route.hits for route in api.api.get_routes_data(month, next_bucket(month, "month")))
+            assert (dates[1:] >= dates[:-1]).all()
+
+        routes = {route.path: route for route in api.get_routes_data(start, end)}
+        assert routes.keys() == expected.keys()
+        for route_path, route in routes.items():
+            assert route.hits == expected[route_path].hits
+            assert abs(route.average_response_time - expected[route_path].average_response_time) < 1e-9
+            assert route.response_time_count == expected[route_path].response_time_count
@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import PREFIX
+
+
+def dashboard_status(stats) -> int:
+    return stats.app.test_client().get(PREFIX).status_code
+
+
+def test_eager_dashboard(make_stats):
+    stats = make_stats(dashboard="eager")
+    assert stats.dash_app is not None
+    assert dashboard_status(stats) == 200
+
+
+def test_lazy_dashboard_is_built_on_first_request(make_stats):
+    stats = make_stats(dashboard="lazy")
+
+    @stats.app.route("/hello")
+    def hello():
+        return "hello"
+
+    middleware = stats.app.wsgi_app
+    assert stats.app.test_client().get("/hello").data == b"hello"
+    assert middleware.server is None
+
+    assert dashboard_status(stats) == 200
+    assert middleware.server is not None
+
+
+def test_without_dashboard(make_stats):
+    stats = make_stats()
+    assert stats.dash_app is None
+    assert dashboard_status(stats) == 404
+    with pytest.raises(ValueError):
+        make_stats("unknown", dashboard="separate")
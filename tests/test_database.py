@@ -0,0 +1,44 @@
+import flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.pool import QueuePool
+
+from Dash_statistics.geo import GeoResolver
+from Dash_statistics.statistics import DashStatistics
+
+from conftest import PREFIX, synthetic_hits
+
+
+def test_database_uri_pool_and_pragmas(make_stats, tmp_path):
+    stats = make_stats(database_uri=f"sqlite:///{tmp_path / 'hits.db'}", pool_size=2, hits=10)
+    with stats.app.app_context():
+        engine = stats.api.engine()
+        assert isinstance(engine.pool, QueuePool)
+        with engine.connect() as connection:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert stats.model.query.count() == 10
+    assert (tmp_path / "hits.db").exists()
+
+
+def test_separate_from_the_host_apps_database(tmp_path):
+    app = flask.Flask("host", root_path=str(tmp_path))
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'host.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    host_db = SQLAlchemy(app)
+
+    class User(host_db.Model):
+        id = host_db.Column(host_db.Integer, primary_key=True)
+
+    host_db.create_all()
+    stats = DashStatistics(app, PREFIX, geo_resolver=GeoResolver())
+    assert app.extensions["sqlalchemy"].db is host_db
+
+    with app.app_context():
+        stats.writer.write_many(synthetic_hits(5))
+        host_db.session.add(User())
+        host_db.session.commit()
+        assert stats.model.query.count() == 5
+        assert User.query.count() == 1
+        assert "user" not in inspect(stats.api.engine()).get_table_names()
+        assert "statistics" not in inspect(host_db.engine).get_table_names()
@@ -0,0 +1,94 @@
+import datetime
+
+from Dash_statistics.enrichment import BotStage, EnrichmentPipeline, EnrichmentStage
+
+from conftest import TODAY, synthetic_hits
+
+BOT = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+
+
+def test_memoized_stage():
+    calls = []
+
+    def length(value):
+        calls.append(value)
+        # Nothing to derive from "later" yet, e.g. an unavailable lookup
+        return None if value == "later" else {"size": len(value)}
+
+    stage = EnrichmentStage(function=length, name="length", input="path", columns=["size"])
+    rows = [{"path": path} for path in ("/a", "/bb", "/a", "later", "/a", "later")]
+    EnrichmentPipeline([stage]).enrich(rows)
+
+    assert [row.get("size") for row in rows] == [2, 3, 2, None, 2, None]
+    # None results aren't cached
+    assert calls == ["/a", "/bb", "later", "later"]
+    stats = stage.stats()
+    assert (stats["rows"], stats["hits"], stats["misses"], stats["errors"]) == (6, 2, 4, 0)
+    assert stats["hit_rate"] == 2 / 6
+
+
+def test_stage_skips_rows_with_its_columns():
+    stage = EnrichmentStage(function=lambda value: {"size": 0}, input="path", columns=["size"])
+    rows = [{"path": "/a", "size": 10}, {"path": "/b"}]
+    stage.enrich(rows)
+    assert rows == [{"path": "/a", "size": 10}, {"path": "/b", "size": 0}]
+    assert stage.stats()["rows"] == 1
+
+
+def test_stage_errors_are_counted():
+    stage = EnrichmentStage(function=lambda value: {"number": int(value)}, input="path", columns=["number"])
+    rows = [{"path": "1"}, {"path": "x"}, {"path": "3"}]
+    stage.enrich(rows)
+    assert [row.get("number") for row in rows] == [1, None, 3]
+    assert stage.stats()["errors"] == 1
+    assert "invalid literal" in stage.stats()["last_error"]
+
+
+def test_bot_stage():
+    rows = [{"user_agent": BOT}, {"user_agent": "curl/7.68.0"}, {"user_agent": ""}, {"user_agent": None},
+            {"user_agent": synthetic_hits(1)[0]["user_agent"]}]
+    BotStage().enrich(rows)
+    assert [row["is_bot"] for row in rows] == [True, True, True, True, False]
+
+
+def test_skip_stages(make_stats):
+    stats = make_stats()
+    rows = [{"user_agent": BOT, "remote_address": "10.0.0.1"}]
+    stats.enrichment.enrich(rows, skip=("geo",))
+    assert rows[0]["is_bot"] and rows[0]["browser"].startswith("google")
+    assert stats.enrichment.stats()["geo"]["rows"] == 0
+
+
+def test_exclude_bots(make_stats):
+    rows = synthetic_hits(1500)
+    for row in rows[::5]:
+        row["user_agent"] = BOT
+    humans = [dict(row) for row in rows if row["user_agent"] != BOT]
+
+    plain = make_stats("plain")
+    filtered = make_stats("filtered", exclude_bots=True)
+    rolled = make_stats("rolled", exclude_bots=True, rollups=True)
+    for stats, hits in ((plain, humans), (filtered, rows), (rolled, rows)):
+        hits = [dict(row) for row in hits]
+        stats.enrichment.enrich(hits)
+        with stats.app.app_context():
+            stats.writer.write_many(hits)
+
+    def answers(stats):
+        start, end = TODAY - datetime.timedelta(days=30), TODAY
+        with stats.app.app_context():
+            assert stats.model.query.count() == len(rows if stats is not plain else humans)
+            return (stats.api.get_number_of_unique_visitors(start, end),
+                    stats.api.get_statistic_data("browser", start, end),
+                    sorted((route.path, route.hits, route.unique_hits)
+                           for route in stats.api.get_routes_data(start, end)),
+                    stats.api.get_user_chart_data(start, end, "/", "day"))
+
+    expected = answers(plain)
+    assert answers(filtered) == expected
+    assert answers(rolled) == expected
+
+    # Rebuilt rollups leave the bots out, too
+    with rolled.app.app_context():
+        rolled.rollups.rebuild(1000)
+    assert answers(rolled) == expected
@@ -0,0 +1,54 @@
+import csv
+import gzip
+import io
+import json
+
+from Dash_statistics import export
+
+from conftest import PREFIX, START, TODAY
+
+
+def test_export_formats(make_stats):
+    stats = make_stats(hits=500)
+    with stats.app.app_context():
+        chunks = export.export_chunks(stats.api, START.date(), TODAY, ["date", "path"], None, "csv", False, 100)
+        rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+        assert rows[0] == ["date", "path"]
+        assert len(rows) == 501
+
+        chunks = export.export_chunks(stats.api, START.date(), TODAY, ["path", "status_code"], "/", "ndjson", True,
+                                      100)
+        hits = [json.loads(line) for line in gzip.decompress(b"".join(chunks)).decode("utf-8").splitlines()]
+        assert hits and all(hit["path"] == "/" and isinstance(hit["status_code"], int) for hit in hits)
+
+
+def test_export_command(make_stats, tmp_path):
+    stats = make_stats(hits=200)
+    runner = stats.app.test_cli_runner()
+    output = tmp_path / "hits.csv"
+    result = runner.invoke(args=["statistics", "export", "--columns", "path,browser", "--output", str(output)])
+    assert result.exit_code == 0, result.output
+    assert len(output.read_text().splitlines()) == 201
+
+    result = runner.invoke(args=["statistics", "export", "--columns", "nope"])
+    assert result.exit_code != 0
+
+
+def test_export_endpoint(make_stats):
+    stats = make_stats(dashboard="eager", hits=300)
+    client = stats.app.test_client()
+
+    response = client.get(PREFIX + "export", query_string={"columns": "date,path", "format": "ndjson", "path": "/",
+                                                           "start": START.date().isoformat()})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    hits = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert hits and all(list(hit) == ["date", "path"] and hit["path"] == "/" for hit in hits)
+
+    response = client.get(PREFIX + "export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(gzip.decompress(response.data).decode("utf-8").splitlines()) >= 301
+
+    assert client.get(PREFIX + "export", query_string={"format": "xml"}).status_code == 400
+    assert client.get(PREFIX + "export", query_string={"columns": "nope"}).status_code == 400
+    assert client.get(PREFIX + "export", query_string={"start": "yesterday"}).status_code == 400
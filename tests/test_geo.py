@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from Dash_statistics.geo import CachedGeoResolver, GeoResolver, LocalGeoResolver, RemoteGeoResolver, build_database
+
+RANGES = """ip_start,ip_end,country_code,country_name,region_code,region_name,city,zip_code,time_zone,latitude,longitude
+# documentation ranges
+192.0.2.0,192.0.2.255,DE,Germany,BE,Berlin,Berlin,10115,Europe/Berlin,52.52,13.40
+198.51.100.0,198.51.100.127,FR,France,,,,,,,
+2001:db8::,2001:db8::ffff,JP,Japan,13,Tokyo,Tokyo,,Asia/Tokyo,35.68,139.69
+"""
+
+
+class CountingResolver(GeoResolver):
+    def __init__(self):
+        self.lookups = []
+
+    def resolve(self, ip):
+        self.lookups.append(ip)
+        return None if ip == "203.0.113.1" else {"user_country_code": "NL"}
+
+
+class SlowResolver(RemoteGeoResolver):
+    """ Answers once released instead of asking the http api """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.release = threading.Event()
+
+    def _lookup(self, ip):
+        self.release.wait(5)
+        if ip == "10.0.0.2" or ip.startswith("10.0.1."):
+            raise OSError("unreachable")
+        return {"user_city": ip}
+
+
+def test_local_database(tmp_path):
+    (tmp_path / "ranges.csv").write_text(RANGES)
+    assert build_database(str(tmp_path / "ranges.csv"), str(tmp_path / "geo.db")) == 3
+    resolver = LocalGeoResolver(str(tmp_path / "geo.db"))
+
+    assert resolver.resolve("192.0.2.0")["user_city"] == "Berlin"
+    assert resolver.resolve("192.0.2.255")["user_latitude"] == 52.52
+    assert resolver.resolve("198.51.100.5") == {"user_country_code": "FR", "user_country_name": "France"}
+    assert resolver.resolve("2001:db8::1")["user_country_name"] == "Japan"
+    # Between, before and after the ranges, and no ip at all
+    for ip in ("198.51.100.128", "1.1.1.1", "255.255.255.255", "not an ip"):
+        assert resolver.resolve(ip) == {}
+
+
+def test_overlapping_ranges_are_rejected(tmp_path):
+    (tmp_path / "ranges.csv").write_text("10.0.0.0,10.0.0.255,DE\n10.0.0.128,10.0.1.0,FR\n")
+    with pytest.raises(ValueError):
+        build_database(str(tmp_path / "ranges.csv"), str(tmp_path / "geo.db"))
+
+
+def test_cached_resolver():
+    backend = CountingResolver()
+    resolver = CachedGeoResolver(backend, maxsize=2)
+    for ip in ("192.0.2.1", "192.0.2.1", "192.0.2.2", "203.0.113.1", "203.0.113.1"):
+        resolver.resolve(ip)
+    # Failed lookups (None) aren't cached
+    assert backend.lookups == ["192.0.2.1", "192.0.2.2", "203.0.113.1", "203.0.113.1"]
+    assert resolver.stats()["hits"] == 1
+
+
+def test_requests_are_stored_with_geo_data(make_stats):
+    stats = make_stats(geo_resolver=CountingResolver())
+
+    @stats.app.route("/hello")
+    def hello():
+        return "hello"
+
+    assert stats.app.test_client().get("/hello", environ_base={"REMOTE_ADDR": "192.0.2.7"}).status_code == 200
+    with stats.app.app_context():
+        hit = stats.model.query.one()
+    assert (hit.path, hit.remote_address, hit.user_country_code) == ("/hello", "192.0.2.7", "NL")
+
+
+def test_remote_lookups_dont_block():
+    resolver = SlowResolver()
+    assert resolver.resolve("10.0.0.1") is None
+    assert resolver.resolve("10.0.0.2") is None
+    assert resolver.stats()["pending"] == 2
+
+    resolver.release.set()
+    resolver._executor.shutdown(wait=True)
+    # Finished lookups leave the pending ones, even if their ip isn't resolved again
+    assert resolver.stats()["pending"] == 0
+    assert resolver.stats()["errors"] == 1
+    assert resolver.resolve("10.0.0.1") == {"user_city": "10.0.0.1"}
+
+
+def test_remote_lookups_can_wait():
+    resolver = SlowResolver(wait=5)
+    resolver.release.set()
+    assert resolver.resolve("10.0.0.1") == {"user_city": "10.0.0.1"}
+    resolver._executor.shutdown(wait=True)
+    assert resolver.stats()["pending"] == 0
+
+
+def test_counters_of_concurrent_lookups():
+    resolver = SlowResolver(max_workers=8)
+    ips = [f"10.0.1.{number}" for number in range(200)]
+    threads = [threading.Thread(target=lambda part=part: [resolver.resolve(ip) for ip in ips[part::8]])
+               for part in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    resolver.release.set()
+    resolver._executor.shutdown(wait=True)
+    assert resolver.stats()["timeouts"] == 200
+    assert resolver.stats()["errors"] == 200
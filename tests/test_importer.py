@@ -0,0 +1,39 @@
+from Dash_statistics.importer import LogImporter, parse_line
+
+LOG = (
+    '1.2.3.4 - - [10/Oct/2026:13:55:36 +0000] "GET /user/12 HTTP/1.1" 200 2326 "-" '
+    '"Mozilla/5.0 (X11; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0"\n'
+    '1.2.3.5 - - [10/Oct/2026:13:55:37 +0000] "GET / HTTP/1.1" 404 120 "-" "Googlebot/2.1"\n'
+    '1.2.3.5 - - [10/Oct/2026:13:55:38 +0000] "POST /statistics/_dash-update-component HTTP/1.1" 200 - "-" "-"\n'
+    'not a log line\n'
+)
+
+
+def test_parse_line():
+    hit = parse_line(LOG.splitlines()[0])
+    assert (hit["remote_address"], hit["method"], hit["path"], hit["status_code"], hit["size"]) == \
+        ("1.2.3.4", "GET", "/user/12", 200, 2326)
+    assert hit["browser"] == "firefox 89.0" and hit["platform"] == "linux"
+    assert hit["referrer"] is None
+    assert parse_line("not a log line") is None
+
+
+def test_import_file(make_stats, tmp_path):
+    stats = make_stats()
+    path = tmp_path / "access.log"
+    path.write_text(LOG)
+
+    with stats.app.app_context():
+        counters = LogImporter(stats, workers=0).import_file(str(path))
+        assert (counters["lines"], counters["imported"], counters["unparsed"], counters["ignored"]) == (4, 2, 1, 1)
+        hits = sorted((hit.path, hit.status_code, hit.is_bot) for hit in stats.model.query.all())
+        assert hits == [("/", 404, True), ("/user/12", 200, False)]
+
+        # Continues after the checkpoint
+        assert LogImporter(stats, workers=0).import_file(str(path))["imported"] == 0
+
+        # Overlapping logs only add the new hits
+        path.write_text(LOG + '1.2.3.6 - - [10/Oct/2026:13:56:00 +0000] "GET /new HTTP/1.1" 200 10 "-" "-"\n')
+        counters = LogImporter(stats, workers=0, dedup=True).import_file(str(path), restart=True)
+        assert (counters["duplicates"], counters["imported"]) == (2, 1)
+        assert stats.model.query.count() == 3
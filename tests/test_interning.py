@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+from Dash_statistics import interning
+
+from conftest import START, TODAY
+
+RANGES = [(TODAY, TODAY), (TODAY - datetime.timedelta(days=45), TODAY)]
+
+
+def answers(stats) -> list:
+    with stats.app.app_context():
+        return [(sorted(tuple(route) for route in stats.api.get_routes_data(start, end)),
+                 stats.api.get_statistic_data("browser", start, end),
+                 stats.api.get_number_of_unique_visitors(start, end),
+                 stats.api.get_user_chart_data(start, end, "/", "day"),
+                 stats.api.get_requests_page("/", start, end, ["date", "path", "browser", "user_country_name"],
+                                             sort_by=[("date", False)], filters=[("browser", "contains", "safari")]))
+                for start, end in RANGES]
+
+
+def test_normalized_hits_answer_like_plain_hits(make_stats):
+    plain, normalized = make_stats("plain", hits=3000), make_stats("normalized", normalized=True, hits=3000)
+    with normalized.app.app_context():
+        assert interning.is_normalized(normalized.api.engine(), "statistics")
+        # One id per distinct value
+        assert normalized.interner.model.query.filter_by(column_name="browser").count() == 3
+
+    assert answers(normalized) == answers(plain)
+
+
+def test_normalize_existing_table(make_stats, tmp_path):
+    database_uri = f"sqlite:///{tmp_path / 'hits.db'}"
+    wide = make_stats("wide", database_uri=database_uri, hits=2500)
+    expected = answers(wide)
+    with wide.app.app_context():
+        assert interning.is_normalized(wide.api.engine(), "statistics") is False
+
+    normalized = make_stats("normalized", database_uri=database_uri, normalized=True)
+    with normalized.app.app_context():
+        engine = normalized.api.engine()
+        assert interning.is_normalized(engine, "statistics")
+        assert {index["name"] for index in inspect(engine).get_indexes("statistics")} >= {"ix_statistics_path_date"}
+        assert "statistics_normalizing" not in inspect(engine).get_table_names()
+    assert answers(normalized) == expected
+    # Nothing left to convert
+    assert normalized.normalize() == []
+
+    with pytest.raises(RuntimeError):
+        make_stats("wide_again", database_uri=database_uri)
+
+
+def test_interner_ids_are_stable(make_stats):
+    stats = make_stats(normalized=True)
+    with stats.app.app_context():
+        ids = stats.interner.ids("path", ["/", "/a", None])
+        assert set(ids) == {"/", "/a"}
+        assert stats.interner.ids("path", ["/a", "/b"])["/a"] == ids["/a"]
+        assert stats.interner.ids("browser", ["/a"], create=False) == {}
+        assert stats.interner.decode([ids["/a"], None, ids["/"]]) == ["/a", None, "/"]
+        rows = [{"path": "/a", "browser": None, "date": START}]
+        assert stats.interner.decode_rows(stats.interner.encode_rows(rows)) == rows
@@ -0,0 +1,75 @@
+import datetime
+
+from Dash_statistics.live import LiveBuffer, minute_date
+
+from conftest import synthetic_hits
+
+NOW = 28000000
+
+
+def buffer_at(minute: int, **options) -> LiveBuffer:
+    buffer = LiveBuffer(**options)
+    buffer.current_minute = lambda: minute
+    return buffer
+
+
+def hit(minute: int, second: int = 0, **columns) -> dict:
+    return {"date": minute_date(minute) + datetime.timedelta(seconds=second), "path": f"/{minute}/{second}",
+            "status_code": 200, "response_time": 0.5, **columns}
+
+
+def test_since_wraps_around_the_ring():
+    buffer = buffer_at(NOW, capacity=4)
+    buffer.add([hit(NOW, second) for second in range(3)])
+    sequence, hits = buffer.since(0)
+    assert sequence == 3
+    assert [path for _, path, _, _ in hits] == ["/28000000/0", "/28000000/1", "/28000000/2"]
+
+    buffer.add([hit(NOW, second) for second in range(3, 10)])
+    # Only the last 4 hits are left, in order
+    sequence, hits = buffer.since(0)
+    assert sequence == 10
+    assert [path for _, path, _, _ in hits] == [f"/28000000/{second}" for second in range(6, 10)]
+    assert [date.second for date, _, _, _ in buffer.since(8)[1]] == [8, 9]
+    assert buffer.since(10) == (10, [])
+
+
+def test_minute_slots_are_reused():
+    buffer = buffer_at(NOW, minutes=5)
+    buffer.add([hit(NOW - 1), hit(NOW, response_time=0.25), hit(NOW, status_code=500)])
+    assert buffer.minute_counts(NOW - 3, NOW + 1) == [
+        (minute_date(NOW - 2), 0.0, 0.0, 0.0),
+        (minute_date(NOW - 1), 1.0, 0.0, 0.5),
+        (minute_date(NOW), 2.0, 1.0, 0.375)]
+
+    # 5 minutes later the minute takes the slot of NOW
+    buffer.current_minute = lambda: NOW + 5
+    buffer.add([hit(NOW + 5, sample_weight=3)])
+    counts = buffer.minute_counts(NOW - 10, NOW + 6)
+    assert [count[0] for count in counts] == [minute_date(minute) for minute in range(NOW + 1, NOW + 6)]
+    assert counts[-1] == (minute_date(NOW + 5), 3.0, 0.0, 0.5)
+    assert all(count[1] == 0 for count in counts[:-1])
+
+
+def test_old_hits_are_dropped():
+    buffer = buffer_at(NOW, minutes=5)
+    buffer.add([hit(NOW - 5), hit(NOW - 4), hit(NOW - 10, is_bot=False)])
+    sequence, hits = buffer.since(0)
+    assert sequence == 1
+    assert hits[0][1] == f"/{NOW - 4}/0"
+
+
+def test_live_buffer_of_the_writer(make_stats):
+    stats = make_stats(live_view=True, live_options={"capacity": 50}, exclude_bots=True)
+    now = datetime.datetime.utcnow()
+    rows = synthetic_hits(20, now - datetime.timedelta(minutes=10), now)
+    for row in rows[::2]:
+        row["is_bot"] = True
+    with stats.app.app_context():
+        stats.writer.write_many(rows)
+
+    sequence, hits = stats.live.since(0)
+    assert sequence == 10
+    assert [hit_path for _, hit_path, _, _ in hits] == [row["path"] for row in rows[1::2]]
+    minute = stats.live.current_minute()
+    assert sum(count[1] for count in stats.live.minute_counts(minute - 60, minute + 1)) == 10
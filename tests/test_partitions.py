@@ -0,0 +1,42 @@
+import datetime
+
+from conftest import TODAY
+
+RANGES = [(TODAY, TODAY), (TODAY - datetime.timedelta(days=45), TODAY)]
+
+
+def answers(stats) -> list:
+    with stats.app.app_context():
+        return [(stats.api.get_routes_data(start, end), stats.api.get_number_of_unique_visitors(start, end),
+                 stats.api.get_user_chart_data(start, end)) for start, end in RANGES]
+
+
+def test_partitions_answer_like_one_table(make_stats):
+    plain, partitioned = make_stats("plain", hits=3000), make_stats("partitioned", partitioning="month", hits=3000)
+    with partitioned.app.app_context():
+        assert len(partitioned.partitions.tables()) >= 2
+
+    assert answers(partitioned) == answers(plain)
+
+
+def test_retention_drops_old_partitions(make_stats):
+    stats = make_stats(partitioning="month", retention_months=0, hits=1000)
+    with stats.app.app_context():
+        months = list(stats.partitions.tables())
+        changes = stats.apply_retention()
+        assert len(changes) == len(months) - 1
+        assert list(stats.partitions.tables()) == months[-1:]
+
+
+def test_range_without_partitions(make_stats):
+    stats = make_stats(partitioning="month", columnar_archive="archive", hits=500)
+    start, end = TODAY - datetime.timedelta(days=400), TODAY - datetime.timedelta(days=370)
+    with stats.app.app_context():
+        assert stats.partitions.raw_tables(*(datetime.datetime.combine(day, datetime.time.min)
+                                             for day in (start, end))) == []
+        for api in (stats.api, stats.api.api):
+            assert api.get_routes_data(start, end) == []
+            assert api.get_number_of_unique_visitors(start, end) == 0
+            assert all(point["y"] == 0 for point in api.get_user_chart_data(start, end, granularity="day")[0])
+        assert list(stats.api.iter_requests(start, end, ["date", "path"])) == []
+        assert stats.api.get_requests_page("/", start, end, ["date", "path"])[0] == []
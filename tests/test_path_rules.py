@@ -0,0 +1,86 @@
+import re
+
+from Dash_statistics.path_rules import PathRules, _trie_pattern, normalize_template
+
+
+def test_rule_kinds():
+    rules = PathRules(exclude=["/static/", "glob:*.png", "regex:/api/v[0-9]+/health", "contains:_dash-layout"])
+    assert not rules.is_recorded("/static/app.js")
+    # * of a glob also matches /
+    assert not rules.is_recorded("/images/icons/logo.png")
+    # Regexes are matched at the start of the path
+    assert not rules.is_recorded("/api/v2/health")
+    assert rules.is_recorded("/v2/api/v2/health")
+    assert not rules.is_recorded("/statistics/_dash-layout")
+    assert rules.is_recorded("/")
+    assert rules.is_recorded("/png")
+
+    # Without a kind a rule is a prefix, regex characters are literals
+    assert PathRules(exclude=["/a.b"]).is_recorded("/aXb")
+
+
+def test_include_rules():
+    rules = PathRules(exclude=["/api/internal"], include=["/api/", "glob:/docs/*"])
+    assert rules.is_recorded("/api/users")
+    assert rules.is_recorded("/docs/index.html")
+    assert not rules.is_recorded("/")
+    assert not rules.is_recorded("/api/internal/jobs")
+    assert rules.stats()["not_included"] == 1
+
+
+def test_counters_per_rule():
+    rules = PathRules(exclude=["/static/", "glob:*.ico"], include=["/", "contains:user"])
+    for path in ("/static/a.css", "/static/b.css", "/favicon.ico", "/user/1", "/about"):
+        rules.is_recorded(path)
+    assert rules.stats() == {"not_included": 0,
+                             "excluded": {"/static/": 2, "glob:*.ico": 1},
+                             "included": {"/": 2, "contains:user": 0},
+                             "templated": {}}
+
+
+def test_prefixes_of_each_other():
+    pattern = re.compile(_trie_pattern({"/api": "short", "/api/v1": "long", "/apple": "other"}))
+    assert pattern.match("/api/v1/users").lastgroup == "short"
+    assert pattern.match("/apple/pie").lastgroup == "other"
+    assert pattern.match("/ap") is None
+
+    rules = PathRules(exclude=["/api/v1", "/api", "/app"])
+    assert not rules.is_recorded("/api/v1/users")
+    assert not rules.is_recorded("/api")
+    assert not rules.is_recorded("/application")
+    assert rules.is_recorded("/ap")
+    # A path is counted once, for the shortest matching prefix
+    assert rules.stats()["excluded"] == {"/api/v1": 0, "/api": 2, "/app": 1}
+
+
+def test_templates():
+    assert normalize_template("/user/<int:id>/posts/<string(length=2):lang>") == "/user/<id>/posts/<lang>"
+
+    rules = PathRules(templates=["/user/<int:id>", "/user/me", "/files/<path:name>", "/<page>"])
+    assert rules.template("/user/12") == "/user/<id>"
+    # The first matching template wins
+    assert rules.template("/user/me") == "/user/<id>"
+    assert rules.template("/files/a/b/c.txt") == "/files/<name>"
+    assert rules.template("/about") == "/<page>"
+    # <name> matches one segment, the whole path has to match
+    assert rules.template("/user/12/posts") == "/user/12/posts"
+    assert rules.template("/user/12/posts", url_rule="/user/<int:id>/posts") == "/user/<id>/posts"
+    assert rules.stats()["templated"] == {"/user/<id>": 2, "/user/me": 0, "/files/<name>": 1, "/<page>": 1}
+
+
+def test_hits_are_stored_with_templates(make_stats):
+    stats = make_stats(exclude_paths=["/health"], path_templates=["/user/<id>"], url_rule_templates=True)
+
+    @stats.app.route("/post/<int:post_id>")
+    def post(post_id):
+        return "post"
+
+    client = stats.app.test_client()
+    for path in ("/user/1", "/user/2", "/post/7", "/health", "/missing"):
+        client.get(path)
+
+    with stats.app.app_context():
+        assert sorted(hit.path for hit in stats.model.query.all()) == ["/missing", "/post/<post_id>", "/user/<id>",
+                                                                       "/user/<id>"]
+    assert stats.url_rule_for("/post/3") == "/post/<int:post_id>"
+    assert stats.url_rule_for("/nothing") is None
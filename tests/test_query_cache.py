@@ -0,0 +1,53 @@
+import datetime
+
+from Dash_statistics.query_cache import CachedStatisticsQueries
+
+from conftest import START, TODAY, synthetic_hits
+
+YESTERDAY = TODAY - datetime.timedelta(days=1)
+
+
+def test_ranges_with_today_follow_the_write_watermark(make_stats):
+    stats = make_stats(query_cache=True, query_cache_options={"watermark_ttl": 0}, hits=2000)
+    with stats.app.app_context():
+        counts = stats.api.get_statistic_data("method", START, TODAY)
+        assert stats.api.get_statistic_data("method", START, TODAY) == counts
+        assert stats.api.stats()["hits"] == 1
+
+        stats.writer.write_many([{"date": datetime.datetime.combine(TODAY, datetime.time(1)), "method": "PATCH",
+                                  "path": "/late", "remote_address": "10.0.0.1"}])
+        labels, values = stats.api.get_statistic_data("method", START, TODAY)
+        assert dict(zip(labels, values))["PATCH"] == 1
+        assert stats.api.stats()["misses"] == 2
+
+
+def test_disk_cache_is_shared(make_stats, tmp_path):
+    stats = make_stats(hits=500)
+    disk_path = str(tmp_path / "cache.db")
+    first, second = (CachedStatisticsQueries(stats.api, disk_path=disk_path) for _ in range(2))
+    with stats.app.app_context():
+        routes = first.get_routes_data(START, YESTERDAY)
+        assert second.get_routes_data(START, YESTERDAY) == routes
+
+    assert first.stats()["misses"] == 1
+    assert second.stats()["disk_hits"] == 1 and second.stats()["misses"] == 0
+
+
+def test_past_ranges_are_recomputed_after_late_writes(make_stats):
+    stats = make_stats(query_cache=True, query_cache_options={"watermark_ttl": 0}, hits=2000)
+    with stats.app.app_context():
+        counts = stats.api.get_statistic_data("method", START, YESTERDAY)
+        assert stats.api.get_statistic_data("method", START, YESTERDAY) == counts
+        assert stats.api.stats()["hits"] == 1
+
+        # Hits of today leave the cached results of past ranges alone
+        stats.writer.write_many(synthetic_hits(100, start=datetime.datetime.combine(TODAY, datetime.time.min),
+                                               seed=1))
+        assert stats.api.get_statistic_data("method", START, YESTERDAY) == counts
+        assert stats.api.stats()["hits"] == 2
+
+        late = datetime.datetime.combine(YESTERDAY, datetime.time(12))
+        stats.writer.write_many([{"date": late, "method": "PATCH", "path": "/late", "remote_address": "10.0.0.1"}])
+        labels, values = stats.api.get_statistic_data("method", START, YESTERDAY)
+        assert dict(zip(labels, values))["PATCH"] == 1
+        assert stats.api.stats()["misses"] == 2
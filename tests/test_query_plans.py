@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+from sqlalchemy import inspect, text
+
+from Dash_statistics import migrations
+from Dash_statistics.benchmarks.traffic import TrafficGenerator
+
+from conftest import END, START, TODAY
+
+INDEXES = {"ix_statistics_date", "ix_statistics_path_date", "ix_statistics_remote_address_date"}
+
+
+def check_query_plans(stats) -> None:
+    with stats.app.app_context():
+        # With table statistics, like a long running database, so the planner could prefer a scan
+        with stats.api.engine().begin() as connection:
+            connection.execute(text("ANALYZE"))
+        plans = migrations.query_plans(stats.api, TODAY - datetime.timedelta(days=6), TODAY, "/")
+
+    assert plans
+    for statement, plan in plans:
+        assert not any(line.startswith("SCAN") for line in plan), statement
+        assert any("USING INDEX ix_statistics_" in line or "USING COVERING INDEX ix_statistics_" in line
+                   for line in plan), statement
+        if "statistics.path = ?" in statement:
+            assert any("ix_statistics_path_date (path=?" in line for line in plan), statement
+
+
+def test_query_plans_use_indexes(make_stats):
+    check_query_plans(make_stats(hits=20000))
+
+
+def test_query_plans_of_a_large_table(make_stats, request):
+    """ The planner's choice depends on the table statistics, run with --plan-rows 5000000 for a realistic size """
+    rows = request.config.getoption("--plan-rows")
+    if not rows:
+        pytest.skip("needs --plan-rows")
+    stats = make_stats()
+    with stats.app.app_context():
+        for chunk in TrafficGenerator(START, END).hits(rows, chunk_size=50000):
+            stats.writer.write_many(chunk)
+    check_query_plans(stats)
+
+
+def test_migrate_creates_missing_indexes(make_stats):
+    stats = make_stats()
+    with stats.app.app_context():
+        engine = stats.api.engine()
+        with engine.begin() as connection:
+            for index in INDEXES:
+                connection.execute(text(f"DROP INDEX {index}"))
+
+    assert sorted(stats.migrate()) == sorted(f"created index {index}" for index in INDEXES)
+    with stats.app.app_context():
+        assert INDEXES <= {index["name"] for index in inspect(stats.api.engine()).get_indexes("statistics")}
+    assert stats.migrate() == []
@@ -0,0 +1,66 @@
+import datetime
+import logging
+
+from Dash_statistics.heavy_hitters import OTHER
+from Dash_statistics.render_context import RenderContext
+
+from conftest import TODAY, synthetic_hits
+
+COLUMNS = ["browser", "platform", "user_country_name"]
+
+
+def write_hits_without_values(stats) -> None:
+    rows = synthetic_hits(2000)
+    for row in rows[::3]:
+        row["browser"] = row["user_country_name"] = None
+    with stats.app.app_context():
+        stats.writer.write_many(rows)
+
+
+def test_breakdowns_match_get_statistic_data(make_stats):
+    stats = make_stats(rollups=True)
+    write_hits_without_values(stats)
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+    with stats.app.app_context():
+        for api in (stats.api, stats.api.__class__(stats.db, stats.model)):
+            expected = {column: api.get_statistic_data(column, start, end) for column in COLUMNS}
+            with RenderContext(api, start, end) as context:
+                assert context.statistic_breakdowns(COLUMNS) == expected
+
+
+def test_render_queries_are_shared_and_logged(make_stats, caplog):
+    stats = make_stats(hits=500)
+    logger = logging.getLogger("dash-statistics-test")
+    logger.setLevel(logging.DEBUG)
+    start, end = TODAY - datetime.timedelta(days=6), TODAY
+    with stats.app.app_context(), caplog.at_level(logging.DEBUG, logger.name):
+        with RenderContext(stats.api, start, end, logger=logger) as context:
+            routes = context.routes()
+            assert context.routes() is routes
+            context.unique_visitors()
+            context.statistic_breakdowns(COLUMNS)
+            context.statistic_breakdowns(COLUMNS)
+
+    assert len(context.queries) == 3
+    assert caplog.records[-1].getMessage().startswith("dash-statistics render of index")
+
+
+def test_top_values_match_get_statistic_data(make_stats):
+    stats = make_stats(top_value_sketches=True)
+    write_hits_without_values(stats)
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+    with stats.app.app_context():
+        expected = {column: dict(zip(*stats.api.get_statistic_data(column, start, end))) for column in COLUMNS}
+        for exact in (False, True):
+            for column in COLUMNS:
+                labels, values = stats.api.get_top_values(column, start, end, 2, exact)
+                assert None not in labels
+                assert sum(values) == sum(expected[column].values())
+                assert labels[:2] == sorted(expected[column], key=lambda label: expected[column][label] or 0,
+                                            reverse=True)[:2]
+                assert values[:2] == [expected[column][label] for label in labels[:2]]
+                assert labels[2:] in ([], [OTHER])
+        with RenderContext(stats.api, start, end, top_k=2) as context:
+            breakdowns = context.statistic_breakdowns(COLUMNS)
+        assert {column: sum(values) for column, (_, values) in breakdowns.items()} == \
+            {column: sum(counts.values()) for column, counts in expected.items()}
@@ -0,0 +1,90 @@
+import datetime
+
+from Dash_statistics import rollups
+
+from conftest import TODAY, synthetic_hits
+
+GRANULARITIES = ("hour", "day", "week", "month")
+RANGES = [(TODAY, TODAY), (TODAY - datetime.timedelta(days=6), TODAY), (TODAY - datetime.timedelta(days=45), TODAY)]
+
+
+def answers(stats) -> list:
+    with stats.app.app_context():
+        return [(stats.api.get_statistic_data("browser", start, end),
+                 {route.path: route.hits for route in stats.api.get_routes_data(start, end)},
+                 [stats.api.get_user_chart_data(start, end, "/", granularity)[0] for granularity in GRANULARITIES])
+                for start, end in RANGES]
+
+
+def test_rollups_answer_like_raw_hits(make_stats):
+    raw, rolled = make_stats("raw", hits=5000), make_stats("rolled", rollups=True, hits=5000)
+    with rolled.app.app_context():
+        assert rolled.api._rollup_bucket_size(TODAY - datetime.timedelta(days=6), TODAY) == "day"
+
+    assert answers(rolled) == answers(raw)
+
+
+def test_rebuild_rollups(make_stats):
+    stats = make_stats(rollups=True, hits=2000)
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+    with stats.app.app_context():
+        before = stats.api.get_statistic_data("platform", start, end)
+        assert stats.rollups.rebuild(500) == 2000
+        assert stats.api.get_statistic_data("platform", start, end) == before
+
+
+def test_missing_values_are_not_counted(make_stats):
+    raw, rolled = make_stats("raw"), make_stats("rolled", rollups=True)
+    rows = synthetic_hits(1000)
+    for row in rows[::4]:
+        row["browser"] = row["user_country_name"] = None
+    for stats in (raw, rolled):
+        with stats.app.app_context():
+            stats.writer.write_many([dict(row) for row in rows])
+
+    start, end = TODAY - datetime.timedelta(days=45), TODAY
+    with raw.app.app_context():
+        expected = {column: raw.api.get_statistic_data(column, start, end) for column in ("browser", "platform")}
+        assert expected["browser"][0][-1] is None and expected["browser"][1][-1] == 0
+        assert raw.api.get_statistic_breakdowns(["browser", "platform"], start, end) == expected
+    with rolled.app.app_context():
+        assert rolled.api.get_statistic_breakdowns(["browser", "platform"], start, end) == expected
+        assert rolled.api.get_statistic_data("browser", start, end) == expected["browser"]
+
+
+def test_rollups_without_upsert_clause(make_stats, monkeypatch):
+    monkeypatch.setattr(rollups, "UPSERT_DIALECTS", {})
+    raw, rolled = make_stats("raw", hits=300), make_stats("rolled", rollups=True, hits=300)
+    for stats in (raw, rolled):
+        with stats.app.app_context():
+            stats.writer.write_many(synthetic_hits(200, seed=1))
+
+    assert answers(rolled) == answers(raw)
+
+
+def test_rollups_estimate_unique_visitors(make_stats):
+    stats = make_stats(rollups=True, hits=5000)
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+    with stats.app.app_context():
+        exact = stats.api.get_number_of_unique_visitors(start, end, exact=True)
+        assert abs(stats.api.get_number_of_unique_visitors(start, end) - exact) <= 0.05 * exact
+
+        exact_routes = {route.path: route.unique_hits for route in stats.api.get_routes_data(start, end, exact=True)}
+        for route in stats.api.get_routes_data(start, end):
+            assert abs(route.unique_hits - exact_routes[route.path]) <= max(2, 0.05 * exact_routes[route.path])
+
+        exact_chart = stats.api.get_user_chart_data(start, end, "/", "week", exact=True)[1]
+        chart = stats.api.get_user_chart_data(start, end, "/", "week")[1]
+        assert [point["x"] for point in chart] == [point["x"] for point in exact_chart]
+        for point, exact_point in zip(chart, exact_chart):
+            assert abs(point["y"] - exact_point["y"]) <= max(2, 0.05 * exact_point["y"])
+
+
+def test_empty_range(make_stats):
+    raw, rolled = make_stats("raw", hits=300), make_stats("rolled", rollups=True, hits=300)
+    start, end = TODAY - datetime.timedelta(days=400), TODAY - datetime.timedelta(days=300)
+    for stats in (raw, rolled):
+        with stats.app.app_context():
+            # method isn't rolled up, so both read the raw table for it
+            assert stats.api.get_statistic_data("browser", start, end) == ([], [])
+            assert stats.api.get_statistic_data("method", start, end) == ([], [])
@@ -0,0 +1,89 @@
+import math
+
+from Dash_statistics import route_view
+
+from conftest import START, TODAY, synthetic_hits
+
+HITS = 2000
+COLUMNS = ["date", "status_code", "response_time", "browser"]
+
+
+def root_hits() -> list:
+    return [row for row in synthetic_hits(HITS) if row["path"] == "/"]
+
+
+def test_parse_filter_query():
+    assert route_view.parse_filter_query(
+        "{status_code} >= 400 && {browser} contains 'firefox 89.0' && {method} eq \"GET\"") == [
+        ("status_code", ">=", "400"), ("browser", "contains", "firefox 89.0"), ("method", "=", "GET")]
+    assert route_view.parse_filter_query("{date} datestartswith 2021-06") == [("date", "datestartswith", "2021-06")]
+
+
+def test_parse_filter_query_skips_bad_input():
+    assert route_view.parse_filter_query(None) == []
+    assert route_view.parse_filter_query("") == []
+    # Unknown operator, missing braces, missing value
+    assert route_view.parse_filter_query("{status_code} ~ 400 && status_code = 400 && {browser} =") == []
+    assert route_view.parse_filter_query("{status_code} ~ 400 && {status_code} < 300") == [("status_code", "<", "300")]
+
+
+def test_requests_page_sort_and_paging(make_stats):
+    stats = make_stats(hits=HITS)
+    expected = sorted(root_hits(), key=lambda row: row["response_time"], reverse=True)
+    with stats.app.app_context():
+        pages = []
+        for page in range(math.ceil(len(expected) / 50)):
+            rows, total = stats.api.get_requests_page("/", START.date(), TODAY, COLUMNS, page, 50,
+                                                      [("response_time", True)])
+            assert total == len(expected)
+            pages.extend(rows)
+        rows, _ = stats.api.get_requests_page("/", START.date(), TODAY, COLUMNS, len(pages) // 50 + 1, 50)
+        assert rows == []
+
+        # Newest first by default, only the requested columns
+        newest, _ = stats.api.get_requests_page("/", START.date(), TODAY, ["date"], 0, 5)
+
+    assert [row["response_time"] for row in pages] == [row["response_time"] for row in expected]
+    assert list(pages[0]) == COLUMNS
+    assert newest == [{"date": row["date"]} for row in sorted(expected, key=lambda row: row["date"])[:-6:-1]]
+
+
+def test_requests_page_filters(make_stats):
+    stats = make_stats(hits=HITS)
+    expected = [row for row in root_hits() if row["status_code"] >= 400 and "firefox" in row["browser"]]
+    with stats.app.app_context():
+        rows, total = stats.api.get_requests_page(
+            "/", START.date(), TODAY, COLUMNS, 0, 1000,
+            filters=[("status_code", ">=", "400"), ("browser", "contains", "firefox"), ("unknown", "=", "1"),
+                     ("method", "~", "GET")])
+
+    assert total == len(expected) == len(rows)
+    assert all(row["status_code"] == 404 and row["browser"].startswith("firefox") for row in rows)
+
+
+def test_table_data_pages(make_stats):
+    stats = make_stats(hits=HITS)
+    hits = root_hits()
+    with stats.app.app_context():
+        rows, page_count = route_view.table_data(stats.api, START.date(), TODAY, "/", page_size=25,
+                                                 sort_by=[{"column_id": "date", "direction": "asc"}])
+        _, filtered_page_count = route_view.table_data(stats.api, START.date(), TODAY, "/", page_size=25,
+                                                       filter_query="{status_code} = 999")
+
+    assert page_count == math.ceil(len(hits) / 25)
+    # An empty table still has one page
+    assert filtered_page_count == 1
+    assert len(rows) == 25
+    assert list(rows[0]) == list(route_view.COLUMN_NAMES)
+    assert rows[0]["date"] == min(row["date"] for row in hits).strftime("%H:%M:%S %Y-%m-%d")
+
+
+def test_table_data_leaves_cached_rows_alone(make_stats):
+    stats = make_stats(query_cache=True, hits=HITS)
+    with stats.app.app_context():
+        first, _ = route_view.table_data(stats.api, START.date(), TODAY, "/", page_size=25)
+        second, _ = route_view.table_data(stats.api, START.date(), TODAY, "/", page_size=25)
+    # The second page comes from the query cache, whose rows still hold datetimes
+    assert stats.api.hits == 1
+    assert second == first
+    assert isinstance(first[0]["date"], str)
@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from Dash_statistics.sampling import SamplingPolicy
+
+from conftest import TODAY, synthetic_hits
+
+
+def write_weighted_hits(stats, n: int = 2000) -> None:
+    """ Every other hit stands for two """
+    rows = synthetic_hits(n)
+    for i, row in enumerate(rows):
+        row["sample_weight"] = 2.0 if i % 2 else 1.0
+    with stats.app.app_context():
+        stats.writer.write_many(rows)
+
+
+def test_sampling_policy():
+    policy = SamplingPolicy(0.0, path_rates={"/api": 0.5, "/api/health": 1.0}, per_visitor=True)
+    assert policy.rate_for("/") == 0.0
+    assert policy.rate_for("/api/users") == 0.5
+    assert policy.rate_for("/api/health") == 1.0
+
+    assert policy.weight("/", "10.0.0.1", 200) is None
+    # Errors are always recorded
+    assert policy.weight("/", "10.0.0.1", 500) == 1.0
+    assert policy.weight("/api/health", "10.0.0.1", 200) == 1.0
+    # All or none of the hits of a visitor
+    weights = {policy.weight("/api/users", "10.0.0.2", 200) for _ in range(20)}
+    assert weights in ({None}, {2.0})
+    assert policy.stats()["skipped"] >= 1
+
+    with pytest.raises(ValueError):
+        SamplingPolicy(1.5)
+
+
+def test_weighted_estimates(make_stats):
+    raw = make_stats("raw", sampling=SamplingPolicy(0.5))
+    rolled = make_stats("rolled", rollups=True, sampling=SamplingPolicy(0.5))
+    start, end = TODAY - datetime.timedelta(days=30), TODAY
+    estimates = []
+    for stats in (raw, rolled):
+        write_weighted_hits(stats)
+        with stats.app.app_context():
+            estimates.append((stats.api.get_number_of_unique_visitors(start, end),
+                              {route.path: route.hits for route in stats.api.get_routes_data(start, end)},
+                              stats.api.get_statistic_data("browser", start, end),
+                              stats.api.get_user_chart_data(start, end, granularity="day"),
+                              stats.api.get_sampling_errors(start, end)))
+
+    assert estimates[1] == estimates[0]
+    _, routes, (_, browser_hits), _, errors = estimates[0]
+    assert sum(routes.values()) == sum(browser_hits)
+    assert errors["hits"] > 0 and errors["unique_visitors"] is None
+    lower = datetime.datetime.combine(start, datetime.time.min)
+    assert sum(browser_hits) == sum(2 if i % 2 else 1 for i, row in enumerate(synthetic_hits(2000))
+                                    if row["date"] >= lower)
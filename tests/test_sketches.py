@@ -0,0 +1,111 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from Dash_statistics.ddsketch import DDSketch
+from Dash_statistics.heavy_hitters import OTHER, HeavyHitters, top_with_other
+from Dash_statistics.hyperloglog import HyperLogLog
+from Dash_statistics.sampling import SamplingPolicy
+
+from conftest import TODAY
+
+START_DATE = TODAY - datetime.timedelta(days=30)
+
+
+def sketch_of(items) -> HyperLogLog:
+    sketch = HyperLogLog()
+    for item in items:
+        sketch.add(item)
+    return sketch
+
+
+def test_hyperloglog_merge_and_bytes():
+    first = sketch_of(f"10.0.0.{i}" for i in range(20000))
+    second = sketch_of(f"10.0.0.{i}" for i in range(10000, 30000))
+    assert abs(first.count() - 20000) <= 0.05 * 20000
+
+    merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+    assert abs(merged.count() - 30000) <= 0.05 * 30000
+    # Small counts are exact enough to compare
+    assert round(sketch_of(["a", "b", "c", "a"]).count()) == 3
+
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=10))
+
+
+def test_unique_visitor_sketches(make_stats):
+    stats = make_stats(unique_visitors="sketch", hits=5000)
+    with stats.app.app_context():
+        exact = stats.api.get_number_of_unique_visitors(START_DATE, TODAY, exact=True)
+        estimate = stats.api.get_number_of_unique_visitors(START_DATE, TODAY)
+        assert abs(estimate - exact) <= 0.05 * exact
+
+
+def test_ddsketch_quantiles():
+    values = np.random.default_rng(0).lognormal(-3.5, 1.0, 20000)
+    first, second = DDSketch(), DDSketch()
+    first.add_many(values[:10000])
+    second.add_many(values[10000:])
+    merged = DDSketch.from_bytes(first.to_bytes()).merge(second)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = np.quantile(values, q)
+        assert abs(merged.quantile(q) - exact) <= 0.02 * exact
+    assert DDSketch().quantiles([0.5]) == [None]
+
+
+def test_response_time_percentiles(make_stats):
+    stats = make_stats(response_time_percentiles=True, hits=5000)
+    with stats.app.app_context():
+        sketched = (stats.api.get_response_time_percentiles(START_DATE, TODAY),
+                    stats.api.get_route_percentiles(START_DATE, TODAY))
+        stats.api.latency_sketches = None
+        exact = (stats.api.get_response_time_percentiles(START_DATE, TODAY),
+                 stats.api.get_route_percentiles(START_DATE, TODAY))
+    assert len(sketched[0]) == len(exact[0])
+    for estimate, value in zip(sketched[0], exact[0]):
+        assert abs(estimate - value) <= 0.02 * value
+    assert sketched[1].keys() == exact[1].keys()
+
+
+def test_heavy_hitters_bounds():
+    values = np.random.default_rng(0).zipf(1.5, 20000) % 5000
+    exact = dict(zip(*np.unique(values, return_counts=True)))
+    first, second = HeavyHitters(50), HeavyHitters(50)
+    for value in values[:10000].tolist():
+        first.add(value)
+    for value in values[10000:].tolist():
+        second.add(value)
+    merged = HeavyHitters.from_bytes(first.to_bytes()).merge(second)
+
+    assert merged.total == 20000
+    for value, count in merged.top(10):
+        assert exact[value] - merged.error <= count <= exact[value]
+    assert [value for value, _ in merged.top(3)] == sorted(exact, key=exact.get, reverse=True)[:3]
+
+
+def test_top_with_other():
+    assert top_with_other([("a", 5), ("b", 7), ("c", 1)], 20, 2) == (["b", "a", OTHER], [7, 5, 8])
+    assert top_with_other([("a", 5), ("b", 7)], 12, 2) == (["b", "a"], [7, 5])
+
+
+def test_top_value_sketches(make_stats):
+    stats = make_stats(top_value_sketches=True, hits=5000)
+    with stats.app.app_context():
+        sketched = stats.api.get_top_values("browser", START_DATE, TODAY, k=2)
+        exact = stats.api.get_top_values("browser", START_DATE, TODAY, k=2, exact=True)
+    assert sketched == exact
+    assert sketched[0][-1] == OTHER
+
+
+def test_response_time_bins_of_the_database(make_stats):
+    for name, options in (("plain", {}), ("sampled", {"sampling": SamplingPolicy(rate=0.5)})):
+        stats = make_stats(name, hits=5000, **options)
+        with stats.app.app_context():
+            assert stats.api._has_logarithms()
+            binned = (stats.api.get_route_percentiles(START_DATE, TODAY),
+                      stats.api.get_response_time_percentiles(START_DATE, TODAY))
+            stats.api._logarithms = False
+            assert (stats.api.get_route_percentiles(START_DATE, TODAY),
+                    stats.api.get_response_time_percentiles(START_DATE, TODAY)) == binned
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from Dash_statistics.spool import SpoolAggregator, decode_hit, encode_hit
+
+from conftest import END, START, synthetic_hits
+
+
+def test_encode_hit():
+    row = synthetic_hits(1)[0]
+    decoded = decode_hit(encode_hit(row))
+    assert decoded["date"] == row["date"]
+    assert all(value == row.get(column) for column, value in decoded.items())
+
+
+def test_aggregator_stores_spooled_hits(make_stats):
+    stats = make_stats(writer_mode="spool", rollups=True)
+    for row in synthetic_hits(1200):
+        stats.writer.write(row)
+    stats.writer.close()
+
+    aggregator = SpoolAggregator(stats, batch_size=500, geo=False)
+    aggregator.acquire()
+    with pytest.raises(RuntimeError):
+        SpoolAggregator(stats).acquire()
+
+    batches = []
+    while not batches or batches[-1]:
+        batches.append(aggregator.drain())
+    assert batches == [500, 500, 200, 0]
+    assert aggregator.metrics()["hits"] == 1200
+    # Sealed and completely stored files are removed
+    assert not [name for name in os.listdir(aggregator.directory) if name.endswith((".spool", ".sealed"))]
+    with stats.app.app_context():
+        assert stats.model.query.count() == 1200
+        assert sum(stats.api.get_statistic_data("browser", START.date(), END.date())[1]) == 1200
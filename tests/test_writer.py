@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from Dash_statistics import writer
+from Dash_statistics.writer import BufferedWriter
+
+from conftest import synthetic_hits
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def stored(stats) -> int:
+    with stats.app.app_context():
+        return stats.model.query.count()
+
+
+class Gate:
+    """ Batch hook holding the writer thread until it is opened """
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.opened = threading.Event()
+
+    def __call__(self, session, rows):
+        self.entered.set()
+        self.opened.wait(5)
+
+
+def test_flush_by_batch_size(make_stats):
+    stats = make_stats()
+    buffered = BufferedWriter(stats.app, stats.db, stats.model, batch_size=10, flush_interval=60000)
+    for row in synthetic_hits(25):
+        buffered.write(row)
+
+    assert wait_for(lambda: buffered.stats()["flushed"] == 20)
+    time.sleep(0.1)
+    # The last 5 rows wait for a full batch or the interval
+    assert buffered.stats()["flushed"] == 20
+    buffered.flush()
+    assert buffered.stats() == {"queued": 25, "flushed": 25, "dropped": 0, "failed": 0}
+    assert stored(stats) == 25
+    buffered.close()
+
+
+def test_flush_by_interval(make_stats):
+    stats = make_stats()
+    buffered = BufferedWriter(stats.app, stats.db, stats.model, batch_size=1000, flush_interval=50)
+    started = time.monotonic()
+    for row in synthetic_hits(3):
+        buffered.write(row)
+
+    assert wait_for(lambda: buffered.stats()["flushed"] == 3)
+    assert time.monotonic() - started >= 0.05
+    assert stored(stats) == 3
+    buffered.close()
+
+
+def test_drop_while_full(make_stats):
+    stats = make_stats()
+    buffered = BufferedWriter(stats.app, stats.db, stats.model, batch_size=1, max_queue=5, overflow="drop")
+    gate = Gate()
+    buffered.batch_hooks.append(gate)
+
+    rows = synthetic_hits(10)
+    buffered.write(rows[0])
+    assert gate.entered.wait(5)
+    # The writer thread holds the first row, the queue takes 5 more
+    for row in rows[1:]:
+        buffered.write(row)
+    assert buffered.stats()["queued"] == 6
+    assert buffered.stats()["dropped"] == 4
+
+    gate.opened.set()
+    buffered.flush()
+    assert buffered.stats()["flushed"] == 6
+    assert stored(stats) == 6
+    buffered.close()
+
+
+def test_block_while_full(make_stats):
+    stats = make_stats()
+    buffered = BufferedWriter(stats.app, stats.db, stats.model, batch_size=1, max_queue=2, overflow="block")
+    gate = Gate()
+    buffered.batch_hooks.append(gate)
+
+    rows = synthetic_hits(5)
+    buffered.write(rows[0])
+    assert gate.entered.wait(5)
+    producer = threading.Thread(target=lambda: [buffered.write(row) for row in rows[1:]])
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+
+    gate.opened.set()
+    producer.join(5)
+    assert not producer.is_alive()
+    buffered.flush()
+    assert buffered.stats() == {"queued": 5, "flushed": 5, "dropped": 0, "failed": 0}
+    buffered.close()
+
+
+def test_close_flushes_and_is_registered_at_exit(make_stats, monkeypatch):
+    registered = []
+    monkeypatch.setattr(writer.atexit, "register", registered.append)
+    stats = make_stats()
+    buffered = BufferedWriter(stats.app, stats.db, stats.model, batch_size=1000, flush_interval=60000)
+    assert registered == [buffered.close]
+
+    for row in synthetic_hits(7):
+        buffered.write(row)
+    buffered.close()
+    assert not buffered._thread.is_alive()
+    assert buffered.stats()["flushed"] == 7
+    assert stored(stats) == 7
+    # Closing twice is harmless, e.g. explicitly and at exit
+    buffered.close()
+
+
+def test_unknown_overflow_policy(make_stats):
+    stats = make_stats()
+    with pytest.raises(ValueError):
+        BufferedWriter(stats.app, stats.db, stats.model, overflow="wait")
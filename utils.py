@@ -1,9 +1,15 @@
 import dash_table
 import pandas as pd
-from .StatisticsQueries import StatisticsQueries
+from .StatisticsQueries import date_bounds
+from .charts import Charts
+from .ddsketch import PERCENTILES
+from .render_context import RenderContext
 import dash_core_components as dcc
-from datetime import datetime, date, timedelta
+from datetime import datetime
 import dash_html_components as html
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import current_app
 
 import plotly.graph_objects as go
 
@@ -53,57 +59,164 @@ def header(path: str, dash_prefix: str):
 
 
 def initial_date(api):
-    query = (api.db.session.query(api.model.date).filter(api.model.index == 1))
-    return query.all()[0][0]
-
-
-def hits_chart(api, start_date: datetime, end_date: datetime, path: str = None, plot_title: str = "Total Hits"):
-    user_chart_data = api.get_user_chart_data(start_date, end_date, path)
-    hits_y = [kv["y"] for kv in user_chart_data[0]]
-    hits_x = [kv["x"] for kv in user_chart_data[0]]
-
-    unique_y = [kv["y"] for kv in user_chart_data[1]]
-    unique_x = [kv["x"] for kv in user_chart_data[1]]
-
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=hits_x, y=hits_y, name="Hits",
-                             hovertemplate="%{x} || Hits: %{y}"))
-    fig.add_trace(go.Scatter(x=unique_x, y=unique_y, name="Unique Hits",
-                             hovertemplate="%{x} || Unique Hits: %{y}"))
-
-    CONF = {
-        "plot_bgcolor": "white",
-        "paper_bgcolor": "white",
-        "xaxis": {"color": "Gray", "fixedrange": True},
-        "yaxis": {"color": "Gray", "visible": True, "fixedrange": True}
-    }
-
-    fig.update_layout(title=plot_title,
-                      xaxis_title='Date',
-                      yaxis_title='Number of Hits',
-                      legend=dict(
-                          orientation="h",
-                          y=0,
-                      ),
-                      margin=dict(
-                          l=0,
-                          r=0,
-                          b=0,
-                          t=50,
-                          pad=0
-                      )
-                      )
-    fig.update_xaxes(tickformat="%b %e\n%Y", fixedrange=True)
-    fig.update_yaxes(fixedrange=True)
-
-    limited_interactions_config = {"scrollZoom": True, "dragMode": False,
-                                   'modeBarButtonsToRemove': ["zoom2d", "zoomIn2d", "zoomOut2d"]}
+    return api.get_first_date()
+
+
+def hits_title(context: RenderContext) -> str:
+    if context.path is None:
+        return "Total Hits"
+    title = f"Total Hits for {context.path}"
+    errors = context.sampling_errors()
+    if errors is not None:
+        title += f" (sampled, ± {errors['hits']:.0f} hits in total)"
+    return title
+
+
+def hits_figure(context: RenderContext, plot_title: str = "Total Hits", granularity: str = None) -> dict:
+    """ Figure of the hits and unique hits of the context's date range and path, downsampled and cached by
+        context.charts
+    """
+    lower, upper = date_bounds(context.start_date, context.end_date)
+    if granularity is None:
+        granularity = context.charts.granularity(lower, upper)
+
+    def build():
+        user_chart_data = context.user_chart_data(granularity)
+        hits = context.charts.downsample(user_chart_data[0])
+        unique = context.charts.downsample(user_chart_data[1])
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=[kv["x"] for kv in hits], y=[kv["y"] for kv in hits], name="Hits",
+                                 hovertemplate="%{x} || Hits: %{y}"))
+        fig.add_trace(go.Scatter(x=[kv["x"] for kv in unique], y=[kv["y"] for kv in unique], name="Unique Hits",
+                                 hovertemplate="%{x} || Unique Hits: %{y}"))
+
+        fig.update_layout(title=plot_title,
+                          xaxis_title='Date',
+                          yaxis_title='Number of Hits',
+                          legend=dict(
+                              orientation="h",
+                              y=0,
+                          ),
+                          margin=dict(
+                              l=0,
+                              r=0,
+                              b=0,
+                              t=50,
+                              pad=0
+                          ),
+                          # Keeps the zoom while the zoomed window is fetched
+                          uirevision=context.path or "",
+                          dragmode="zoom"
+                          )
+        fig.update_xaxes(tickformat="%H:%M\n%b %e %Y" if granularity in ("minute", "hour") else "%b %e\n%Y")
+        fig.update_yaxes(fixedrange=True)
+        return fig
+
+    return context.charts.figure(context.api, ("hits", lower, upper, context.path, granularity, plot_title), upper,
+                                 build)
+
+
+def hits_chart(context: RenderContext, plot_title: str = "Total Hits", granularity: str = None):
+    """ Chart of the hits and unique hits of the context's date range and path. Zooming in fetches the zoomed window
+        at a finer granularity, see chart_callbacks.
+    """
+    limited_interactions_config = {"scrollZoom": True,
+                                   'modeBarButtonsToRemove': ["zoomIn2d", "zoomOut2d", "select2d", "lasso2d"]}
 
     return html.Div(className="row justify-content-md-center", children=[
         html.Div(className="col-md-10", children=[
             html.Div(className="card", children=[
                 html.Div(className="card-body px-1", children=[
-                    dcc.Graph(figure=fig, config=limited_interactions_config)
+                    dcc.Graph(id="hits-chart", figure=hits_figure(context, plot_title, granularity),
+                              config=limited_interactions_config)
+                ])
+            ])
+        ])
+    ])
+
+
+def zoomed_range(relayout_data: dict, lower: datetime, upper: datetime):
+    """ [lower, upper) narrowed to the x axis range of a graph's relayoutData, None if it wasn't zoomed """
+    if "xaxis.range[0]" in relayout_data and "xaxis.range[1]" in relayout_data:
+        zoomed = [relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]]
+    elif "xaxis.range" in relayout_data:
+        zoomed = relayout_data["xaxis.range"]
+    else:
+        return None
+    zoomed_lower, zoomed_upper = (pd.Timestamp(value).to_pydatetime() for value in zoomed)
+    zoomed_lower, zoomed_upper = max(lower, zoomed_lower), min(upper, zoomed_upper)
+    return (zoomed_lower, zoomed_upper) if zoomed_lower < zoomed_upper else None
+
+
+def chart_callbacks(app, api, charts: Charts):
+    """ Re-fetches the hits chart of the index and route view for the zoomed window, at the finest granularity the
+        charts' bucket budget allows for it. Resetting the zoom fetches the whole date range again.
+    """
+
+    @app.callback(
+        Output("hits-chart", "figure"),
+        [Input("hits-chart", "relayoutData"),
+         State('startdate-input', 'value'),
+         State('enddate-input', 'value'),
+         State("url", "search")]
+    )
+    def zoom(relayout_data, start_date, end_date, search):
+        if not relayout_data or not ("xaxis.autorange" in relayout_data or any(
+                key.startswith("xaxis.range") for key in relayout_data)):
+            raise PreventUpdate
+
+        path = search.split("?path=")[1] if search and "?path=" in search else None
+        lower, upper = date_bounds(datetime.strptime(start_date, "%Y-%m-%d").date(),
+                                   datetime.strptime(end_date, "%Y-%m-%d").date())
+        zoomed = zoomed_range(relayout_data, lower, upper)
+        granularity = None
+        if zoomed is not None:
+            granularity = charts.granularity(*zoomed)
+            lower, upper = charts.window(*zoomed, granularity)
+
+        with RenderContext(api, lower, upper, path, logger=current_app.logger, charts=charts) as context:
+            return hits_figure(context, hits_title(context), granularity)
+
+
+def percentile_label(quantile: float) -> str:
+    return f"p{quantile * 100:g}"
+
+
+def response_time_chart(context: RenderContext, plot_title: str = "Response Times", granularity: str = None):
+    """ Chart of the response time percentiles of the context's date range and path """
+    lower, upper = date_bounds(context.start_date, context.end_date)
+    if granularity is None:
+        granularity = context.charts.granularity(lower, upper)
+
+    def build():
+        chart_data = context.charts.downsample(context.response_time_chart_data(granularity))
+        x = [point["x"] for point in chart_data]
+
+        fig = go.Figure()
+        for i, quantile in enumerate(PERCENTILES):
+            name = percentile_label(quantile)
+            fig.add_trace(go.Scatter(x=x, y=[point["y"][i] for point in chart_data], name=name, connectgaps=False,
+                                     hovertemplate="%{x} || " + name + ": %{y:.4f} s"))
+
+        fig.update_layout(title=plot_title,
+                          xaxis_title='Date',
+                          yaxis_title='Response time in [s]',
+                          legend=dict(orientation="h", y=0),
+                          margin=dict(l=0, r=0, b=0, t=50, pad=0))
+        fig.update_xaxes(tickformat="%H:%M\n%b %e %Y" if granularity in ("minute", "hour") else "%b %e\n%Y",
+                         fixedrange=True)
+        fig.update_yaxes(fixedrange=True)
+        return fig
+
+    figure = context.charts.figure(context.api, ("response_times", lower, upper, context.path, granularity,
+                                                 plot_title), upper, build)
+
+    return html.Div(className="row justify-content-md-center", children=[
+        html.Div(className="col-md-10", children=[
+            html.Div(className="card", children=[
+                html.Div(className="card-body px-1", children=[
+                    dcc.Graph(figure=figure, config={"scrollZoom": True, "dragMode": False})
                 ])
             ])
         ])
@@ -152,6 +265,49 @@ def stats_table(data, data_labels):
     ])
 
 
+def paged_stats_table(table_id: str, column_names: dict, page_size: int = 50):
+    """ DataTable whose paging, sorting and filtering is done by a callback on the server (see route_view)
+
+        :param column_names: {"column_name": "displayed title"}, the column names are the ids of the table columns
+    """
+    return html.Div(className="row justify-content-md-center", children=[
+        html.Div(className="col-md-10", style={"overflow-x": "auto"}, children=[
+            dash_table.DataTable(
+                id=table_id,
+                columns=[
+                    {'name': title, "id": column, "type": 'text', "presentation": 'markdown'}
+                    for column, title in column_names.items()],
+
+                style_cell={
+                    'textAlign': 'left',
+                    'font-family': "arial",
+                },
+                style_header={
+                    'fontWeight': 'bold'
+                },
+                style_data_conditional=[{
+                    "if": {
+                        'column_id': ["URL", "path"]
+                    },
+                    'overflow': 'hidden',
+                    'textOverflow': 'ellipsis',
+                    'maxWidth': 350,
+                }],
+
+                page_current=0,
+                page_size=page_size,
+                page_action="custom",
+                filter_action="custom",
+                filter_query="",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+
+            )
+        ])
+    ])
+
+
 def search_section(api, start_date: datetime, end_date: datetime):
     return html.Div(className="search_section", children=[
         html.Div(className="input-form-column", children=[
@@ -207,11 +363,11 @@ def data_to_pie_chart(data):
     return dcc.Graph(figure=fig, responsive=True)
 
 
-def basic_stats(api: StatisticsQueries, start_date: datetime, end_date: datetime, data_columns: dict = None):
+def basic_stats(context: RenderContext, data_columns: dict = None):
     """ Generate basic stats, including text and chart statistics
 
 
-        @param api: reference to StatisticsQueries object
+        @param context: RenderContext of the date range
         @param data_columns: Dictionary specifying which database columns and what title should be displayed as a pie chart 
         {{column_name: chart_title}}. Example: {{'browser': "Browser"}}. Default: 
         {{"browser": "Browser", "user_country_name": "Country Name", "platform": "Platform"}}
@@ -221,21 +377,28 @@ def basic_stats(api: StatisticsQueries, start_date: datetime, end_date: datetime
         data_columns = {"browser": "Browser", "user_country_name": "Country Name", "platform": "Platform"}
         # Default data columns
 
-    routes = api.get_routes_data(start_date,
-                                 end_date)
-    hits = sum([route.hits for route in routes])
-    unique_users = api.get_number_of_unique_visitors(start_date,
-                                                     end_date)
+    routes = context.routes()
+    hits = context.total_hits()
+    unique_users = context.unique_visitors()
     url_most_frequent = routes[0]
+    breakdowns = context.statistic_breakdowns(list(data_columns))
+
+    # Estimates of sampled hits come with their error bounds
+    hits_error, unique_error = [], []
+    errors = context.sampling_errors()
+    if errors is not None:
+        hits_error = [f"± {errors['hits']:.0f} (95%), sampled"]
+        if errors["unique_visitors"] is not None:
+            unique_error = [f"± {errors['unique_visitors']:.0f} (95%), sampled"]
 
     return html.Div(id="statistics", style={"margin": "25px 0"}, children=[
         html.Div(id="basic_stats", style={"margin": "25px 5px"}, children=[
             html.Div(id="basic_stats_container", className="row", children=[
                 html.Div(className="col-sm", children=[
-                    card(f"{hits}", "Total Hits"),
+                    card(f"{hits}", "Total Hits", *hits_error),
                 ]),
                 html.Div(className="col-sm", children=[
-                    card(f"{unique_users}", "Total Unique Hits", ),
+                    card(f"{unique_users}", "Total Unique Hits", *unique_error),
                 ]),
                 html.Div(className="col-sm", children=[
                     card(f"{url_most_frequent[0]}", "Most clicked URL"),
@@ -251,7 +414,7 @@ def basic_stats(api: StatisticsQueries, start_date: datetime, end_date: datetime
                         html.Div(className="card-body h100", children=[
                             html.H4(f"{data_columns[column_name]} Pie Chart", className="card-title"),
                             html.Div(className="pie-chart-wrapper h100 py-1", children=[
-                                data_to_pie_chart(api.get_statistic_data(column_name))
+                                data_to_pie_chart(breakdowns[column_name])
                             ])
                         ])
                     ])
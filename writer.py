@@ -0,0 +1,166 @@
+import atexit
+import queue
+import threading
+import time
+from typing import Callable, List
+
+from flask_sqlalchemy import Model, SQLAlchemy
+
+_STOP = object()
+_FLUSH = object()
+
+
+class SyncWriter:
+    """ Stores every hit in its own transaction on the thread that served the request """
+
+    def __init__(self, app, db: SQLAlchemy, model: Model):
+        self.app = app
+        self.db = db
+        self.model = model
+
+        # Called as hook(session, rows) inside the transaction of every written batch
+        self.batch_hooks = []
+        # Monthly partitions the hits are inserted into instead of the model's table, if enabled
+        self.partitions = None
+        # Lookup table of the normalized columns, if enabled
+        self.interner = None
+        # Pipeline deriving browser, platform, geo data, ... of the hits passed to write()
+        self.enrichment = None
+
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def write(self, obj: dict) -> None:
+        with self._lock:
+            self.queued += 1
+        if self.enrichment is not None:
+            self.enrichment.enrich([obj])
+        self.write_many([obj])
+
+    def write_many(self, rows: List[dict], before_commit: Callable = None) -> None:
+        """ Bulk insert rows and run the batch hooks in a single transaction
+
+            :param before_commit: called as before_commit(session) after the hooks, e.g. to store a checkpoint
+        """
+        session = self.db.session
+        try:
+            # The hooks get the rows as written, the table the ids of their values
+            stored = rows if self.interner is None else self.interner.encode_rows(rows)
+            if self.partitions is not None:
+                self.partitions.insert(session, stored)
+            else:
+                session.bulk_insert_mappings(self.model, stored)
+            for hook in self.batch_hooks:
+                hook(session, rows)
+            if before_commit is not None:
+                before_commit(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self._lock:
+                self.failed += len(rows)
+            raise
+
+        with self._lock:
+            self.flushed += len(rows)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self.queued, "flushed": self.flushed, "dropped": self.dropped, "failed": self.failed}
+
+
+class BufferedWriter(SyncWriter):
+    """ Puts hits on a bounded queue which a background thread writes in batches
+
+        :param batch_size: flush as soon as this many rows are buffered
+        :param flush_interval: flush at the latest this many milliseconds after the first buffered row
+        :param max_queue: maximum number of rows waiting to be written
+        :param overflow: "drop" discards (and counts) hits while the queue is full, "block" waits for free space
+    """
+
+    def __init__(self, app, db: SQLAlchemy, model: Model, batch_size: int = 500, flush_interval: int = 1000,
+                 max_queue: int = 10000, overflow: str = "drop"):
+        super().__init__(app, db, model)
+
+        if overflow not in ("drop", "block"):
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="dash-statistics-writer", daemon=True)
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def write(self, obj: dict) -> None:
+        try:
+            self._queue.put(obj, block=self.overflow == "block")
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+
+        with self._lock:
+            self.queued += 1
+
+    def flush(self) -> None:
+        """ Write everything that is currently buffered and wait until it is stored """
+        if self._thread.is_alive():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self) -> None:
+        """ Flush the remaining rows and stop the background thread """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = []
+            done = 1
+            deadline = time.monotonic() + self.flush_interval / 1000
+
+            while item is not _STOP and item is not _FLUSH:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                done += 1
+
+            if batch:
+                self._write_batch(batch)
+            for _ in range(done):
+                self._queue.task_done()
+
+            if item is _STOP:
+                return
+
+    def _write_batch(self, batch: List[dict]) -> None:
+        with self.app.app_context():
+            try:
+                if self.enrichment is not None:
+                    self.enrichment.enrich(batch)
+                self.write_many(batch)
+            except Exception as e:
+                self.app.logger.warning("Error in dash-statistics writer: " + str(e))